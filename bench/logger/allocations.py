@@ -0,0 +1,87 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+"""
+LogMessage 的内存占用 和 格式化时的临时内存分配
+python bench/logger/allocations.py
+"""
+
+import sys
+import time
+import inspect
+import tracemalloc
+
+from pathlib import Path
+
+# 直接在源码目录里运行
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src"))
+
+from lib_not_dr.loggers.structure import LogMessage  # noqa: E402
+from lib_not_dr.loggers.formatter import StdFormatter  # noqa: E402
+
+COUNT = 10000
+
+
+def make_message() -> LogMessage:
+    return LogMessage(
+        messages=("hello", 1),
+        logger_name="bench",
+        logger_tag="tag",
+        stack_trace=inspect.currentframe(),
+    )
+
+
+def retained_per_message() -> dict:
+    """
+    保留 COUNT 条消息, 计算每条消息占用的 内存块数 / 字节数
+    """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    messages = [make_message() for _ in range(COUNT)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    del messages
+    return {
+        "blocks_per_message": round(blocks / COUNT, 2),
+        "bytes_per_message": round(size / COUNT, 1),
+    }
+
+
+def format_peak(outputs: int) -> dict:
+    """
+    同一条消息被 outputs 个 formatter 格式化时 临时分配的峰值内存
+    """
+    formatters = [StdFormatter() for _ in range(outputs)]
+    message = make_message()
+    for formatter in formatters:
+        formatter.format_message(message)  # 预热 (编译模板)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    for formatter in formatters:
+        formatter.format_message(message)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for _ in range(COUNT):
+        message = make_message()
+        for formatter in formatters:
+            formatter.format_message(message)
+    used = time.perf_counter() - start
+    return {
+        "outputs": outputs,
+        "peak_bytes": peak,
+        "us_per_message": round(used / COUNT * 1e6, 3),
+    }
+
+
+if __name__ == "__main__":
+    print("retained", retained_per_message())
+    for outputs in (1, 3):
+        print("format", format_peak(outputs))
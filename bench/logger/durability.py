@@ -0,0 +1,88 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+"""
+FileCacheOutputStream 各个持久化模式的 吞吐量 / 单次调用延迟
+python bench/logger/durability.py [directory] [messages per thread]
+directory 默认是临时目录 (如果是 tmpfs, fsync 几乎没有开销, 最好指定一个真实磁盘上的目录)
+"""
+
+import sys
+import time
+import tempfile
+import threading
+
+from pathlib import Path
+from typing import List
+
+# 直接在源码目录里运行
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src"))
+
+from lib_not_dr.loggers import LogLevel  # noqa: E402
+from lib_not_dr.loggers.structure import LogMessage  # noqa: E402
+from lib_not_dr.loggers.formatter import StdFormatter  # noqa: E402
+from lib_not_dr.loggers.outstream import FileCacheOutputStream  # noqa: E402
+
+CASES = {
+    "none": {"durability": "none"},
+    "periodic (1s)": {"durability": "periodic", "fsync_interval": 1.0},
+    "none + durable error": {"durability": "none", "durable_level": LogLevel.error},
+    "group": {"durability": "group"},
+}
+
+
+def percentile(values: List[int], percent: float) -> float:
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def run(directory: Path, options: dict, threads_count: int, count: int) -> dict:
+    output = FileCacheOutputStream(
+        formatter=StdFormatter(enable_color=False),
+        file_path=directory,
+        file_name="bench.log",
+        flush_count_limit=100,
+        **options,
+    )
+    latencies: List[List[int]] = [[] for _ in range(threads_count)]
+
+    def worker(index: int) -> None:
+        own = latencies[index]
+        for i in range(count):
+            # 每 100 条有一条 error
+            message = LogMessage(
+                messages=["message", i, "from", index],
+                level=LogLevel.error if i % 100 == 99 else LogLevel.info,
+            )
+            start = time.perf_counter_ns()
+            output.write_stdout(message)
+            own.append(time.perf_counter_ns() - start)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(threads_count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    output.close()
+    used = time.perf_counter() - start
+    (directory / "bench.log").unlink()
+    merged = sorted(value for own in latencies for value in own)
+    total = threads_count * count
+    return {
+        "threads": threads_count,
+        "msgs_per_sec": round(total / used),
+        "p50_us": round(percentile(merged, 50) / 1000, 1),
+        "p99_us": round(percentile(merged, 99) / 1000, 1),
+        "max_us": round(merged[-1] / 1000, 1),
+    }
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    with tempfile.TemporaryDirectory(dir=sys.argv[1] if len(sys.argv) > 1 else None) as log_dir:
+        for name, options in CASES.items():
+            for threads_count in (1, 8):
+                print(f"{name:<22}", run(Path(log_dir), options, threads_count, count))
@@ -0,0 +1,74 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+"""
+JsonFormatter 和 StdFormatter 的吞吐量对比
+python bench/logger/json_formatter.py
+"""
+
+import sys
+import time
+import inspect
+
+from pathlib import Path
+
+# 直接在源码目录里运行
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src"))
+
+from lib_not_dr.loggers.structure import LogMessage  # noqa: E402
+from lib_not_dr.loggers.formatter import (  # noqa: E402
+    BaseFormatter,
+    StdFormatter,
+    JsonFormatter,
+    orjson,
+)
+
+COUNT = 100000
+
+
+def make_messages() -> list:
+    frame = inspect.currentframe()
+    return [
+        LogMessage(
+            messages=["request", i, 'done with "status"', "ok"],
+            logger_name="bench",
+            logger_tag="http" if i % 2 else None,
+            stack_trace=frame,
+        )
+        for i in range(1000)
+    ]
+
+
+def throughput(formatter: BaseFormatter, messages: list) -> dict:
+    """
+    格式化 COUNT 条消息, 计算每秒条数
+    """
+    for message in messages:
+        formatter.format_message(message)  # 预热
+    start = time.perf_counter()
+    size = 0
+    for _ in range(COUNT // len(messages)):
+        for message in messages:
+            size += len(formatter.format_message(message))
+    used = time.perf_counter() - start
+    return {
+        "msgs_per_sec": round(COUNT / used),
+        "us_per_message": round(used / COUNT * 1e6, 3),
+        "bytes_per_message": round(size / COUNT, 1),
+    }
+
+
+if __name__ == "__main__":
+    messages = make_messages()
+    cases = {
+        "StdFormatter (color)": StdFormatter(),
+        "StdFormatter (no color)": StdFormatter(enable_color=False),
+        "JsonFormatter (json)": JsonFormatter(serializer="json"),
+    }
+    if orjson is not None:
+        cases["JsonFormatter (orjson)"] = JsonFormatter(serializer="orjson")
+    for name, formatter in cases.items():
+        print(f"{name:<24}", throughput(formatter, messages))
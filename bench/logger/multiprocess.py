@@ -0,0 +1,69 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+"""
+多进程日志汇总的吞吐量测试
+python bench/logger/multiprocess.py [workers] [messages per worker]
+"""
+
+import sys
+import time
+import tempfile
+import multiprocessing
+
+from pathlib import Path
+
+# 直接在源码目录里运行
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src"))
+
+from lib_not_dr.loggers.logger import Logger  # noqa: E402
+from lib_not_dr.loggers.outstream import FileCacheOutputStream  # noqa: E402
+from lib_not_dr.loggers.multiprocess import (  # noqa: E402
+    LogAggregator,
+    ProcessOutputStream,
+)
+
+
+def worker(output: ProcessOutputStream, index: int, count: int) -> None:
+    logger = Logger(outputs=[output], logger_name=f"worker-{index}")
+    for i in range(count):
+        logger.info("message", i, "from worker", index)
+
+
+def run(workers: int, count: int) -> dict:
+    with tempfile.TemporaryDirectory() as log_dir:
+        file_output = FileCacheOutputStream(
+            file_path=Path(log_dir), file_name="bench.log", flush_count_limit=1000
+        )
+        aggregator = LogAggregator(outputs=[file_output])
+        start = time.perf_counter()
+        with aggregator:
+            child_output = aggregator.make_output()
+            processes = [
+                multiprocessing.Process(target=worker, args=(child_output, index, count))
+                for index in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        used = time.perf_counter() - start
+        file_output.close()
+        lines = (Path(log_dir) / "bench.log").read_text(encoding="utf-8").splitlines()
+    total = workers * count
+    return {
+        "workers": workers,
+        "messages": total,
+        "lines": len(lines),
+        "seconds": round(used, 4),
+        "messages_per_sec": round(total / used),
+    }
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    print(run(workers, count))
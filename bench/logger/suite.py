@@ -0,0 +1,291 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+"""
+日志的 吞吐量 / 单次调用延迟 基准测试 (和标准库 logging 对比)
+python bench/logger/suite.py [--count N] [--threads 1 4] [--filter NAME]
+                             [--output results.json] [--baseline old.json]
+
+每个用例先不计时单次调用跑一遍算 msgs/sec, 再逐次用 perf_counter_ns 计时算 p50 / p99
+stdout 在测试的时候被重定向到 os.devnull, 文件写在临时目录里
+结果写成 JSON, 指定 --baseline 的时候打印和之前结果的比值
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import tempfile
+import threading
+
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 直接在源码目录里运行
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src"))
+
+from lib_not_dr.loggers import LogLevel  # noqa: E402
+from lib_not_dr.loggers.logger import Logger  # noqa: E402
+from lib_not_dr.loggers.structure import LogMessage  # noqa: E402
+from lib_not_dr.loggers.formatter import StdFormatter, JsonFormatter  # noqa: E402
+from lib_not_dr.loggers.outstream import StdioOutputStream, FileCacheOutputStream  # noqa: E402
+
+# 用例: 名字 -> 构造函数 (临时目录 -> (每次调用的函数, 结束时调用的函数))
+Case = Callable[[Path], Tuple[Callable[[int], Any], Callable[[], Any]]]
+CASES: Dict[str, Case] = {}
+
+
+def case(name: str) -> Callable[[Case], Case]:
+    def register(function: Case) -> Case:
+        CASES[name] = function
+        return function
+
+    return register
+
+
+def make_logger(*outputs, level: int = LogLevel.info) -> Logger:
+    return Logger(logger_name="bench", outputs=list(outputs), level=level)
+
+
+def make_stdlib(name: str, handler: Optional[logging.Handler], level: int = logging.INFO):
+    logger = logging.getLogger(f"bench.{name}")
+    logger.handlers.clear()
+    logger.propagate = False
+    logger.setLevel(level)
+    if handler is not None:
+        handler.setFormatter(
+            logging.Formatter("[%(asctime)s][%(levelname)s]|%(name)s|%(message)s")
+        )
+        logger.addHandler(handler)
+    return logger
+
+
+def close_handlers(logger: logging.Logger) -> None:
+    for handler in logger.handlers:
+        handler.close()
+    logger.handlers.clear()
+
+
+@case("stdio")
+def stdio(path: Path):
+    output = StdioOutputStream()
+    logger = make_logger(output)
+    return lambda i: logger.info("request", i, "done"), output.close
+
+
+@case("stdio.no_color")
+def stdio_no_color(path: Path):
+    output = StdioOutputStream(formatter=StdFormatter(enable_color=False))
+    logger = make_logger(output)
+    return lambda i: logger.info("request", i, "done"), output.close
+
+
+@case("stdio.buffered")
+def stdio_buffered(path: Path):
+    output = StdioOutputStream(buffered=True)
+    logger = make_logger(output)
+    return lambda i: logger.info("request", i, "done"), output.close
+
+
+@case("stdio.disabled")
+def stdio_disabled(path: Path):
+    output = StdioOutputStream()
+    logger = make_logger(output)
+    return lambda i: logger.debug("request", i, "done"), output.close
+
+
+@case("file")
+def file(path: Path):
+    output = FileCacheOutputStream(file_path=path, file_name="file.log")
+    logger = make_logger(output)
+    return lambda i: logger.info("request", i, "done"), output.close
+
+
+@case("file.json")
+def file_json(path: Path):
+    output = FileCacheOutputStream(
+        file_path=path, file_name="file.json.log", formatter=JsonFormatter()
+    )
+    logger = make_logger(output)
+    return lambda i: logger.info("request", i, "done"), output.close
+
+
+@case("file.disabled")
+def file_disabled(path: Path):
+    output = FileCacheOutputStream(file_path=path, file_name="file.disabled.log")
+    logger = make_logger(output)
+    return lambda i: logger.debug("request", i, "done"), output.close
+
+
+@case("formatter.std")
+def formatter_std(path: Path):
+    formatter = StdFormatter()
+    message = LogMessage(messages=["request", 1, "done"], logger_name="bench")
+    return lambda i: formatter.format_message(message), lambda: None
+
+
+@case("formatter.std.no_color")
+def formatter_std_no_color(path: Path):
+    formatter = StdFormatter(enable_color=False)
+    message = LogMessage(messages=["request", 1, "done"], logger_name="bench")
+    return lambda i: formatter.format_message(message), lambda: None
+
+
+@case("formatter.json")
+def formatter_json(path: Path):
+    formatter = JsonFormatter()
+    message = LogMessage(messages=["request", 1, "done"], logger_name="bench")
+    return lambda i: formatter.format_message(message), lambda: None
+
+
+@case("stdlib.stream")
+def stdlib_stream(path: Path):
+    logger = make_stdlib("stream", logging.StreamHandler(sys.stdout))
+    return lambda i: logger.info("request %s done", i), lambda: close_handlers(logger)
+
+
+@case("stdlib.stream.disabled")
+def stdlib_stream_disabled(path: Path):
+    logger = make_stdlib("stream.disabled", logging.StreamHandler(sys.stdout))
+    return lambda i: logger.debug("request %s done", i), lambda: close_handlers(logger)
+
+
+@case("stdlib.file")
+def stdlib_file(path: Path):
+    logger = make_stdlib("file", logging.FileHandler(path / "stdlib.log", encoding="utf-8"))
+    return lambda i: logger.info("request %s done", i), lambda: close_handlers(logger)
+
+
+@case("stdlib.formatter")
+def stdlib_formatter(path: Path):
+    formatter = logging.Formatter("[%(asctime)s][%(levelname)s]|%(name)s|%(message)s")
+    record = logging.LogRecord("bench", logging.INFO, __file__, 0, "request %s done", (1,), None)
+    return lambda i: formatter.format(record), lambda: None
+
+
+def percentile(values: List[int], percent: float) -> int:
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def run_threads(threads_count: int, target: Callable[[int], Any]) -> float:
+    """
+    在 threads_count 个线程里同时运行 target(index), 返回总耗时
+    """
+    barrier = threading.Barrier(threads_count + 1)
+
+    def worker(index: int) -> None:
+        barrier.wait()
+        target(index)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def measure(name: str, path: Path, threads_count: int, count: int) -> Dict[str, Any]:
+    call, close = CASES[name](path)
+    for i in range(min(count, 1000)):
+        call(i)  # 预热
+
+    def loop(_: int) -> None:
+        for i in range(count):
+            call(i)
+
+    used = run_threads(threads_count, loop)
+
+    latencies: List[List[int]] = [[] for _ in range(threads_count)]
+    timer = time.perf_counter_ns
+
+    def timed(index: int) -> None:
+        own = latencies[index]
+        append = own.append
+        for i in range(count):
+            start = timer()
+            call(i)
+            append(timer() - start)
+
+    run_threads(threads_count, timed)
+    close()
+    merged = sorted(value for own in latencies for value in own)
+    return {
+        "name": name,
+        "threads": threads_count,
+        "count": count * threads_count,
+        "msgs_per_sec": round(count * threads_count / used),
+        "p50_ns": percentile(merged, 50),
+        "p99_ns": percentile(merged, 99),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any]) -> None:
+    """
+    打印 和 baseline 的比值 (>1 表示变快了)
+    """
+    old = {(item["name"], item["threads"]): item for item in baseline["results"]}
+    print(f"\n{'case':<28}{'threads':>8}{'msgs/sec':>12}{'p50':>10}{'p99':>10}")
+    for item in results:
+        if (before := old.get((item["name"], item["threads"]))) is None:
+            continue
+        print(
+            f"{item['name']:<28}{item['threads']:>8}"
+            f"{item['msgs_per_sec'] / before['msgs_per_sec']:>11.2f}x"
+            f"{before['p50_ns'] / max(item['p50_ns'], 1):>9.2f}x"
+            f"{before['p99_ns'] / max(item['p99_ns'], 1):>9.2f}x"
+        )
+
+
+def main(args: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="lib-not-dr logger benchmark suite")
+    parser.add_argument("--count", type=int, default=20000, help="calls per thread")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--filter", default="", help="only run cases containing this text")
+    parser.add_argument("--output", default="bench-results.json", help="JSON result file")
+    parser.add_argument("--baseline", default=None, help="previous JSON result to compare")
+    options = parser.parse_args(args)
+
+    results = []
+    stdout = sys.stdout
+    with tempfile.TemporaryDirectory() as log_dir, open(os.devnull, "w") as devnull:
+        for name in CASES:
+            if options.filter not in name:
+                continue
+            for threads_count in options.threads:
+                sys.stdout = devnull
+                try:
+                    result = measure(name, Path(log_dir), threads_count, options.count)
+                finally:
+                    sys.stdout = stdout
+                results.append(result)
+                print(
+                    f"{name:<28}{threads_count:>3} threads"
+                    f"{result['msgs_per_sec']:>12} msgs/s"
+                    f"  p50 {result['p50_ns'] / 1000:>8.2f}us"
+                    f"  p99 {result['p99_ns'] / 1000:>8.2f}us"
+                )
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "count": options.count,
+        "results": results,
+    }
+    Path(options.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if options.baseline is not None:
+        compare(results, json.loads(Path(options.baseline).read_text(encoding="utf-8")))
+    return report
+
+
+if __name__ == "__main__":
+    main()
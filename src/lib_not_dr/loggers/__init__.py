@@ -106,6 +106,12 @@ if TYPE_CHECKING:
     from lib_not_dr.loggers import formatter
     from lib_not_dr.loggers import outstream
     from lib_not_dr.loggers import structure
+    from lib_not_dr.loggers import multiprocess
+    from lib_not_dr.loggers import binary
+    from lib_not_dr.loggers import ratelimit
+    from lib_not_dr.loggers import rotation
+    from lib_not_dr.loggers import mmaplog
+    from lib_not_dr.loggers import timing
 
 __all__ = [
     # modules
@@ -113,6 +119,12 @@ __all__ = [
     'formatter',
     'outstream',
     'structure',
+    'multiprocess',
+    'binary',
+    'ratelimit',
+    'rotation',
+    'mmaplog',
+    'timing',
     'config',
     # class
     'LogLevel',
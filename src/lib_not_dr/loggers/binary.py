@@ -0,0 +1,313 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+"""
+二进制日志格式
+写日志的时候只写入 LogMessage 的原始字段, 等到真的有人要看的时候再格式化
+
+文件结构:
+    每一段 (每次打开文件写入) 以 header 开头: b"LNDL" + 版本号(u8)
+    之后是一条条的记录: 类型(u8) + 长度(u32) + 内容
+    - RECORD_STRING  : id(u32) + utf-8 字符串 (logger 名 / tag / 文件名 / 函数名 / end)
+    - RECORD_MESSAGE : level(i32) time_ns(i64) flags(u8) logger_name(u32) logger_tag(u32)
+                       end(u32) split 之后的消息在最后 (utf-8)
+                       如果有堆栈信息: file(u32) line(u32) function(u32) 在消息之前
+    字符串 id 只在同一段里有效
+    重新打开文件写入的时候, 末尾不完整的记录 (写入的时候崩溃了) 会先被截掉
+
+python -m lib_not_dr.loggers.binary <file> [--template TEMPLATE] [--color]
+"""
+
+import sys
+import atexit
+import struct
+import argparse
+import threading
+
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Union
+
+from lib_not_dr.loggers import LogLevel
+from lib_not_dr.loggers.structure import LogMessage, FrameInfo
+from lib_not_dr.loggers.outstream import BaseOutputStream
+from lib_not_dr.loggers.formatter import BaseFormatter, StdFormatter
+
+__all__ = [
+    "BinaryFileOutputStream",
+    "BinaryLogReader",
+    "MAGIC",
+    "VERSION",
+]
+
+MAGIC = b"LNDL"
+VERSION = 1
+
+RECORD_STRING = 1
+RECORD_MESSAGE = 2
+
+FLAG_FLUSH_SET = 0b0001
+FLAG_FLUSH = 0b0010
+FLAG_TAG = 0b0100
+FLAG_TRACE = 0b1000
+
+_record_head = struct.Struct("<BI")
+_string_head = struct.Struct("<I")
+_message_head = struct.Struct("<iqBIII")
+_trace_head = struct.Struct("<III")
+
+
+def complete_size(file: BinaryIO) -> int:
+    """
+    找到文件里最后一条完整记录的结尾 (只读记录头, 跳过内容)
+    :param file: seekable binary file object
+    :return: 完整部分的长度
+    """
+    total = file.seek(0, 2)
+    end = file.seek(0)
+    while end + _record_head.size <= total:
+        head = file.read(_record_head.size)
+        following = end + _record_head.size
+        if head[: len(MAGIC)] != MAGIC:
+            following += _record_head.unpack(head)[1]
+        if following > total:
+            break
+        end = file.seek(following)
+    return end
+
+
+class BinaryFileOutputStream(BaseOutputStream):
+    """
+    以二进制格式写入 LogMessage 的 output
+    不做任何格式化, 用 BinaryLogReader 或者命令行读取
+    """
+
+    name = "BinaryFileOutputStream"
+
+    level: int = LogLevel.info
+    file_path: Path = Path("./logs")
+    file_name: str = "log.lndl"
+    # 是否记录堆栈信息 (文件名 / 行号 / 函数名)
+    save_trace: bool = True
+    # 写入缓冲区大小
+    buffer_size: int = 64 * 1024
+    # 等级 >= flush_level 的消息会立刻写入磁盘
+    flush_level: int = LogLevel.error
+
+    file: Optional[BinaryIO] = None
+
+    def init(self, **kwargs) -> bool:
+        self._lock = threading.Lock()
+        self._strings: Dict[str, int] = {}
+        return False
+
+    @property
+    def required_fields(self) -> None:
+        return None
+
+    @property
+    def need_stack_trace(self) -> bool:
+        return self.save_trace
+
+    def _open(self) -> BinaryIO:
+        file = Path(self.file_path) / self.file_name
+        file.parent.mkdir(parents=True, exist_ok=True)
+        if file.exists():
+            with file.open("r+b") as f:
+                # 上次写入的时候崩溃了, 先把不完整的记录截掉
+                # 不然新的一段会被当成这条记录的一部分读出来
+                size = complete_size(f)
+                if size < file.stat().st_size:
+                    f.truncate(size)
+        self.file = file.open("ab", buffering=self.buffer_size)
+        # 新的一段, 字符串表重新开始
+        self._strings = {}
+        self.file.write(MAGIC + bytes((VERSION,)))
+        atexit.register(self.flush)
+        return self.file
+
+    def _intern(self, file: BinaryIO, text: str) -> int:
+        """
+        获取字符串的 id, 第一次出现的时候写入字符串记录
+        """
+        if (index := self._strings.get(text)) is not None:
+            return index
+        index = self._strings[text] = len(self._strings) + 1
+        data = text.encode("utf-8")
+        file.write(_record_head.pack(RECORD_STRING, _string_head.size + len(data)))
+        file.write(_string_head.pack(index))
+        file.write(data)
+        return index
+
+    def _write(self, message: LogMessage) -> None:
+        text = message.format_text().encode("utf-8")
+        flags = 0
+        if message.flush is not None:
+            flags |= FLAG_FLUSH_SET
+            if message.flush:
+                flags |= FLAG_FLUSH
+        if message.logger_tag is not None:
+            flags |= FLAG_TAG
+        trace = message.stack_trace if self.save_trace else None
+        if trace is not None:
+            flags |= FLAG_TRACE
+        with self._lock:
+            file = self.file if self.file is not None else self._open()
+            name_id = self._intern(file, message.logger_name)
+            tag_id = 0
+            if message.logger_tag is not None:
+                tag_id = self._intern(file, message.logger_tag)
+            end_id = self._intern(file, message.end)
+            body = _message_head.pack(
+                message.level, int(message.log_time), flags, name_id, tag_id, end_id
+            )
+            if trace is not None:
+                body += _trace_head.pack(
+                    self._intern(file, trace.f_code.co_filename),
+                    trace.f_lineno or 0,
+                    self._intern(file, trace.f_code.co_name),
+                )
+            file.write(_record_head.pack(RECORD_MESSAGE, len(body) + len(text)))
+            file.write(body)
+            file.write(text)
+            if message.flush or message.level >= self.flush_level:
+                file.flush()
+        return None
+
+    def write_stdout(self, message: LogMessage) -> None:
+        if not self.enable:
+            return None
+        if message.level < self.level:
+            return None
+        self._write(message)
+        return None
+
+    def write_stderr(self, message: LogMessage) -> None:
+        if not self.enable:
+            return None
+        if message.level < self.level:
+            return None
+        self._write(message)
+        return None
+
+    def flush(self) -> None:
+        with self._lock:
+            if self.file is not None:
+                self.file.flush()
+        return None
+
+    def close(self) -> None:
+        super().close()
+        with self._lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        atexit.unregister(self.flush)
+        return None
+
+
+class BinaryLogReader:
+    """
+    流式读取 BinaryFileOutputStream 写出的文件
+    """
+
+    def __init__(self, file: Union[str, Path, BinaryIO]) -> None:
+        """
+        :param file: path or a binary file object
+        """
+        self.file = file
+
+    def __iter__(self) -> Iterator[LogMessage]:
+        if isinstance(self.file, (str, Path)):
+            with open(self.file, "rb") as file:
+                yield from self.read(file)
+        else:
+            yield from self.read(self.file)
+
+    @staticmethod
+    def read(file: BinaryIO) -> Iterator[LogMessage]:
+        """
+        Decode messages from a binary file
+        文件末尾不完整的记录 (比如写入的时候崩溃了) 会被忽略
+        :param file: binary file object
+        :return: messages
+        """
+        strings: List[Optional[str]] = [None]
+        while True:
+            # header 和记录头一样都是 5 byte
+            head = file.read(_record_head.size)
+            if len(head) < _record_head.size:
+                return
+            if head[: len(MAGIC)] == MAGIC:
+                # 新的一段, 字符串表重新开始
+                if head[len(MAGIC)] != VERSION:
+                    raise ValueError(f"unsupported binary log version {head[len(MAGIC)]}")
+                strings = [None]
+                continue
+            record_type, size = _record_head.unpack(head)
+            data = file.read(size)
+            if len(data) < size:
+                return
+            if record_type == RECORD_STRING:
+                (index,) = _string_head.unpack_from(data)
+                # id 是连续的
+                del strings[index:]
+                strings.append(data[_string_head.size :].decode("utf-8"))
+                continue
+            if record_type != RECORD_MESSAGE:
+                # 未知的记录类型, 跳过
+                continue
+            level, log_time, flags, name_id, tag_id, end_id = _message_head.unpack_from(data)
+            offset = _message_head.size
+            trace = None
+            if flags & FLAG_TRACE:
+                file_id, line, function_id = _trace_head.unpack_from(data, offset)
+                offset += _trace_head.size
+                trace = FrameInfo.from_tuple((strings[file_id], line, strings[function_id]))
+            yield LogMessage(
+                messages=[data[offset:].decode("utf-8")],
+                end=strings[end_id],  # type: ignore
+                flush=bool(flags & FLAG_FLUSH) if flags & FLAG_FLUSH_SET else None,
+                level=level,
+                log_time=log_time,
+                logger_name=strings[name_id],  # type: ignore
+                logger_tag=strings[tag_id] if flags & FLAG_TAG else None,
+                stack_trace=trace,
+            )
+
+    def render(self, formatter: Optional[BaseFormatter] = None) -> Iterator[str]:
+        """
+        Render every message with a formatter
+        :param formatter: formatter to use (default: StdFormatter without color)
+        :return: formatted messages
+        """
+        if formatter is None:
+            formatter = StdFormatter(enable_color=False)
+        for message in self:
+            yield formatter.format_message(message)
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m lib_not_dr.loggers.binary",
+        description="render a lib-not-dr binary log file",
+    )
+    parser.add_argument("file", help="binary log file")
+    parser.add_argument("--template", default=None, help="template of StdFormatter")
+    parser.add_argument("--color", action="store_true", help="enable color")
+    parser.add_argument("--level", type=int, default=0, help="only show messages >= level")
+    options = parser.parse_args(args)
+
+    formatter = StdFormatter(enable_color=options.color)
+    if options.template is not None:
+        formatter.template = options.template
+    for message in BinaryLogReader(options.file):
+        if message.level >= options.level:
+            sys.stdout.write(formatter.format_message(message))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,12 @@
 #  All rights reserved
 #  -------------------------------
 
-from typing import List, Set, Dict, Optional, Tuple
+from typing import List, Set, Dict, Optional, Tuple, Union
 
 from lib_not_dr.loggers.logger import Logger
 from lib_not_dr.loggers.formatter import BaseFormatter
 from lib_not_dr.loggers.outstream import BaseOutputStream
+from lib_not_dr.loggers.ratelimit import RateLimitRule, RateLimiter
 from lib_not_dr.loggers import formatter, outstream, LogLevel
 from lib_not_dr.types.options import Options, OptionNameNotDefined
 
@@ -20,10 +21,12 @@ class ConfigStorage(Options):
     loggers: Dict[str, Logger] = {}
     formatters: Dict[str, BaseFormatter] = {}
     outputs: Dict[str, BaseOutputStream] = {}
+    rate_limits: Dict[str, RateLimitRule] = {}
     # 存储失败的 logger, formatter, output 的字典
     fail_loggers: Dict[str, dict] = {}
     fail_formatters: Dict[str, dict] = {}
     fail_outputs: Dict[str, dict] = {}
+    fail_rate_limits: Dict[str, dict] = {}
 
     log: Logger = Logger(logger_name="loggers-storage")
 
@@ -36,6 +39,9 @@ class ConfigStorage(Options):
     def have_logger(self, logger_name: str) -> bool:
         return logger_name in self.loggers
 
+    def have_rate_limit(self, rule_name: str) -> bool:
+        return rule_name in self.rate_limits
+
     def merge_storage(self, other_storage: "ConfigStorage") -> None:
         """
         Merge storage
@@ -45,9 +51,11 @@ class ConfigStorage(Options):
         self.loggers.update(other_storage.loggers)
         self.formatters.update(other_storage.formatters)
         self.outputs.update(other_storage.outputs)
+        self.rate_limits.update(other_storage.rate_limits)
         self.fail_loggers.update(other_storage.fail_loggers)
         self.fail_formatters.update(other_storage.fail_formatters)
         self.fail_outputs.update(other_storage.fail_outputs)
+        self.fail_rate_limits.update(other_storage.fail_rate_limits)
 
     # by GitHub Copilot
     @classmethod
@@ -268,6 +276,63 @@ class ConfigStorage(Options):
         self.merge_storage(env)
         return None
 
+    def parse_rate_limit(self, rate_limit_config: Dict[str, dict]) -> None:
+        """
+        Parse rate limit rule config
+        :param rate_limit_config: config of rate limit rules
+        :return:
+        """
+        env = ConfigStorage()
+        for rule_name, config in rate_limit_config.items():
+            if "max_level_name" in config:
+                config["max_level"] = LogLevel.parse_name_level(config.pop("max_level_name"))
+            try:
+                rule_instance = RateLimitRule(**config)
+            except OptionNameNotDefined as e:
+                self.log.error(
+                    f"RateLimit {rule_name} init failed, ignored\n" f"Error: {e}"
+                )
+                env.fail_rate_limits[rule_name] = config
+                continue
+            env.rate_limits[rule_name] = rule_instance
+        self.merge_storage(env)
+        return None
+
+    def parse_logger_rate_limit(
+        self, logger_name: str, rate_limit_config: Union[List[str], dict]
+    ) -> Optional[RateLimiter]:
+        """
+        Build the RateLimiter of a logger
+        :param logger_name: name of the logger
+        :param rate_limit_config: list of rule names or {"rules": [...], **RateLimiter options}
+        :return: RateLimiter (None if failed)
+        """
+        if isinstance(rate_limit_config, dict):
+            config = dict(rate_limit_config)
+        else:
+            config = {"rules": rate_limit_config}
+        rules = []
+        for rule_name in config.get("rules", []):
+            if self.rate_limits.get(rule_name) is None:
+                if self.fail_rate_limits.get(rule_name) is None:
+                    self.log.error(
+                        f"Logger {logger_name} rate limit {rule_name} not found, ignored"
+                    )
+                else:
+                    self.log.error(
+                        f"Logger {logger_name} require a fail rate limit {rule_name}, ignored"
+                    )
+                return None
+            rules.append(self.rate_limits[rule_name])
+        config["rules"] = rules
+        try:
+            return RateLimiter(**config)
+        except OptionNameNotDefined as e:
+            self.log.error(
+                f"Logger {logger_name} rate limit init failed, ignored\n" f"Error: {e}"
+            )
+            return None
+
     def parse_logger(self, logger_config: Dict[str, dict]) -> None:
         """
         Parse loggers config
@@ -295,6 +360,12 @@ class ConfigStorage(Options):
                 config["level"] = level
             if "level_name" in config:
                 config.pop("level_name")
+            if "rate_limit" in config:
+                rate_limit = self.parse_logger_rate_limit(logger_name, config["rate_limit"])
+                if rate_limit is None:
+                    env.fail_loggers[logger_name] = config
+                    continue
+                config["rate_limit"] = rate_limit
             # init logger
             try:
                 logger_instance = Logger(**config)
@@ -317,6 +388,7 @@ class ConfigStorage(Options):
         """
         self.parse_formatter(config.get("Formatter", {}))
         self.parse_output(config.get("Outstream", {}))
+        self.parse_rate_limit(config.get("RateLimit", {}))
         self.parse_logger(config.get("Logger", {}))
 
 
@@ -4,19 +4,55 @@
 #  All rights reserved
 #  -------------------------------
 import time
+import codecs
 
+from time import perf_counter_ns
+from bisect import bisect_left, bisect_right
+from json import encoder as json_encoder
 from pathlib import Path
-from string import Template
-from typing import List, Union, Optional, TYPE_CHECKING
+from string import Template, Formatter
+from typing import Any, Callable, Dict, FrozenSet, List, Union, Optional, Tuple, TYPE_CHECKING
 
 from lib_not_dr.loggers import LogLevel
 from lib_not_dr.types.options import Options
-from lib_not_dr.loggers.structure import LogMessage, FormattingMessage
+from lib_not_dr.loggers.structure import (
+    LogMessage,
+    FormattingMessage,
+    LogConfigVersion,
+    STACK_TRACE_FIELDS,
+)
+from lib_not_dr.loggers.formatter.template import CompiledTemplate
+from lib_not_dr.loggers.timing import StageTimer, pipeline_timer, timed
 
 if TYPE_CHECKING:
     from lib_not_dr.loggers.formatter.colors import BaseColorFormatter
 
-__all__ = ["BaseFormatter", "MainFormatter", "StdFormatter"]
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ["BaseFormatter", "MainFormatter", "StdFormatter", "JsonFormatter"]
+
+# StdFormatter 生成的渲染函数直接从 LogMessage 上取的字段
+MESSAGE_FIELDS = frozenset(
+    ("messages", "logger_tag", "end", "split", "flush", "stack_trace", "style")
+)
+
+# JsonFormatter 的字段 -> 需要的 LogMessage / 模板字段
+JSON_FIELD_SOURCES = {
+    "time": "log_time",
+    "time_ns": "log_time",
+    "level": "level",
+    "level_name": "level",
+    "logger": "logger_name",
+    "tag": "logger_tag",
+    "message": "messages",
+    "source": "log_source",
+    "line": "log_line",
+    "function": "log_function",
+}
+JSON_TRACE_FIELDS = frozenset(("source", "line", "function"))
 
 
 class BaseFormatter(Options):
@@ -27,6 +63,24 @@ class BaseFormatter(Options):
     default_template: str = (
         "[${log_time}][${level}]|${logger_name}:${logger_tag}|${messages}"
     )
+    # 使用预编译的模板渲染 (False 则每次都使用 string.Template)
+    compile_template: bool = True
+
+    # 缓存的渲染函数 (LogMessage -> str) 和它对应的配置
+    _renderer = None  # type: Optional[Callable[[LogMessage], str]]
+    _renderer_key = None  # type: Optional[tuple]
+    _compiled = None  # type: Optional[CompiledTemplate]
+    # 渲染成 bytes 的函数和它对应的 (配置, 编码, errors)
+    _bytes_renderer = None  # type: Optional[Callable[[LogMessage], bytes]]
+    _bytes_renderer_key = None  # type: Optional[tuple]
+    # enable_timing 的时候使用的计时器
+    _timer = None  # type: Optional[StageTimer]
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name == "default_template":
+            # 模板变了, 需要的字段可能也变了
+            LogConfigVersion.bump()
 
     @classmethod
     def add_info(cls, match: str, to: str, description: str) -> str:
@@ -67,6 +121,14 @@ class BaseFormatter(Options):
         :param template: 日志输出模板
         :return:
         """
+        if self.compile_template:
+            if template is None:
+                return self.get_renderer()(message)
+            if isinstance(template, Template):
+                template = template.template
+            compiled = CompiledTemplate.get(template)
+            return compiled.render(self._format((message, message.format_for_message()))[1])
+
         basic_info = message.format_for_message()
         message, info = self._format((message, basic_info))
 
@@ -90,6 +152,194 @@ class BaseFormatter(Options):
             message = formatter._format(message)
         return message
 
+    @property
+    def compiled_template(self) -> CompiledTemplate:
+        """
+        The compiled version of the current template
+        :return:
+        """
+        compiled = self._compiled
+        if compiled is None or compiled.template is not self.default_template:
+            compiled = self._compiled = CompiledTemplate.get(self.default_template)
+        return compiled
+
+    @property
+    def required_fields(self) -> FrozenSet[str]:
+        """
+        The fields used by the current template
+        :return:
+        """
+        return self.compiled_template.fields
+
+    @property
+    def need_stack_trace(self) -> bool:
+        """
+        Whether the current template needs the stack trace of the message
+        :return:
+        """
+        return not self.required_fields.isdisjoint(STACK_TRACE_FIELDS)
+
+    def render_key(self) -> tuple:
+        """
+        渲染函数依赖的配置, 变化的时候会重新生成渲染函数
+        :return:
+        """
+        return (self.default_template,)
+
+    def get_renderer(self) -> Callable[[LogMessage], str]:
+        """
+        Get the cached render function (rebuild it if the config changed)
+        :return: render function (LogMessage -> str)
+        """
+        key = self.render_key()
+        if self._renderer is None or key != self._renderer_key:
+            self._renderer = self.build_renderer(self.compiled_template)
+            self._renderer_key = key
+        return self._renderer
+
+    def format_bytes(
+        self, message: LogMessage, encoding: str = "utf-8", errors: str = "strict"
+    ) -> bytes:
+        """
+        Format message and encode it (with the current template)
+        :param message: 输入的消息
+        :param encoding: encoding of the output
+        :param errors: encoding error handler
+        :return:
+        """
+        return self.get_bytes_renderer(encoding, errors)(message)
+
+    def get_bytes_renderer(
+        self, encoding: str = "utf-8", errors: str = "strict"
+    ) -> Callable[[LogMessage], bytes]:
+        """
+        Get the cached render function that outputs bytes
+        :param encoding: encoding of the output
+        :param errors: encoding error handler
+        :return: render function (LogMessage -> bytes)
+        """
+        key = (self.render_key(), encoding, errors)
+        if self._bytes_renderer is None or key != self._bytes_renderer_key:
+            self._bytes_renderer = self.build_renderer(
+                self.compiled_template, encoding=encoding, errors=errors
+            )
+            self._bytes_renderer_key = key
+        return self._bytes_renderer
+
+    def build_renderer(
+        self,
+        compiled: CompiledTemplate,
+        encoding: Optional[str] = None,
+        errors: str = "strict",
+    ) -> Callable[[LogMessage], Any]:
+        """
+        Build a render function for the compiled template
+        :param compiled: compiled template
+        :param encoding: None -> render to str, otherwise encode the result
+        :param errors: encoding error handler
+        :return: render function (LogMessage -> str / bytes)
+        """
+        format_ = self._format
+        render = compiled.render
+
+        if encoding is not None:
+
+            def bytes_renderer(message: LogMessage) -> bytes:
+                return render(format_((message, message.format_for_message()))[1]).encode(
+                    encoding, errors
+                )
+
+            return bytes_renderer
+
+        def renderer(message: LogMessage) -> str:
+            return render(format_((message, message.format_for_message()))[1])
+
+        return renderer
+
+    def timing_stages(self) -> List[Tuple[str, "BaseFormatter"]]:
+        """
+        The stages of _format when timing (stage name, formatter to call _format on)
+        :return:
+        """
+        return [(f"formatter.{type(self).__name__}", self)]
+
+    def enable_timing(
+        self, timer: Optional[StageTimer] = None, stages: bool = False
+    ) -> StageTimer:
+        """
+        Record the time of formatting
+        默认计时的是实际使用的 format_message / format_bytes (融合的渲染函数) 整体
+        stages=True 的时候换成一步一步执行的版本, 分别记录每个阶段
+        注意: 这个版本不使用融合的渲染函数, 各阶段的耗时加起来比实际的渲染慢
+        只能用来比较各阶段的相对开销
+        :param timer: timer to record to (default: pipeline_timer)
+        :param stages: record every stage with the unfused pipeline
+        :return: the timer
+        """
+        self.disable_timing()
+        self._timer = timer if timer is not None else pipeline_timer
+        if stages:
+            self.format_message = self._format_message_timed  # type: ignore
+            self.format_bytes = self._format_bytes_timed  # type: ignore
+        else:
+            self.format_message = timed(  # type: ignore
+                self.format_message, self._timer, "formatter.format_message"
+            )
+            self.format_bytes = timed(  # type: ignore
+                self.format_bytes, self._timer, "formatter.format_bytes"
+            )
+        return self._timer
+
+    def disable_timing(self) -> None:
+        """
+        Stop timing, restore the normal code path
+        :return: None
+        """
+        self.__dict__.pop("format_message", None)
+        self.__dict__.pop("format_bytes", None)
+        self._timer = None
+        return None
+
+    def _format_message_timed(
+        self,
+        message: LogMessage,
+        template: Optional[Union[Template, str]] = None,
+    ) -> str:
+        """
+        format_message with per-stage timing (see enable_timing)
+        :param message: 输入的消息
+        :param template: 日志输出模板
+        :return:
+        """
+        add = self._timer.add  # type: ignore
+        start = perf_counter_ns()
+        formatting = (message, message.format_for_message())
+        now = perf_counter_ns()
+        add("formatter.fields", now - start)
+        for stage, formatter in self.timing_stages():
+            start = now
+            formatting = formatter._format(formatting)
+            now = perf_counter_ns()
+            add(stage, now - start)
+        if template is None:
+            compiled = self.compiled_template
+        else:
+            compiled = CompiledTemplate.get(
+                template.template if isinstance(template, Template) else template
+            )
+        text = compiled.render(formatting[1])
+        add("formatter.template", perf_counter_ns() - now)
+        return text
+
+    def _format_bytes_timed(
+        self, message: LogMessage, encoding: str = "utf-8", errors: str = "strict"
+    ) -> bytes:
+        text = self._format_message_timed(message)
+        start = perf_counter_ns()
+        data = text.encode(encoding, errors)
+        self._timer.add("formatter.encode", perf_counter_ns() - start)  # type: ignore
+        return data
+
     @property
     def template(self) -> str:
         return self.default_template
@@ -99,6 +349,8 @@ class BaseFormatter(Options):
         if not isinstance(template, str):
             raise TypeError(f"The template must be str, not {type(template)}")
         self.default_template = template
+        self._renderer = None
+        self._bytes_renderer = None
 
 
 class MainFormatter(BaseFormatter):
@@ -107,7 +359,14 @@ class MainFormatter(BaseFormatter):
 
     time_format: str = "%Y-%m-%d %H:%M:%S"
     msec_time_format: str = "{}-{:03d}"
+    # local -> time.strftime(time_format)
+    # iso   -> ISO-8601 local time with utc offset (2023-11-28T23:23:00.000+08:00)
+    # utc   -> ISO-8601 utc time (2023-11-28T15:23:00.000Z)
+    # epoch -> unix timestamp (1701184980.000)
+    # iso / utc / epoch 不会调用 strftime, 也不使用 time_format
+    time_mode: str = "local"
     use_absolute_path: bool = False
+    compile_template: bool = True
 
     default_level: int = 20
     level_get_higher: bool = True
@@ -122,6 +381,13 @@ class MainFormatter(BaseFormatter):
         LogLevel.error: "ERROR ",
         LogLevel.fatal: "FATAL ",
     }
+    # (second, time_format, msec_time_format, time_mode, prefix, msec table, suffix, fallback)
+    _time_cache = None  # type: Optional[tuple]
+    # format spec -> ("000", "001", ..., "999")
+    _msec_tables = {}  # type: Dict[str, Tuple[str, ...]]
+    # (level_name_map, sorted levels, level tags)
+    _level_table = None  # type: Optional[Tuple[dict, List[int], List[str]]]
+
     name_level_map = {
         "NOTSET": LogLevel.notset,
         " TRACE": LogLevel.trace,
@@ -140,7 +406,8 @@ class MainFormatter(BaseFormatter):
             "formatted time when logging",
             "The time format string"
             ". See https://docs.python.org/3/library/time"
-            ".html#time.strftime for more information.",
+            ".html#time.strftime for more information."
+            " (time_mode iso / utc / epoch use built-in formats)",
         )
         info += "\n"
         info += cls.add_info("level", "log level", "The log level")
@@ -165,36 +432,127 @@ class MainFormatter(BaseFormatter):
         return message
 
     def _level_format(self, message: FormattingMessage) -> FormattingMessage:
-        if message[0].level in self.name_level_map:
-            level_tag = self.level_name_map[message[0].level]
-        else:
-            if self.level_get_higher:
-                for level in self.name_level_map:
-                    if message[0].level <= self.name_level_map[level]:
-                        level_tag = level
-                        break
-                else:
-                    level_tag = "FATAL"
-            else:
-                for level in self.name_level_map:
-                    if message[0].level >= self.name_level_map[level]:
-                        level_tag = level
-                        break
-                else:
-                    level_tag = "NOTSET"
-        message[1]["level"] = level_tag
+        message[1]["level"] = self.level_tag(message[0].level)
         return message
 
-    def _time_format(self, message: FormattingMessage) -> FormattingMessage:
-        time_mark = time.localtime(message[0].log_time / 1000000000)
-        if self.msec_time_format:
-            time_mark = self.msec_time_format.format(
-                time.strftime(self.time_format, time_mark),
-                message[0].create_msec_3,
+    def level_tag(self, level: int) -> str:
+        """
+        Get the level tag of a level
+        非标准的等级按照 level_get_higher 取相邻的标准等级
+        :param level: log level
+        :return: level tag
+        """
+        if (level_tag := self.level_name_map.get(level)) is not None:
+            return level_tag
+        table = self._level_table
+        if table is None or table[0] is not self.level_name_map:
+            levels = sorted(self.level_name_map)
+            table = self._level_table = (
+                self.level_name_map,
+                levels,
+                [self.level_name_map[level] for level in levels],
             )
-        message[1]["log_time"] = time_mark
+        levels, tags = table[1], table[2]
+        if self.level_get_higher:
+            return tags[min(bisect_left(levels, level), len(tags) - 1)]
+        return tags[max(bisect_right(levels, level) - 1, 0)]
+
+    def _time_format(self, message: FormattingMessage) -> FormattingMessage:
+        message[1]["log_time"] = self.time_text(message[0].log_time)
         return message
 
+    def time_text(self, log_time: int) -> str:
+        """
+        Format a log time
+        :param log_time: time.time_ns()
+        :return: formatted time
+        """
+        second = int(log_time // 1000000000)
+        cache = self._time_cache
+        if (
+            cache is None
+            or cache[0] != second
+            or cache[1] is not self.time_format
+            or cache[2] is not self.msec_time_format
+            or cache[3] is not self.time_mode
+        ):
+            # 同一秒内的消息只需要拼上毫秒
+            cache = self._time_cache = self._build_time_cache(second)
+        prefix, msec_table, suffix, fallback = cache[4:]
+        if msec_table is not None:
+            return prefix + msec_table[int(log_time // 1000000) % 1000] + suffix
+        if fallback is not None:
+            return fallback.format(prefix, int(log_time // 1000000) % 1000)
+        return prefix
+
+    @classmethod
+    def _msec_table(cls, spec: str) -> Tuple[str, ...]:
+        """
+        get formatted msec strings for a format spec
+        :param spec: format spec (like "03d")
+        :return: 1000 formatted msec
+        """
+        if (table := cls._msec_tables.get(spec)) is None:
+            table = cls._msec_tables[spec] = tuple(format(msec, spec) for msec in range(1000))
+        return table
+
+    def _build_time_cache(self, second: int) -> tuple:
+        """
+        Build the time cache for one second
+        :param second: unix timestamp (second)
+        :return: cache tuple
+        """
+        key = (second, self.time_format, self.msec_time_format, self.time_mode)
+        mode = self.time_mode
+        with_msec = bool(self.msec_time_format)
+        if mode in ("iso", "utc"):
+            if mode == "utc":
+                time_mark = time.gmtime(second)
+                zone = "Z"
+            else:
+                time_mark = time.localtime(second)
+                offset = time_mark.tm_gmtoff or 0
+                sign = "-" if offset < 0 else "+"
+                offset = abs(offset) // 60
+                zone = f"{sign}{offset // 60:02d}:{offset % 60:02d}"
+            base = (
+                f"{time_mark.tm_year:04d}-{time_mark.tm_mon:02d}-{time_mark.tm_mday:02d}"
+                f"T{time_mark.tm_hour:02d}:{time_mark.tm_min:02d}:{time_mark.tm_sec:02d}"
+            )
+            if with_msec:
+                return key + (f"{base}.", self._msec_table("03d"), zone, None)
+            return key + (base + zone, None, "", None)
+        if mode == "epoch":
+            if with_msec:
+                return key + (f"{second}.", self._msec_table("03d"), "", None)
+            return key + (str(second), None, "", None)
+
+        base = time.strftime(self.time_format, time.localtime(second))
+        if not with_msec:
+            return key + (base, None, "", None)
+        # 尝试把 msec_time_format 拆成 前缀 + 毫秒 + 后缀
+        try:
+            parts = list(Formatter().parse(self.msec_time_format))
+        except ValueError:
+            parts = []
+        fields = [part for part in parts if part[1] is not None]
+        if (
+            len(fields) == 2
+            and fields[0][1:] in (("", "", None), ("0", "", None))
+            and fields[1][1] in ("", "1")
+            and fields[1][3] is None
+            and len(parts) in (2, 3)
+            and parts[0] is fields[0]
+            and parts[1] is fields[1]
+        ):
+            try:
+                msec_table = self._msec_table(fields[1][2])
+            except ValueError:
+                return key + (base, None, "", self.msec_time_format)
+            suffix = parts[2][0] if len(parts) == 3 else ""
+            return key + (fields[0][0] + base + fields[1][0], msec_table, suffix, None)
+        return key + (base, None, "", self.msec_time_format)
+
     def _trace_format(self, message: FormattingMessage) -> FormattingMessage:
         if message[0].stack_trace is None:
             return message
@@ -213,6 +571,7 @@ class StdFormatter(BaseFormatter):
     name = "StdFormatter"
 
     enable_color: bool = True
+    compile_template: bool = True
 
     sub_formatter: List[BaseFormatter] = [MainFormatter()]
     from lib_not_dr.loggers.formatter.colors import (
@@ -280,6 +639,348 @@ class StdFormatter(BaseFormatter):
 
         return message
 
+    def timing_stages(self) -> List[Tuple[str, BaseFormatter]]:
+        # 和 _format 的顺序一样: sub formatter, 然后是 color formatter
+        stages = [
+            (f"formatter.{type(formatter).__name__}", formatter)
+            for formatter in self.sub_formatter
+        ]
+        if self.enable_color:
+            stages.extend(
+                (f"formatter.color.{type(formatter).__name__}", formatter)
+                for formatter in self.color_formatters
+            )
+        return stages
+
+    def render_key(self) -> tuple:
+        return (
+            self.default_template,
+            self.enable_color,
+            tuple(self.sub_formatter),
+            tuple(self.color_formatters),
+        )
+
+    def build_renderer(
+        self,
+        compiled: CompiledTemplate,
+        encoding: Optional[str] = None,
+        errors: str = "strict",
+    ) -> Callable[[LogMessage], Any]:
+        """
+        把 MainFormatter 和 color formatter 融合进一个生成的渲染函数
+        只计算模板里用得到的字段, 字段直接放在局部变量里, 不再创建 dict
+        :param compiled: compiled template
+        :param encoding: None -> render to str, otherwise encode the result
+        :param errors: encoding error handler
+        :return: render function (LogMessage -> str / bytes)
+        """
+        if len(self.sub_formatter) != 1 or type(self.sub_formatter[0]) is not MainFormatter:
+            # 自定义的 sub formatter, 老老实实走完整的流程
+            return super().build_renderer(compiled, encoding, errors)
+        main = self.sub_formatter[0]
+        fields = compiled.fields
+
+        color_index: Dict[str, int] = {}
+        namespace: Dict[str, Any] = {
+            "Path": Path,
+            "main": main,
+            "time_text": main.time_text,
+            "level_tag": main.level_tag,
+        }
+        if self.enable_color:
+            from lib_not_dr.loggers.formatter.colors import ColorTable
+
+            color_fields = [
+                name
+                for name in dict.fromkeys(
+                    name
+                    for formatter in self.color_formatters
+                    for name in getattr(formatter, "color_fields", ())
+                )
+                if name in fields
+            ]
+            table = ColorTable(self.color_formatters, color_fields)
+            if not table.fusable:
+                return super().build_renderer(compiled, encoding, errors)
+            color_index = {name: index * 2 for index, name in enumerate(table.fields)}
+            namespace["color_table"] = table.get
+
+        def wrap(name: str) -> str:
+            index = color_index[name]
+            return f"f'{{c[{index}]}}{{v_{name}}}{{c[{index + 1}]}}'"
+
+        lines = []
+        if color_index:
+            lines.append("c = color_table(message.level)")
+        # 直接写在 f-string 里的字段
+        inline = set()
+        for name in sorted(fields):
+            if name == "log_time":
+                lines.append("v_log_time = time_text(message.log_time)")
+                inline.add(name)
+            elif name == "level":
+                lines.append("v_level = level_tag(message.level)")
+                inline.add(name)
+            elif name == "logger_name":
+                lines.append("v_logger_name = message.logger_name")
+                inline.add(name)
+            elif name == "logger_tag":
+                lines.append("v_logger_tag = message.logger_tag")
+                lines.append("if v_logger_tag is None:")
+                lines.append("    v_logger_tag = '   '")
+                if name in color_index:
+                    lines.append("else:")
+                    lines.append(f"    v_logger_tag = {wrap(name)}")
+            elif name == "messages":
+                lines.append("v_messages = message.format_message()")
+                if name in color_index:
+                    index = color_index[name]
+                    # 结尾的换行放在颜色外面
+                    lines.append("if v_messages[-1:] == '\\n':")
+                    lines.append(
+                        f"    v_messages = f'{{c[{index}]}}{{v_messages[:-1]}}"
+                        f"{{c[{index + 1}]}}\\n'"
+                    )
+                    lines.append("else:")
+                    lines.append(f"    v_messages = {wrap(name)}")
+            elif name in MESSAGE_FIELDS:
+                # end / split / flush / stack_trace / style
+                lines.append(f"v_{name} = message.{name}")
+                if name in color_index:
+                    lines.append(f"if v_{name} is not None:")
+                    lines.append(f"    v_{name} = {wrap(name)}")
+
+        # stack_trace 本身在上面当作普通字段处理了 (没有堆栈信息的时候是 None)
+        trace_fields = sorted((fields & STACK_TRACE_FIELDS) - MESSAGE_FIELDS)
+        if trace_fields:
+            raw = {placeholder_name: raw for _, placeholder_name, raw in compiled.segments}
+            lines.append("trace = message.stack_trace")
+            lines.append("if trace is None:")
+            # 没有堆栈信息的时候保留原始的占位符
+            for name in trace_fields:
+                lines.append(f"    v_{name} = {raw[name]!r}")
+            lines.append("else:")
+            for name in trace_fields:
+                if name == "log_source":
+                    lines.append("    v_log_source = trace.f_code.co_filename")
+                    lines.append("    if main.use_absolute_path:")
+                    lines.append("        v_log_source = Path(v_log_source).absolute()")
+                elif name == "log_line":
+                    lines.append("    v_log_line = trace.f_lineno")
+                else:
+                    lines.append("    v_log_function = trace.f_code.co_name")
+                if name in color_index:
+                    lines.append(f"    v_{name} = {wrap(name)}")
+
+        known = inline | MESSAGE_FIELDS | STACK_TRACE_FIELDS
+        pieces = []
+        for literal, name, raw_placeholder in compiled.segments:
+            if literal:
+                pieces.append(repr(literal))
+            if name is None:
+                continue
+            if name not in known:
+                # 不认识的字段, 跟 safe_substitute 一样原样保留
+                pieces.append(repr(raw_placeholder))
+            elif name in inline and name in color_index:
+                pieces.append(wrap(name))
+            else:
+                pieces.append(f"f'{{v_{name}!s}}'")
+        result = f"({' '.join(pieces) or repr('')})"
+        if encoding is not None:
+            # 整行拼好之后一次编码 (比逐段拼接预先编码的 bytes 快)
+            result += f".encode({encoding!r}, {errors!r})"
+        lines.append(f"return {result}")
+
+        source = "def renderer(message):\n" + "".join(f"    {line}\n" for line in lines)
+        exec(compile(source, f"<StdFormatter {compiled.template!r}>", "exec"), namespace)
+        return namespace["renderer"]
+
+    @classmethod
+    def _info(cls) -> str:
+        return "None"
+
+
+class JsonFormatter(BaseFormatter):
+    """
+    JSON Lines formatter, 每条消息输出一行 JSON
+    给日志收集 / 索引用, 不需要再用正则把文本拆开
+    """
+
+    name = "JsonFormatter"
+
+    # 输出的字段 (按顺序, 堆栈相关的字段总是在最后, 没有堆栈信息的时候省略)
+    # time       : 按 time_mode 格式化的时间
+    # time_ns    : time.time_ns()
+    # level      : 等级数字
+    # level_name : 等级名字
+    # logger     : logger 名字
+    # tag        : logger tag (没有的时候是 null)
+    # message    : 消息内容 (不包含 end)
+    # source / line / function : 堆栈信息
+    fields: List[str] = [
+        "time", "level", "level_name", "logger", "tag", "message", "source", "line", "function",
+    ]
+    # 时间格式: iso / utc / epoch / local (同 MainFormatter.time_mode)
+    time_mode: str = "iso"
+    # 转义所有非 ascii 字符
+    ensure_ascii: bool = False
+    # auto: 有 orjson 的时候用 orjson, 否则拼接预先生成的 key 片段
+    # orjson / json: 强制使用其中一种
+    serializer: str = "auto"
+
+    def init(self, **kwargs) -> bool:
+        if unknown := set(self.fields) - JSON_FIELD_SOURCES.keys():
+            raise ValueError(f"unknown JsonFormatter fields: {sorted(unknown)}")
+        if self.serializer not in ("auto", "orjson", "json"):
+            raise ValueError(f"serializer must be auto / orjson / json, not {self.serializer!r}")
+        if self.serializer == "orjson" and orjson is None:
+            raise ValueError("serializer 'orjson' requires orjson to be installed")
+        return False
+
+    @property
+    def required_fields(self) -> FrozenSet[str]:
+        return frozenset(JSON_FIELD_SOURCES[name] for name in self.fields)
+
+    def format_message(
+        self,
+        message: LogMessage,
+        template: Optional[Union[Template, str]] = None,
+    ) -> str:
+        """
+        Format message as one line of JSON
+        :param message: 输入的消息
+        :param template: ignored
+        :return: JSON object + "\\n"
+        """
+        return self.get_renderer()(message)
+
+    def render_key(self) -> tuple:
+        return tuple(self.fields), self.time_mode, self.ensure_ascii, self.serializer
+
+    def _format_message_timed(
+        self,
+        message: LogMessage,
+        template: Optional[Union[Template, str]] = None,
+    ) -> str:
+        # 字段是直接从 LogMessage 上取的, 没有单独的阶段
+        start = perf_counter_ns()
+        text = self.get_renderer()(message)
+        self._timer.add("formatter.json", perf_counter_ns() - start)  # type: ignore
+        return text
+
+    def use_orjson(self) -> bool:
+        """
+        Whether orjson is used to serialize
+        :return:
+        """
+        if self.ensure_ascii or orjson is None:
+            # orjson 不支持 ensure_ascii
+            return False
+        return self.serializer != "json"
+
+    def build_renderer(
+        self,
+        compiled: CompiledTemplate,
+        encoding: Optional[str] = None,
+        errors: str = "strict",
+    ) -> Callable[[LogMessage], Any]:
+        """
+        生成一个专门用于当前字段的渲染函数
+        :param compiled: unused
+        :param encoding: None -> render to str, otherwise encode the result
+        :param errors: encoding error handler
+        :return: render function (LogMessage -> str / bytes)
+        """
+        main = MainFormatter(time_mode=self.time_mode)
+        level_names: Dict[int, str] = {}
+
+        def level_name(level: int) -> str:
+            if (name := level_names.get(level)) is None:
+                name = level_names[level] = LogLevel.parse_level_name(level)
+            return name
+
+        namespace: Dict[str, Any] = {
+            "time_text": main.time_text,
+            "level_name": level_name,
+        }
+        # 字段 -> 取值的表达式
+        values = {
+            "time": "time_text(message.log_time)",
+            "time_ns": "int(message.log_time)",
+            "level": "message.level",
+            "level_name": "level_name(message.level)",
+            "logger": "message.logger_name",
+            "tag": "message.logger_tag",
+            "message": "message.format_text()",
+            "source": "trace.f_code.co_filename",
+            "line": "trace.f_lineno",
+            "function": "trace.f_code.co_name",
+        }
+        plain = [name for name in self.fields if name not in JSON_TRACE_FIELDS]
+        traced = [name for name in self.fields if name in JSON_TRACE_FIELDS]
+
+        lines = []
+        if self.use_orjson():
+            namespace["dumps"] = orjson.dumps
+            namespace["option"] = orjson.OPT_APPEND_NEWLINE
+            items = ", ".join(f"{name!r}: {values[name]}" for name in plain)
+            lines.append(f"data = {{{items}}}")
+            if traced:
+                lines.append("trace = message.stack_trace")
+                lines.append("if trace is not None:")
+                for name in traced:
+                    lines.append(f"    data[{name!r}] = {values[name]}")
+            if encoding is None:
+                lines.append("return dumps(data, option=option).decode()")
+            elif codecs.lookup(encoding).name == "utf-8":
+                # orjson 输出的就是 utf-8
+                lines.append("return dumps(data, option=option)")
+            else:
+                lines.append(
+                    f"return dumps(data, option=option).decode().encode({encoding!r}, {errors!r})"
+                )
+        else:
+            if self.ensure_ascii:
+                escape = json_encoder.encode_basestring_ascii
+            else:
+                escape = json_encoder.encode_basestring
+            namespace["escape"] = escape
+            string_fields = ("time", "level_name", "logger", "message", "source", "function")
+
+            def piece(name: str, prefix: str) -> str:
+                # 预先生成 key 片段, 只有字符串的值需要转义
+                key = prefix + escape(name) + ":"
+                if name in string_fields:
+                    return repr(key) + f" f'{{escape({values[name]})}}'"
+                if name == "tag":
+                    return repr(key) + " f'{tag}'"
+                return repr(key) + f" f'{{{values[name]}}}'"
+
+            if "tag" in plain:
+                lines.append("tag = message.logger_tag")
+                lines.append("tag = 'null' if tag is None else escape(tag)")
+            head = " ".join(
+                piece(name, "," if index else "{") for index, name in enumerate(plain)
+            )
+            lines.append(f"text = ({head or repr('{')})")
+            if traced:
+                lines.append("trace = message.stack_trace")
+                lines.append("if trace is not None:")
+                # 没有其他字段的时候 "{" 已经在 text 里了
+                tail = " ".join(
+                    piece(name, "," if index or plain else "") for index, name in enumerate(traced)
+                )
+                lines.append(f"    text += ({tail})")
+            if encoding is None:
+                lines.append("return text + '}\\n'")
+            else:
+                lines.append(f"return (text + '}}\\n').encode({encoding!r}, {errors!r})")
+
+        source = "def renderer(message):\n" + "".join(f"    {line}\n" for line in lines)
+        exec(compile(source, f"<JsonFormatter {self.fields!r}>", "exec"), namespace)
+        return namespace["renderer"]
+
     @classmethod
     def _info(cls) -> str:
         return "None"
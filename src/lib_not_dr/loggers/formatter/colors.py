@@ -4,6 +4,9 @@
 #  All rights reserved
 #  -------------------------------
 
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Sequence, Tuple
+
 from lib_not_dr.loggers import LogLevel, COLOR_SUPPORT
 from lib_not_dr.loggers.formatter import BaseFormatter
 from lib_not_dr.loggers.structure import FormattingMessage
@@ -15,6 +18,7 @@ __all__ = [
     "TimeColorFormatter",
     "TraceColorFormatter",
     "MessageColorFormatter",
+    "ColorTable",
     "RESET_COLOR",
 ]
 
@@ -43,19 +47,38 @@ class BaseColorFormatter(BaseFormatter):
         LogLevel.fatal: "\033[0;41m",
     }
 
+    # 这个 formatter 会上色的字段 (用于 ColorTable)
+    color_fields = ()  # type: Tuple[str, ...]
+    # (color dict, sorted levels, colors)
+    _color_table = None  # type: Tuple[Dict[int, str], List[int], List[str]] | None
+
     def get_color(self, message: FormattingMessage) -> str:
-        if message[0].level in self.color:
-            return self.color[message[0].level]
-        for level in self.color:
-            if message[0].level <= level:
-                break
-        else:
-            level = 90
-        return self.color[level]
+        return self.color_for_level(message[0].level)
+
+    def color_for_level(self, level: int) -> str:
+        """
+        Get the color for a level
+        非标准的等级使用比它高的第一个等级的颜色 (比最高的还高就用最高的)
+        :param level: log level
+        :return: color
+        """
+        if (color := self.color.get(level)) is not None:
+            return color
+        table = self._color_table
+        if table is None or table[0] is not self.color:
+            levels = sorted(self.color)
+            table = self._color_table = (
+                self.color,
+                levels,
+                [self.color[level] for level in levels],
+            )
+        index = bisect_left(table[1], level)
+        return table[2][min(index, len(table[2]) - 1)]
 
 
 class LevelColorFormatter(BaseColorFormatter):
     name = "LevelColorFormatter"
+    color_fields = ("level",)
     # TODO 迁移老 logger 颜色
     color = {
         # Notset: just black
@@ -95,6 +118,7 @@ class LevelColorFormatter(BaseColorFormatter):
 
 class LoggerColorFormatter(BaseColorFormatter):
     name = "LoggerColorFormatter"
+    color_fields = ("logger_name", "logger_tag")
     # TODO 迁移老 logger 颜色
     color = {
         # Notset: just black
@@ -142,6 +166,7 @@ class LoggerColorFormatter(BaseColorFormatter):
 
 class TimeColorFormatter(BaseColorFormatter):
     name = "TimeColorFormatter"
+    color_fields = ("log_time",)
     # TODO 迁移老 logger 颜色
     color = {
         # Notset: just black
@@ -183,6 +208,7 @@ class TimeColorFormatter(BaseColorFormatter):
 
 class TraceColorFormatter(BaseColorFormatter):
     name = "TraceColorFormatter"
+    color_fields = ("log_source", "log_line", "log_function")
     # TODO 迁移老 logger 颜色
     color = {
         # Notset: just black
@@ -236,6 +262,7 @@ class TraceColorFormatter(BaseColorFormatter):
 
 class MessageColorFormatter(BaseColorFormatter):
     name = "MessageColorFormatter"
+    color_fields = ("messages",)
 
     color = {
         # Notset: just black
@@ -278,3 +305,69 @@ class MessageColorFormatter(BaseColorFormatter):
                     "messages"
                 ] = f'{color}{message[1]["messages"]}{RESET_COLOR}'
         return message
+
+
+class ColorTable:
+    """
+    预先计算好的颜色表
+    把多个 color formatter 合并, 每个等级只计算一次每个字段的 (前缀, 后缀)
+    """
+
+    __slots__ = ("formatters", "fields", "fusable", "_tables")
+
+    def __init__(
+        self, formatters: Iterable[BaseFormatter], fields: Sequence[str]
+    ) -> None:
+        """
+        :param formatters: color formatters
+        :param fields: 需要上色的字段 (表里的顺序)
+        """
+        self.formatters = tuple(formatters)
+        self.fields = tuple(fields)
+        # 自定义了 _format 的 formatter 没法合并
+        self.fusable = all(
+            type(formatter)._format in _FUSABLE_FORMATS for formatter in self.formatters
+        )
+        self._tables: Dict[int, Tuple[str, ...]] = {}
+
+    def get(self, level: int) -> Tuple[str, ...]:
+        """
+        Get the color table of a level
+        :param level: log level
+        :return: (prefix_0, suffix_0, prefix_1, suffix_1, ...) in the order of fields
+        """
+        if (table := self._tables.get(level)) is None:
+            if len(self._tables) > 256:
+                self._tables.clear()
+            table = self._tables[level] = self._build(level)
+        return table
+
+    def _build(self, level: int) -> Tuple[str, ...]:
+        prefixes = dict.fromkeys(self.fields, "")
+        suffixes = dict.fromkeys(self.fields, "")
+        if COLOR_SUPPORT:
+            for formatter in self.formatters:
+                color = formatter.color_for_level(level)  # type: ignore
+                if color == "" or color == RESET_COLOR:
+                    continue
+                for name in formatter.color_fields:  # type: ignore
+                    if name in prefixes:
+                        # 后面的 formatter 包在外面
+                        prefixes[name] = color + prefixes[name]
+                        suffixes[name] = suffixes[name] + RESET_COLOR
+        table: List[str] = []
+        for name in self.fields:
+            table.append(prefixes[name])
+            table.append(suffixes[name])
+        return tuple(table)
+
+
+_FUSABLE_FORMATS = frozenset(
+    (
+        LevelColorFormatter._format,
+        LoggerColorFormatter._format,
+        TimeColorFormatter._format,
+        TraceColorFormatter._format,
+        MessageColorFormatter._format,
+    )
+)
@@ -0,0 +1,125 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+from string import Template
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+__all__ = ["CompiledTemplate"]
+
+# (literal, field name, raw placeholder)
+Segment = Tuple[str, Optional[str], str]
+
+
+class CompiledTemplate:
+    """
+    预编译的 string.Template
+    只在创建的时候解析一次模板, 之后直接用生成的函数渲染
+    渲染结果与 Template.safe_substitute 一致 (缺失的字段原样保留)
+    """
+
+    __slots__ = ("template", "segments", "fields", "render")
+
+    # template str -> CompiledTemplate
+    _cache: Dict[str, "CompiledTemplate"] = {}
+    _cache_limit: int = 256
+
+    def __init__(self, template: str) -> None:
+        """
+        Compile a template
+        :param template: string.Template style template
+        """
+        self.template = template
+        self.segments = self.parse(template)
+        self.fields: FrozenSet[str] = frozenset(
+            name for _, name, _ in self.segments if name is not None
+        )
+        self.render: Callable[[Dict[str, Any]], str] = self._build_render()
+
+    @classmethod
+    def get(cls, template: str) -> "CompiledTemplate":
+        """
+        Get a compiled template from cache (or compile it)
+        :param template: template str
+        :return: compiled template
+        """
+        if (compiled := cls._cache.get(template)) is not None:
+            return compiled
+        compiled = cls(template)
+        if len(cls._cache) >= cls._cache_limit:
+            cls._cache.clear()
+        cls._cache[template] = compiled
+        return compiled
+
+    @staticmethod
+    def parse(template: str) -> List[Segment]:
+        """
+        Split template into (literal, field, raw placeholder) segments
+        :param template: template str
+        :return: segments
+        """
+        segments: List[Segment] = []
+        literal = ""
+        last = 0
+        for match in Template.pattern.finditer(template):
+            literal += template[last : match.start()]
+            last = match.end()
+            if match.group("escaped") is not None:
+                literal += Template.delimiter
+                continue
+            name = match.group("named") or match.group("braced")
+            if name is None:
+                # invalid placeholder, 跟 safe_substitute 一样原样保留
+                literal += match.group()
+                continue
+            segments.append((literal, name, match.group()))
+            literal = ""
+        literal += template[last:]
+        if literal:
+            segments.append((literal, None, ""))
+        return segments
+
+    def safe_render(self, info: Dict[str, Any]) -> str:
+        """
+        Render template, keep the placeholder of missing fields
+        :param info: fields
+        :return: rendered str
+        """
+        parts = []
+        for literal, name, raw in self.segments:
+            parts.append(literal)
+            if name is not None:
+                if name in info:
+                    parts.append(str(info[name]))
+                else:
+                    parts.append(raw)
+        return "".join(parts)
+
+    def _build_render(self) -> Callable[[Dict[str, Any]], str]:
+        """
+        生成一个专门用于这个模板的渲染函数
+        字段名只可能是 identifier, 字面量用 repr 嵌入, 所以可以安全的 exec
+        """
+        pieces = []
+        for literal, name, _ in self.segments:
+            if literal:
+                pieces.append(repr(literal))
+            if name is not None:
+                pieces.append(f'f"{{info[{name!r}]!s}}"')
+        if not pieces:
+            return lambda info: ""
+        source = (
+            "def render(info):\n"
+            "    try:\n"
+            f"        return ({' '.join(pieces)})\n"
+            "    except KeyError:\n"
+            "        return safe_render(info)\n"
+        )
+        namespace: Dict[str, Any] = {"safe_render": self.safe_render}
+        exec(compile(source, f"<CompiledTemplate {self.template!r}>", "exec"), namespace)
+        return namespace["render"]
+
+    def __repr__(self) -> str:
+        return f"<CompiledTemplate {self.template!r}>"
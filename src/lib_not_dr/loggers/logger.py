@@ -5,14 +5,25 @@
 #  -------------------------------
 
 import time
+import asyncio
 import inspect
+from bisect import bisect_right
 from types import FrameType
-from typing import List, Optional, Union
+from typing import Any, Callable, List, Optional, Tuple, Union
 
 from lib_not_dr.loggers import LogLevel
 from lib_not_dr.types.options import Options
-from lib_not_dr.loggers.structure import LogMessage
-from lib_not_dr.loggers.outstream import BaseOutputStream, StdioOutputStream
+from lib_not_dr.loggers.structure import LogMessage, LogConfigVersion
+from lib_not_dr.loggers.ratelimit import RateLimiter
+from lib_not_dr.loggers.timing import StageTimer, StageClock, pipeline_timer
+from lib_not_dr.loggers.outstream import (
+    BaseOutputStream,
+    StdioOutputStream,
+    AsyncOutputStream,
+)
+
+# (output.write_stdout / write_stderr, 是否需要堆栈信息)
+Route = Tuple[Tuple[Callable[[LogMessage], None], ...], bool]
 
 
 class Logger(Options):
@@ -25,6 +36,68 @@ class Logger(Options):
 
     enable: bool = True
     level: int = 20  # info
+    # 等级 >= stderr_level 的消息写入 write_stderr
+    stderr_level: int = LogLevel.warn
+    # 限流 / 采样 (None 表示不限制)
+    rate_limit: Optional[RateLimiter] = None
+
+    # 路由表缓存: 按照 outputs 的等级把等级分段
+    # _route_levels[i] <= level < _route_levels[i + 1] 的消息使用 _route_table[i + 1]
+    # _route_table[0] 是比所有 output 等级都低的消息 (没有人接收)
+    _route_levels = []  # type: List[int]
+    _route_table = [((), False)]  # type: List[Route]
+    _cache_version = -1  # type: int
+    # 计算路由表时 outputs 的内容, 直接修改 outputs 列表 (append / remove / 切片赋值) 不会改变版本号
+    _route_outputs = []  # type: List[BaseOutputStream]
+    # enable_timing 的时候使用的计时器
+    _timer = None  # type: Optional[StageTimer]
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in ("outputs", "stderr_level"):
+            LogConfigVersion.bump()
+
+    def _update_cache(self) -> None:
+        """
+        根据 outputs 重新计算路由表
+        output 的 level / enable / formatter 修改的时候也会触发 (LogConfigVersion)
+        :return: None
+        """
+        self._cache_version = LogConfigVersion.version
+        self._route_outputs = list(self.outputs)
+        outputs = [output for output in self.outputs if output.enable]
+        levels = sorted({output.level for output in outputs} | {self.stderr_level})
+        table: List[Route] = [((), False)]
+        for level in levels:
+            accepted = [output for output in outputs if level >= output.level]
+            if level >= self.stderr_level:
+                writers = tuple(output.write_stderr for output in accepted)
+            else:
+                writers = tuple(output.write_stdout for output in accepted)
+            table.append((writers, any(output.need_stack_trace for output in accepted)))
+        self._route_levels = levels
+        self._route_table = table
+
+    def route(self, level: int) -> Route:
+        """
+        Get the writers that accept a message with this level.
+        :param level: the level of the message
+        :return: (writers, need stack trace)
+        """
+        if (
+            self._cache_version != LogConfigVersion.version
+            or self._route_outputs != self.outputs
+        ):
+            self._update_cache()
+        return self._route_table[bisect_right(self._route_levels, level)]
+
+    def need_stack_trace(self, level: int) -> bool:
+        """
+        Check if any output needs the stack trace of a message with this level.
+        :param level: the level of the message
+        :return: True if the stack trace is needed
+        """
+        return self.route(level)[1]
 
     def clone_logger(self) -> "Logger":
         """
@@ -33,10 +106,12 @@ class Logger(Options):
         Returns:
             Logger: The cloned loggers.
         """
-        return Logger(
+        return self.__class__(
             logger_name=self.logger_name,
             enable=self.enable,
             level=self.level,
+            stderr_level=self.stderr_level,
+            rate_limit=self.rate_limit,
             outputs=self.outputs.copy(),
             default_tag=self.default_tag,
         )
@@ -61,6 +136,7 @@ class Logger(Options):
         """
         self.outputs.append(output)
         self.level = min(self.level, output.level)
+        LogConfigVersion.bump()
 
     def remove_output(self, output: BaseOutputStream) -> None:
         """
@@ -70,6 +146,7 @@ class Logger(Options):
         """
         self.outputs.remove(output)
         self.level = max(self.level, *[output.level for output in self.outputs])
+        LogConfigVersion.bump()
 
     @property
     def tag(self):
@@ -141,46 +218,163 @@ class Logger(Options):
             # logger_name: str = 'root',
             # logger_tag: Optional[str] = None,
             stack_trace: Optional[FrameType] = None,
+            style: Optional[str] = None,
     ) -> None:
         # 检查是否需要记录
         if not self.log_for(level):
             return
-        log_time = time.time_ns()
-        # 处理堆栈信息
-        if stack_trace is None:
-            # 尝试获取堆栈信息
-            if (stack := inspect.currentframe()) is not None:
-                # 如果可能 尝试获取上两层的堆栈信息
-                if (up_stack := stack.f_back) is not None:
-                    if (upper_stack := up_stack.f_back) is not None:
-                        stack_trace = upper_stack
-                    else:
-                        stack_trace = up_stack
-                else:
-                    stack_trace = stack
+        writers, need_trace = self.route(level)
+        if not writers:
+            # 没有 output 会接收这条消息
+            return
         # 处理标签
         if tag is None and self.default_tag is not None:
             tag = self.default_tag
+        limiter = self.rate_limit
+        # 处理堆栈信息 (只有在有输出或者限流需要的时候才去获取)
+        if stack_trace is None and (
+            need_trace or (limiter is not None and limiter.need_call_site)
+        ):
+            stack_trace = self._caller_frame()
+        # 限流 (在创建消息之前)
+        if limiter is not None and not limiter.allow(self, level, tag, stack_trace):
+            return
+        message = self._new_message(messages, tag, end, split, flush, level, stack_trace, style)
+        for writer in writers:
+            writer(message)
+        # done?
+        # 20231106 00:06
 
-        message = LogMessage(
+    @staticmethod
+    def _caller_frame() -> Optional[FrameType]:
+        """
+        获取 make_log 的调用者的调用者的堆栈信息 (logger.info(...) 所在的位置)
+        make_log 和 _make_log_timed 共用, 两者的调用层数一样
+        :return: frame (None if not supported)
+        """
+        if (stack := inspect.currentframe()) is None:
+            return None
+        # make_log / _make_log_timed
+        if (stack := stack.f_back) is None:
+            return None
+        # 如果可能 尝试获取上两层的堆栈信息
+        if (up_stack := stack.f_back) is not None:
+            if (upper_stack := up_stack.f_back) is not None:
+                return upper_stack
+            return up_stack
+        return stack
+
+    def _new_message(
+            self,
+            messages: Union[list, tuple],
+            tag: Optional[str],
+            end: str,
+            split: str,
+            flush: Optional[bool],
+            level: int,
+            stack_trace: Optional[FrameType],
+            style: Optional[str],
+    ) -> LogMessage:
+        """
+        Create the message written to the outputs (shared by make_log and _make_log_timed)
+        """
+        return LogMessage(
             messages=messages,  # type: ignore
             end=end,
             split=split,
             flush=flush,
             level=level,
-            log_time=log_time,
+            log_time=time.time_ns(),
             logger_name=self.logger_name,
             logger_tag=tag,
             stack_trace=stack_trace,
+            style=style,
         )
-        if level >= 30:  # WARN
+
+    def enable_timing(
+            self,
+            timer: Optional[StageTimer] = None,
+            outputs: bool = True,
+            stages: bool = False,
+    ) -> StageTimer:
+        """
+        Record the time of every stage of make_log
+        make_log 被换成带计时的版本, 关闭之后换回去, 所以不计时的时候没有额外开销
+        :param timer: timer to record to (default: pipeline_timer)
+        :param outputs: also enable timing on the outputs (and their formatters)
+        :param stages: time every formatter stage (unfused, see BaseFormatter.enable_timing)
+        :return: the timer
+        """
+        self._timer = timer if timer is not None else pipeline_timer
+        self.make_log = self._make_log_timed  # type: ignore
+        if outputs:
             for output in self.outputs:
-                output.write_stderr(message)
-        else:
+                output.enable_timing(self._timer, stages=stages)
+        return self._timer
+
+    def disable_timing(self, outputs: bool = True) -> None:
+        """
+        Stop timing, restore the normal make_log
+        :param outputs: also disable timing on the outputs
+        :return: None
+        """
+        self.__dict__.pop("make_log", None)
+        self._timer = None
+        if outputs:
             for output in self.outputs:
-                output.write_stdout(message)
-        # done?
-        # 20231106 00:06
+                output.disable_timing()
+        return None
+
+    def _make_log_timed(
+            self,
+            messages: Union[list, tuple],
+            tag: Optional[str] = None,
+            end: str = "\n",
+            split: str = " ",
+            flush: bool = None,
+            level: int = 20,  # info
+            stack_trace: Optional[FrameType] = None,
+            style: Optional[str] = None,
+    ) -> None:
+        """
+        make_log with per-stage timing (see enable_timing)
+        流程和 make_log 一样, 获取堆栈信息 / 创建消息 用的是同样的函数
+        """
+        if not self.log_for(level):
+            return
+        clock = StageClock(self._timer)  # type: ignore
+        writers, need_trace = self.route(level)
+        clock.mark("logger.route")
+        if not writers:
+            return
+        if tag is None and self.default_tag is not None:
+            tag = self.default_tag
+        limiter = self.rate_limit
+        if stack_trace is None and (
+            need_trace or (limiter is not None and limiter.need_call_site)
+        ):
+            stack_trace = self._caller_frame()
+            clock.mark("logger.stack_trace")
+        if limiter is not None:
+            allowed = limiter.allow(self, level, tag, stack_trace)
+            clock.mark("logger.rate_limit")
+            if not allowed:
+                return
+        message = self._new_message(messages, tag, end, split, flush, level, stack_trace, style)
+        clock.mark("logger.message")
+        for writer in writers:
+            writer(message)
+        clock.mark("logger.write")
+        clock.total("logger.make_log")
+
+    def timing_snapshot(self) -> dict:
+        """
+        Get the statistics of the timer used by enable_timing
+        :return: {stage: {"calls": ..., "total_ns": ..., "mean_ns": ...}} ({} if not timing)
+        """
+        if self._timer is None:
+            return {}
+        return self._timer.snapshot()
 
     def info(
             self,
@@ -190,6 +384,7 @@ class Logger(Options):
             split: str = " ",
             flush: bool = None,
             stack_trace: Optional[FrameType] = None,
+            style: Optional[str] = None,
     ) -> None:
         if not self.log_for(LogLevel.info):
             return
@@ -201,6 +396,7 @@ class Logger(Options):
             flush=flush,
             level=LogLevel.info,
             stack_trace=stack_trace,
+            style=style,
         )
 
     def trace(
@@ -211,6 +407,7 @@ class Logger(Options):
             split: str = " ",
             flush: bool = None,
             stack_trace: Optional[FrameType] = None,
+            style: Optional[str] = None,
     ) -> None:
         if not self.log_for(LogLevel.trace):
             return
@@ -222,6 +419,7 @@ class Logger(Options):
             flush=flush,
             level=LogLevel.trace,
             stack_trace=stack_trace,
+            style=style,
         )
 
     def fine(
@@ -232,6 +430,7 @@ class Logger(Options):
             split: str = " ",
             flush: bool = None,
             stack_trace: Optional[FrameType] = None,
+            style: Optional[str] = None,
     ) -> None:
         if not self.log_for(LogLevel.fine):
             return
@@ -243,6 +442,7 @@ class Logger(Options):
             flush=flush,
             level=LogLevel.fine,
             stack_trace=stack_trace,
+            style=style,
         )
 
     def debug(
@@ -253,6 +453,7 @@ class Logger(Options):
             split: str = " ",
             flush: bool = None,
             stack_trace: Optional[FrameType] = None,
+            style: Optional[str] = None,
     ) -> None:
         if not self.log_for(LogLevel.debug):
             return
@@ -264,6 +465,7 @@ class Logger(Options):
             flush=flush,
             level=LogLevel.debug,
             stack_trace=stack_trace,
+            style=style,
         )
 
     def warn(
@@ -274,6 +476,7 @@ class Logger(Options):
             split: str = " ",
             flush: bool = None,
             stack_trace: Optional[FrameType] = None,
+            style: Optional[str] = None,
     ) -> None:
         if not self.log_for(LogLevel.warn):
             return
@@ -285,6 +488,7 @@ class Logger(Options):
             flush=flush,
             level=LogLevel.warn,
             stack_trace=stack_trace,
+            style=style,
         )
 
     def error(
@@ -295,6 +499,7 @@ class Logger(Options):
             split: str = " ",
             flush: bool = None,
             stack_trace: Optional[FrameType] = None,
+            style: Optional[str] = None,
     ) -> None:
         if not self.log_for(LogLevel.error):
             return
@@ -306,6 +511,7 @@ class Logger(Options):
             flush=flush,
             level=LogLevel.error,
             stack_trace=stack_trace,
+            style=style,
         )
 
     def fatal(
@@ -316,6 +522,7 @@ class Logger(Options):
             split: str = " ",
             flush: bool = None,
             stack_trace: Optional[FrameType] = None,
+            style: Optional[str] = None,
     ) -> None:
         if not self.log_for(LogLevel.fatal):
             return
@@ -327,4 +534,66 @@ class Logger(Options):
             flush=flush,
             level=LogLevel.fatal,
             stack_trace=stack_trace,
+            style=style,
         )
+
+
+class AsyncLogger(Logger):
+    """
+    给 asyncio 服务用的 Logger
+    所有的 output 都会被包装成 AsyncOutputStream, 在协程里 log 不会阻塞 event loop
+    """
+
+    name = "AsyncLogger"
+
+    outputs: List[BaseOutputStream] = []
+
+    logger_name: str = "root"
+    default_tag: Optional[str] = None
+
+    enable: bool = True
+    level: int = 20  # info
+    stderr_level: int = LogLevel.warn
+    rate_limit: Optional[RateLimiter] = None
+
+    def init(self, **kwargs) -> bool:
+        if "outputs" not in kwargs:
+            # 不要包装 Logger.outputs 里共享的那个, aclose() 会把它关掉
+            self.outputs = [StdioOutputStream()]
+        self.outputs = [self.wrap_output(output) for output in self.outputs]
+        return False
+
+    @staticmethod
+    def wrap_output(output: BaseOutputStream) -> AsyncOutputStream:
+        """
+        Wrap an output with AsyncOutputStream (if it is not one already)
+        :param output: output to wrap
+        :return: wrapped output
+        """
+        if isinstance(output, AsyncOutputStream):
+            return output
+        return AsyncOutputStream(output=output)
+
+    def add_output(self, output: BaseOutputStream) -> None:
+        super().add_output(self.wrap_output(output))
+
+    def remove_output(self, output: BaseOutputStream) -> None:
+        for wrapped in self.outputs:
+            if wrapped is output or getattr(wrapped, "output", None) is output:
+                super().remove_output(wrapped)
+                return None
+        raise ValueError(f"{output} is not in outputs")
+
+    async def aflush(self) -> None:
+        """
+        Wait until every output has written and flushed its pending messages.
+        :return: None
+        """
+        await asyncio.gather(*(output.aflush() for output in self.outputs))  # type: ignore
+
+    async def aclose(self) -> None:
+        """
+        Drain and close every output.
+        :return: None
+        """
+        await asyncio.gather(*(output.aclose() for output in self.outputs))  # type: ignore
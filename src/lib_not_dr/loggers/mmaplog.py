@@ -0,0 +1,301 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+"""
+内存映射的循环日志文件
+文件大小在创建的时候就固定了, 写满之后从头开始覆盖最旧的记录
+写入只是一次 memcpy, 不需要系统调用
+
+文件结构:
+    header (64 byte): b"LNDM" + 版本号(u8) + 填充 + 数据区大小(u64) + 写入位置(u64)
+                      + 绕回次数(u64) + 下一条记录的序号(u64)
+    数据区: 一条条的记录, 每条记录按 8 byte 对齐
+        marker(u32) 长度(u32) 序号(u64) 等级(i32) crc32(u32) + utf-8 文本
+    记录放不下的时候直接绕回到数据区开头 (绕回次数 + 1)
+
+读取的时候不依赖 header 里的写入位置 (崩溃的时候可能没有写回)
+而是扫描整个数据区, 用 crc32 校验每条记录, 再按照序号排序
+只保留以最新一条记录结尾的那一段连续的序号 (更早几圈留下的记录会被丢掉)
+
+python -m lib_not_dr.loggers.mmaplog <file> [--level LEVEL]
+"""
+
+import sys
+import mmap
+import zlib
+import atexit
+import struct
+import argparse
+import threading
+
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Union
+
+from lib_not_dr.loggers import LogLevel
+from lib_not_dr.loggers.structure import LogMessage
+from lib_not_dr.loggers.outstream import BaseOutputStream
+from lib_not_dr.loggers.formatter import BaseFormatter, StdFormatter
+
+__all__ = [
+    "MmapOutputStream",
+    "MmapLogReader",
+    "MmapRecord",
+    "MAGIC",
+    "VERSION",
+]
+
+MAGIC = b"LNDM"
+VERSION = 1
+RECORD_MARKER = 0x52444E4C  # b"LNDR"
+ALIGN = 8
+
+_header = struct.Struct("<4sB3xQQQQ")
+# header 里 写入位置 / 绕回次数 / 序号 的部分, 每次写入都会更新
+_position = struct.Struct("<QQQ")
+POSITION_OFFSET = 16
+HEADER_SIZE = 64
+_record = struct.Struct("<IIQiI")
+
+
+class MmapRecord(NamedTuple):
+    sequence: int
+    level: int
+    text: str
+
+
+def _align(size: int) -> int:
+    return (size + ALIGN - 1) & ~(ALIGN - 1)
+
+
+def scan_records(data: Union[bytes, mmap.mmap], capacity: int) -> List[MmapRecord]:
+    """
+    扫描数据区里所有完整的记录 (按照序号排序)
+    :param data: 整个文件的内容
+    :param capacity: 数据区大小
+    :return: records
+    """
+    records = []
+    offset = 0
+    end = HEADER_SIZE + capacity
+    while offset + _record.size <= capacity:
+        position = HEADER_SIZE + offset
+        marker, length, sequence, level, crc = _record.unpack_from(data, position)
+        start = position + _record.size
+        if (
+            marker == RECORD_MARKER
+            and start + length <= end
+            and zlib.crc32(data[start : start + length]) == crc
+        ):
+            text = bytes(data[start : start + length]).decode("utf-8", "replace")
+            records.append(MmapRecord(sequence, level, text))
+            offset += _align(_record.size + length)
+            continue
+        # 被覆盖了一半的记录, 继续找下一个对齐的位置
+        offset += ALIGN
+    records.sort()
+    # 绕回的时候上一圈末尾没有被覆盖的空隙里可能还留着更早几圈的完整记录
+    # 只保留以最新一条记录结尾的连续序号
+    first = len(records) - 1
+    while first > 0 and records[first - 1].sequence == records[first].sequence - 1:
+        first -= 1
+    return records[max(first, 0) :]
+
+
+class MmapOutputStream(BaseOutputStream):
+    """
+    把格式化之后的消息写入一个内存映射的循环文件
+    """
+
+    name = "MmapOutputStream"
+
+    level: int = LogLevel.info
+    formatter: BaseFormatter = StdFormatter(enable_color=False)
+    file_path: Path = Path("./logs")
+    file_name: str = "log.lndm"
+    # 文件大小 (包括 header), 已经存在的文件使用原来的大小
+    file_size: int = 1024 * 1024
+    # 等级 >= flush_level 的消息会立刻 msync 到磁盘
+    flush_level: int = LogLevel.error
+
+    def init(self, **kwargs) -> bool:
+        self._lock = threading.Lock()
+        self._map: Optional[mmap.mmap] = None
+        self.capacity = 0
+        # [写入位置, 绕回次数, 下一条记录的序号]
+        # 用 list 而不是属性, 每次写入不需要经过 Options 的 __setattr__
+        self._position = [0, 0, 0]
+        return False
+
+    @property
+    def cursor(self) -> int:
+        return self._position[0]
+
+    @property
+    def wrap_count(self) -> int:
+        return self._position[1]
+
+    @property
+    def sequence(self) -> int:
+        return self._position[2]
+
+    def _open(self) -> mmap.mmap:
+        file = Path(self.file_path) / self.file_name
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.touch()
+        with file.open("r+b") as f:
+            magic = f.read(len(MAGIC))
+            fresh = magic != MAGIC
+            if fresh:
+                if magic.strip(b"\0"):
+                    raise ValueError(f"{file} is not a mmap log")
+                # 新文件 (或者还没写完 header 就崩溃了的文件)
+                f.truncate(0)
+                f.truncate(max(_align(self.file_size), HEADER_SIZE + ALIGN * 4))
+            self._map = mmap.mmap(f.fileno(), 0)
+        self.capacity = len(self._map) - HEADER_SIZE
+        position = self._position = [0, 0, 0]
+        if not fresh:
+            _, version, capacity, _, wrap_count, sequence = _header.unpack_from(self._map)
+            if version != VERSION or capacity != self.capacity:
+                self._map.close()
+                self._map = None
+                raise ValueError(f"{file} is not a version {VERSION} mmap log")
+            position[1:] = wrap_count, sequence
+            # header 可能在崩溃的时候没有写回, 以记录为准
+            records = scan_records(self._map, self.capacity)
+            if records:
+                position[0] = self._find_end(records[-1].sequence)
+                position[2] = records[-1].sequence + 1
+        _header.pack_into(self._map, 0, MAGIC, VERSION, self.capacity, *position)
+        atexit.register(self.flush)
+        return self._map
+
+    def _find_end(self, sequence: int) -> int:
+        """
+        找到序号为 sequence 的记录的结尾
+        """
+        offset = 0
+        while offset + _record.size <= self.capacity:
+            marker, length, record_sequence, _, _ = _record.unpack_from(
+                self._map, HEADER_SIZE + offset  # type: ignore
+            )
+            if marker == RECORD_MARKER and record_sequence == sequence:
+                return offset + _align(_record.size + length)
+            offset += ALIGN
+        return 0
+
+    def _write(self, message: LogMessage) -> None:
+        data = self.formatter.format_bytes(message)
+        with self._lock:
+            log_map = self._map if self._map is not None else self._open()
+            # 太长的消息截断到数据区大小
+            data = data[: self.capacity - _record.size]
+            size = _align(_record.size + len(data))
+            position = self._position
+            cursor, wrap_count, sequence = position
+            if cursor + size > self.capacity:
+                cursor = 0
+                wrap_count += 1
+            start = HEADER_SIZE + cursor + _record.size
+            _record.pack_into(
+                log_map,
+                start - _record.size,
+                RECORD_MARKER,
+                len(data),
+                sequence,
+                message.level,
+                zlib.crc32(data),
+            )
+            log_map[start : start + len(data)] = data
+            position[:] = cursor + size, wrap_count, sequence + 1
+            _position.pack_into(log_map, POSITION_OFFSET, *position)
+            if message.flush or message.level >= self.flush_level:
+                log_map.flush()
+        return None
+
+    def write_stdout(self, message: LogMessage) -> None:
+        if not self.enable:
+            return None
+        if message.level < self.level:
+            return None
+        self._write(message)
+        return None
+
+    def write_stderr(self, message: LogMessage) -> None:
+        if not self.enable:
+            return None
+        if message.level < self.level:
+            return None
+        self._write(message)
+        return None
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+        return None
+
+    def close(self) -> None:
+        super().close()
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+                self._map.close()
+                self._map = None
+        atexit.unregister(self.flush)
+        return None
+
+
+class MmapLogReader:
+    """
+    读取 MmapOutputStream 写出的文件 (按照写入的顺序)
+    """
+
+    def __init__(self, file: Union[str, Path]) -> None:
+        """
+        :param file: path of the mmap log file
+        """
+        self.file = Path(file)
+        self.wrap_count = 0
+
+    def records(self) -> List[MmapRecord]:
+        """
+        Read all complete records, oldest first
+        :return: records
+        """
+        data = self.file.read_bytes()
+        if len(data) < HEADER_SIZE:
+            return []
+        magic, version, capacity, _, wrap_count, _ = _header.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{self.file} is not a mmap log")
+        if version != VERSION:
+            raise ValueError(f"unsupported mmap log version {version}")
+        self.wrap_count = wrap_count
+        return scan_records(data, min(capacity, len(data) - HEADER_SIZE))
+
+    def __iter__(self) -> Iterator[str]:
+        for record in self.records():
+            yield record.text
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m lib_not_dr.loggers.mmaplog",
+        description="print a lib-not-dr mmap log file in order",
+    )
+    parser.add_argument("file", help="mmap log file")
+    parser.add_argument("--level", type=int, default=0, help="only show messages >= level")
+    options = parser.parse_args(args)
+
+    for record in MmapLogReader(options.file).records():
+        if record.level >= options.level:
+            sys.stdout.write(record.text)
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+"""
+多进程日志
+子进程里的 ProcessOutputStream 把消息转换成 LogRecord 发送到父进程
+父进程里的 LogAggregator 是唯一真正格式化和写入的地方
+所以多个进程写同一个文件的时候不会互相打架
+"""
+
+import sys
+import atexit
+import threading
+import traceback
+import multiprocessing
+
+from typing import Any, Iterable, List, Optional
+
+from lib_not_dr.loggers import LogLevel
+from lib_not_dr.types.options import Options
+from lib_not_dr.loggers.structure import LogMessage
+from lib_not_dr.loggers.outstream import BaseOutputStream
+
+__all__ = [
+    "ProcessOutputStream",
+    "LogAggregator",
+    "process_output_initializer",
+]
+
+
+class ProcessOutputStream(BaseOutputStream):
+    """
+    子进程用的 output
+    只负责把消息转换成 LogRecord 放进队列, 不做任何格式化
+    """
+
+    name = "ProcessOutputStream"
+
+    level: int = LogLevel.info
+    # LogAggregator 的队列
+    record_queue: Any = None
+    # 父进程的 output 是否需要堆栈信息 (由 LogAggregator.make_output 填写)
+    trace: bool = True
+
+    @property
+    def required_fields(self) -> None:
+        return None
+
+    @property
+    def need_stack_trace(self) -> bool:
+        return self.trace
+
+    def write_stdout(self, message: LogMessage) -> None:
+        if not self.enable:
+            return None
+        if message.level < self.level:
+            return None
+        self.record_queue.put((False, message.to_record()))
+        return None
+
+    def write_stderr(self, message: LogMessage) -> None:
+        if not self.enable:
+            return None
+        if message.level < self.level:
+            return None
+        self.record_queue.put((True, message.to_record()))
+        return None
+
+    def flush(self) -> None:
+        # multiprocessing.Queue 的后台线程会自己发送, 这里没什么要做的
+        return None
+
+
+class LogAggregator(Options):
+    """
+    父进程里的日志汇总
+    一个线程从队列里读取子进程发来的 LogRecord, 然后写入 outputs
+    """
+
+    name = "LogAggregator"
+
+    outputs: List[BaseOutputStream] = []
+    # 队列最大长度, 0 表示无限
+    queue_size: int = 0
+
+    record_queue: Any = None
+    listener: Optional[threading.Thread] = None
+    # 已经处理的记录数量
+    record_count: int = 0
+
+    def init(self, **kwargs) -> bool:
+        if self.record_queue is None:
+            self.record_queue = multiprocessing.Queue(maxsize=max(self.queue_size, 0))
+        self.outputs = list(self.outputs)
+        return False
+
+    def make_output(self, level: Optional[int] = None) -> ProcessOutputStream:
+        """
+        Make an output for child processes (pass it to the child / Pool initializer)
+        :param level: level of the output (default: lowest level of the outputs)
+        :return: output that sends records to this aggregator
+        """
+        if level is None:
+            level = min((output.level for output in self.outputs), default=LogLevel.info)
+        trace = any(output.need_stack_trace for output in self.outputs if output.enable)
+        return ProcessOutputStream(record_queue=self.record_queue, level=level, trace=trace)
+
+    def start(self) -> "LogAggregator":
+        """
+        Start the listener thread
+        :return: self
+        """
+        if self.listener is not None and self.listener.is_alive():
+            return self
+        self.listener = threading.Thread(
+            target=self._listen, name=f"{self.name}-listener", daemon=True
+        )
+        self.listener.start()
+        atexit.register(self.stop)
+        return self
+
+    def _listen(self) -> None:
+        record_queue = self.record_queue
+        while True:
+            item = record_queue.get()
+            if item is None:
+                return None
+            try:
+                self.dispatch(*item)
+            except Exception:
+                traceback.print_exc(file=sys.__stderr__)
+
+    def dispatch(self, to_stderr: bool, record: Iterable[Any]) -> None:
+        """
+        Write a record to the outputs
+        :param to_stderr: write to stderr or not
+        :param record: LogMessage.to_record()
+        :return: None
+        """
+        message = LogMessage.from_record(record)  # type: ignore
+        self.record_count += 1
+        if to_stderr:
+            for output in self.outputs:
+                output.write_stderr(message)
+        else:
+            for output in self.outputs:
+                output.write_stdout(message)
+        return None
+
+    def stop(self) -> None:
+        """
+        Stop the listener after all queued records are written, then flush the outputs
+        call this after the child processes are finished
+        :return: None
+        """
+        if self.listener is not None and self.listener.is_alive():
+            self.record_queue.put(None)
+            self.listener.join()
+        for output in self.outputs:
+            output.flush()
+        atexit.unregister(self.stop)
+        return None
+
+    def __enter__(self) -> "LogAggregator":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+def process_output_initializer(
+    output: ProcessOutputStream, logger_names: Iterable[str] = ("root",)
+) -> None:
+    """
+    给 multiprocessing.Pool(initializer=...) 用的函数
+    把子进程里这些 logger 的输出全部换成 output
+    :param output: LogAggregator.make_output()
+    :param logger_names: loggers to redirect
+    :return: None
+    """
+    from lib_not_dr.loggers.config import get_logger
+
+    for name in logger_names:
+        logger = get_logger(name)
+        logger.outputs = [output]
+        logger.level = output.level
+    return None
@@ -5,28 +5,58 @@
 #  -------------------------------
 
 import io
+import copy
+import os
 import sys
 import time
+import queue
 import string
 import atexit
+import asyncio
 import threading
+import weakref
+import traceback
+
+from collections import deque
 
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Deque, Dict, FrozenSet, List, Optional, Tuple
 
 from lib_not_dr.loggers import LogLevel
 from lib_not_dr.types.options import Options
-from lib_not_dr.loggers.structure import LogMessage
+from lib_not_dr.loggers.structure import (
+    LogMessage,
+    LogConfigVersion,
+    FrameInfo,
+    STACK_TRACE_FIELDS,
+)
 from lib_not_dr.loggers.formatter import BaseFormatter, StdFormatter
+from lib_not_dr.loggers.timing import StageTimer, pipeline_timer, timed
+from lib_not_dr.loggers.rotation import (
+    COMPRESSIONS,
+    RotationPolicy,
+    rotation_worker,
+    parse_rotation,
+    compress_file,
+    clean_rotated,
+    RotationLock,
+)
 
 # fmt: off
 __all__ = [
     "BaseOutputStream",
     "StdioOutputStream",
-    "FileCacheOutputStream"
+    "FileCacheOutputStream",
+    "QueueOutputStream",
+    "AsyncOutputStream",
+    "RingBufferOutputStream",
+    "DedupOutputStream",
 ]
 # fmt: on
 
+# enable_timing 的时候计时的方法
+TIMED_METHODS = ("write_stdout", "write_stderr", "flush")
+
 
 class BaseOutputStream(Options):
     name = "BaseOutputStream"
@@ -36,6 +66,37 @@ class BaseOutputStream(Options):
 
     formatter: BaseFormatter
 
+    # 这些属性变化的时候 Logger 需要重新计算缓存
+    _version_attrs = frozenset(("level", "enable", "formatter"))  # type: FrozenSet[str]
+    # enable_timing 的时候原来的 formatter (计时的是它的副本)
+    _untimed_formatter = None  # type: Optional[BaseFormatter]
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in self._version_attrs:
+            LogConfigVersion.bump()
+
+    @property
+    def required_fields(self) -> Optional[FrozenSet[str]]:
+        """
+        The fields this output needs from a message
+        None means unknown (treated as "needs everything")
+        :return:
+        """
+        formatter = getattr(self, "formatter", None)
+        if formatter is None:
+            return None
+        return formatter.required_fields
+
+    @property
+    def need_stack_trace(self) -> bool:
+        """
+        Whether this output needs the stack trace of a message
+        :return:
+        """
+        fields = self.required_fields
+        return fields is None or not fields.isdisjoint(STACK_TRACE_FIELDS)
+
     def write_stdout(self, message: LogMessage) -> None:
         raise NotImplementedError(f"{self.__class__.__name__}.write_stdout is not implemented")
 
@@ -48,6 +109,156 @@ class BaseOutputStream(Options):
     def close(self) -> None:
         self.enable = False
 
+    def enable_timing(
+        self,
+        timer: Optional[StageTimer] = None,
+        formatter: bool = True,
+        stages: bool = False,
+    ) -> StageTimer:
+        """
+        Record the time of write_stdout / write_stderr / flush (and the formatter stages)
+        把实例上的方法换成带计时的版本, disable_timing 的时候换回去
+        formatter 可能和其他 output 共用 (比如类上的默认值), 所以换成一个副本再计时
+        disable_timing 的时候换回原来的 formatter
+        :param timer: timer to record to (default: pipeline_timer)
+        :param formatter: also enable timing on the formatter
+        :param stages: time every formatter stage (see BaseFormatter.enable_timing)
+        :return: the timer
+        """
+        if timer is None:
+            timer = pipeline_timer
+        self.disable_timing(formatter=False)
+        for method in TIMED_METHODS:
+            self.__dict__[method] = timed(
+                getattr(self, method), timer, f"output.{self.name}.{method}"
+            )
+        if formatter and (output_formatter := getattr(self, "formatter", None)) is not None:
+            if self._untimed_formatter is None:
+                self._untimed_formatter = output_formatter
+                output_formatter = self.formatter = copy.copy(output_formatter)
+            output_formatter.enable_timing(timer, stages=stages)
+        # Logger 的路由表里缓存的是 write_stdout / write_stderr
+        LogConfigVersion.bump()
+        return timer
+
+    def disable_timing(self, formatter: bool = True) -> None:
+        """
+        Stop timing, restore the normal code path
+        :param formatter: also disable timing on the formatter
+        :return: None
+        """
+        for method in TIMED_METHODS:
+            self.__dict__.pop(method, None)
+        if formatter and self._untimed_formatter is not None:
+            self.formatter = self._untimed_formatter
+            self._untimed_formatter = None
+        LogConfigVersion.bump()
+        return None
+
+
+class PeriodicFlusher:
+    """
+    所有 output 共用的一个后台线程
+    按照注册时的间隔定期调用 output 的 flush 函数, 不会为每个 output 创建线程
+    只保存 output 的弱引用, output 被回收之后自动取消注册
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        # id(output) -> [下一次调用的时间, 间隔, weakref.WeakMethod]
+        self._tasks: Dict[int, List[Any]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, callback: Callable[[], Any], interval: float) -> None:
+        """
+        Call callback every interval seconds (replaces the previous registration of its owner)
+        :param callback: bound method of an output
+        :param interval: interval in seconds
+        :return: None
+        """
+        key = id(callback.__self__)  # type: ignore
+        with self._condition:
+            self._tasks[key] = [time.monotonic() + interval, interval, weakref.WeakMethod(callback)]
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="lib-not-dr-flusher", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def unregister(self, callback: Callable[[], Any]) -> None:
+        """
+        Stop calling the callback
+        :param callback: bound method registered before
+        :return: None
+        """
+        with self._condition:
+            self._tasks.pop(id(callback.__self__), None)  # type: ignore
+
+    def _run(self) -> None:
+        while True:
+            due = []
+            with self._condition:
+                now = time.monotonic()
+                timeout = None
+                for key, task in list(self._tasks.items()):
+                    if task[0] <= now:
+                        # 固定间隔, 不受 flush 耗时影响
+                        task[0] = max(task[0] + task[1], now)
+                        due.append((key, task[2]))
+                    wait = task[0] - now
+                    if timeout is None or wait < timeout:
+                        timeout = wait
+                if not due:
+                    self._condition.wait(timeout)
+                    continue
+            for key, method in due:
+                if (callback := method()) is None:
+                    with self._condition:
+                        self._tasks.pop(key, None)
+                    continue
+                try:
+                    callback()
+                except Exception:
+                    traceback.print_exc(file=sys.__stderr__)
+
+
+periodic_flusher = PeriodicFlusher()
+
+# 一次 writev 最多能写入多少块
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+
+# 只需要数据落盘, 不需要更新文件的元数据 (修改时间之类)
+_fsync = getattr(os, "fdatasync", os.fsync)
+
+DURABILITY_MODES = ("none", "periodic", "group")
+
+
+def write_chunks(fd: int, chunks: List[bytes]) -> int:
+    """
+    Write all chunks to a file descriptor with one writev (os.write on Windows)
+    对 O_APPEND 打开的文件, 一批数据是一次追加写入, 不需要先拼接成一整块
+    :param fd: file descriptor
+    :param chunks: data to write
+    :return: number of bytes written
+    """
+    size = sum(map(len, chunks))
+    if 1 < len(chunks) <= IOV_MAX and hasattr(os, "writev"):
+        written = os.writev(fd, chunks)
+        if written == size:
+            return size
+        # 部分写入 (被信号打断 / 管道满了), 剩下的部分用 os.write 写完
+        view = memoryview(b"".join(chunks))[written:]
+    else:
+        view = memoryview(chunks[0] if len(chunks) == 1 else b"".join(chunks))
+    while view:
+        view = view[os.write(fd, view) :]
+    return size
+
 
 class StdioOutputStream(BaseOutputStream):
     name = "StdioOutputStream"
@@ -56,11 +267,103 @@ class StdioOutputStream(BaseOutputStream):
     formatter: BaseFormatter = StdFormatter()
     use_stderr: bool = True
 
+    # 缓冲模式: 编码之后直接写入 sys.stdout.buffer / sys.stderr.buffer
+    # 多条消息合并成一次写入
+    buffered: bool = False
+    # 缓冲区超过这么多 byte 的时候写入
+    buffer_size: int = 64 * 1024
+    # 消息最多在缓冲区里停留多少秒 (0 表示只按照大小 / 等级写入)
+    buffer_time: float = 0.1
+    # 等级 >= flush_level 的消息会立刻写入
+    flush_level: int = LogLevel.error
+
+    def init(self, **kwargs) -> bool:
+        self._lock = threading.Lock()
+        # 缓冲的数据都是写入同一个流的, 切换流的时候先写入之前的
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        self._pending_stderr = False
+        if self.buffered:
+            if self.buffer_time > 0:
+                periodic_flusher.register(self.flush_buffer, self.buffer_time)
+            atexit.register(self.flush_buffer)
+        return False
+
+    def _buffer(self, message: LogMessage, to_stderr: bool) -> None:
+        """
+        write a message into the buffer
+        :param message: message to write
+        :param to_stderr: write to stderr or not
+        :return: None
+        """
+        stream = sys.stderr if to_stderr else sys.stdout
+        data = self.formatter.format_bytes(
+            message,
+            getattr(stream, "encoding", None) or "utf-8",
+            getattr(stream, "errors", None) or "strict",
+        )
+        with self._lock:
+            if self._pending and self._pending_stderr is not to_stderr:
+                # 保证 stdout 和 stderr 之间的顺序
+                self._write_pending()
+            self._pending.append(data)
+            self._pending_size += len(data)
+            self._pending_stderr = to_stderr
+            if (
+                message.flush
+                or message.level >= self.flush_level
+                or self._pending_size >= self.buffer_size
+            ):
+                self._write_pending()
+        return None
+
+    def _write_pending(self) -> None:
+        """
+        write the buffer to stdout / stderr (需要持有 _lock)
+        :return: None
+        """
+        pending = self._pending
+        if not pending:
+            return None
+        self._pending = []
+        self._pending_size = 0
+        stream = sys.stderr if self._pending_stderr else sys.stdout
+        # 先把 print 之类写进文本层的内容写出去, 再直接写入文件描述符
+        stream.flush()
+        try:
+            fd = stream.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        if fd is not None:
+            write_chunks(fd, pending)
+        elif (buffer := getattr(stream, "buffer", None)) is not None:
+            buffer.write(b"".join(pending))
+            buffer.flush()
+        else:
+            # 被替换成了 StringIO 之类的没有 buffer 的流
+            stream.write(
+                b"".join(pending).decode(getattr(stream, "encoding", None) or "utf-8", "replace")
+            )
+            stream.flush()
+        return None
+
+    def flush_buffer(self) -> None:
+        """
+        write buffered messages now
+        :return: None
+        """
+        with self._lock:
+            self._write_pending()
+        return None
+
     def write_stdout(self, message: LogMessage) -> None:
         if not self.enable:
             return None
         if message.level < self.level:
             return None
+        if self.buffered:
+            self._buffer(message, False)
+            return None
         out_msg = self.formatter.format_message(message)
         if message.flush is not None:
             print(out_msg, end="", flush=message.flush)
@@ -74,7 +377,9 @@ class StdioOutputStream(BaseOutputStream):
         if message.level < self.level:
             return None
         if self.use_stderr:
-            if message.flush is not None:
+            if self.buffered:
+                self._buffer(message, True)
+            elif message.flush is not None:
                 print(
                     self.formatter.format_message(message),
                     end="",
@@ -97,23 +402,31 @@ class StdioOutputStream(BaseOutputStream):
         flush stdout and stderr
         :return: None
         """
+        self.flush_buffer()
         print("", end="", flush=True)
         print("", end="", flush=True, file=sys.stderr)
         return None
 
+    def close(self) -> None:
+        super().close()
+        self.flush()
+        if self.buffered:
+            periodic_flusher.unregister(self.flush_buffer)
+            atexit.unregister(self.flush_buffer)
+        return None
+
 
 class FileCacheOutputStream(BaseOutputStream):
     name = "FileCacheOutputStream"
 
     level: int = LogLevel.info
     formatter: BaseFormatter = StdFormatter(enable_color=False)
-    text_cache: io.StringIO = None  # type: ignore
 
     flush_counter: int = 0
     # 默认 10 次 flush 一次
     flush_count_limit: int = 10
-    flush_time_limit: int = 10  # time limit in sec, 0 means no limit
-    flush_timer: Optional[threading.Timer] = None
+    # 每隔多少秒 flush 一次 (由 periodic_flusher 调用), 0 means no limit
+    flush_time_limit: float = 10
 
     file_path: Path = Path("./logs")
     # if contain {time} -> time.strftime("%Y-%m-%d_%H-%M-%S", time.gmtime(time.time)
@@ -138,6 +451,51 @@ class FileCacheOutputStream(BaseOutputStream):
     file_size_limit: int = 0  # size limit in kb
     file_time_limit: int = 0  # time limit in sec 0
     file_swap_on_both: bool = False  # swap file when both size and time limit reached
+    # 每隔多少秒检查一次文件是否被移动 / 删除 / 截断 (logrotate 之类)
+    file_check_interval: float = 1.0
+    # 多个进程写同一个文件
+    # 每一批数据都是一次 O_APPEND 写入, 不会和其他进程的数据交错
+    # 写入之前检查文件有没有被其他进程轮换, 大小按照文件的实际大小算
+    # 轮换通过 RotationLock 协调, 只有一个进程会轮换 (需要用 rotation, 不支持 file_swap)
+    multi_process: bool = False
+
+    # 持久化模式 (什么时候 fsync)
+    # none     : 不主动 fsync, 交给操作系统
+    # periodic : 最多每隔 fsync_interval 秒 fsync 一次 (flush 的时候 / 由 periodic_flusher 调用)
+    # group    : 每条消息返回之前都已经写入并 fsync 了
+    #            同时写入的消息合并成一次 write + fsync, 每个调用者只等待包含自己的那一批
+    durability: str = "none"
+    fsync_interval: float = 1.0
+    # 等级 >= durable_level 的消息返回之前一定已经 fsync 了 (任何模式下, None 表示不启用)
+    durable_level: Optional[int] = None
+
+    # 轮换策略 (RotationPolicy 或者 {"class": "DailyRotation", ...})
+    # 设置了之后 file_swap 相关的选项不再生效, 任意一个策略满足的时候
+    # 当前文件被重命名为 {file_name}.{time}, 然后在后台线程里 压缩 / 清理
+    rotation: List[RotationPolicy] = []
+    # 轮换下来的文件名里的时间格式
+    rotation_time_format: str = "%Y-%m-%d_%H-%M-%S"
+    # 压缩方式: "" (不压缩) / gzip / lzma
+    compression: str = ""
+    # 最多保留多少个轮换下来的文件 (0 表示不限制)
+    retention_count: int = 0
+    # 轮换下来的文件最多保留多少秒 (0 表示不限制)
+    retention_age: float = 0
+
+    # 一直打开的文件, 以及在内存里记录的 大小 / 创建时间 / (st_dev, st_ino)
+    _file = None  # type: Optional[io.FileIO]
+    _file_size = 0  # type: int
+    _file_created = 0.0  # type: float
+    _file_identity = None  # type: Optional[Tuple[int, int]]
+    _next_file_check = 0.0  # type: float
+    _rotation_lock = None  # type: Optional[RotationLock]
+    # 等待写入的数据 (已经编码), flush 的时候一次 writev 写入
+    _chunks = None  # type: Optional[List[bytes]]
+    # 消息的编号: 进入缓存的 / 已经写入文件的 / 已经 fsync 的 (group commit 用)
+    _appended = 0  # type: int
+    _written = 0  # type: int
+    _synced = 0  # type: int
+    _last_sync = 0.0  # type: float
 
     def init(self, **kwargs) -> bool:
         # 时间取整
@@ -147,11 +505,27 @@ class FileCacheOutputStream(BaseOutputStream):
             self.file_name = self.file_name.format(time=time.strftime(
                 "%Y-%m-%d_%H-%M-%S", time.gmtime(self.file_start_time)
             ))
-        # 初始化缓存
-        if self.text_cache is None:
-            self.text_cache = io.StringIO()
+        # 初始化缓存 (close 之后是 None)
+        self._chunks = []
+        # _lock 保护 _chunks 和 flush_counter
+        # _file_lock 保证 flush 按顺序写入文件 (先拿 _file_lock 再拿 _lock)
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self.rotation = [parse_rotation(policy) for policy in self.rotation]
+        if self.compression and self.compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of {list(COMPRESSIONS)}")
+        if self.durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {list(DURABILITY_MODES)}")
+        if self.multi_process and self.file_swap and not self.rotation:
+            raise ValueError("multi_process uses rotation, file_swap is not supported")
+        self._last_sync = time.monotonic()
         # 检查文件名
         self.get_file_path()
+        intervals = [self.flush_time_limit]
+        if self.durability == "periodic":
+            intervals.append(self.fsync_interval)
+        if intervals := [interval for interval in intervals if interval > 0]:
+            periodic_flusher.register(self.flush, min(intervals))
         return False
 
     def _write(self, message: LogMessage) -> None:
@@ -161,19 +535,25 @@ class FileCacheOutputStream(BaseOutputStream):
         :param message: message to write
         :return: None
         """
-        self.text_cache.write(self.formatter.format_message(message))
-        self.flush_counter += 1
-        if message.flush or self.flush_counter >= self.flush_count_limit:
+        data = self.formatter.format_bytes(message, self.file_encoding)
+        with self._lock:
+            if self._chunks is None:
+                # 已经 close 了
+                return None
+            self._chunks.append(data)
+            self._appended += 1
+            ticket = self._appended
+            self.flush_counter += 1
+            need_flush = message.flush or self.flush_counter >= self.flush_count_limit
+        if self.durability == "group" or (
+            self.durable_level is not None and message.level >= self.durable_level
+        ):
+            self.commit(ticket)
+        elif need_flush:
             self.flush()
-        else:
-            if self.flush_time_limit > 0:
-                if self.flush_timer is None or not self.flush_timer.is_alive():
-                    self.flush_timer = threading.Timer(self.flush_time_limit, self.flush)
-                    self.flush_timer.daemon = True
-                    self.flush_timer.start()
-            if not self.at_exit_register:
-                atexit.register(self.flush)
-                self.at_exit_register = True
+        elif not self.at_exit_register:
+            atexit.register(self.flush)
+            self.at_exit_register = True
         return None
 
     def write_stdout(self, message: LogMessage) -> None:
@@ -198,7 +578,7 @@ class FileCacheOutputStream(BaseOutputStream):
         :return:
         """
         if (current_file := self.current_file_name) is None:
-            if not self.file_swap:
+            if not self.file_swap or self.rotation:
                 # 直接根据 file name 生成文件
                 current_file = Path(self.file_path) / self.file_name
                 self.current_file_name = str(current_file)
@@ -216,53 +596,817 @@ class FileCacheOutputStream(BaseOutputStream):
             current_file = Path(current_file)
         return current_file
 
-    def check_flush(self) -> Path:
+    def open_file(self) -> io.FileIO:
+        """
+        open the current log file (append, binary) and load its size / age
+        :return: opened file
+        """
+        self.close_file()
         current_file = self.get_file_path()
-        # 获取当前文件的路径
+        current_file.parent.mkdir(parents=True, exist_ok=True)
+        file = io.FileIO(current_file, "a")
+        stat = os.fstat(file.fileno())
+        now = time.time()
+        self._file = file
+        self._file_size = stat.st_size
+        # 已经存在的文件从最后修改的时间开始算
+        self._file_created = min(stat.st_mtime, now) if stat.st_size else now
+        self._file_identity = (stat.st_dev, stat.st_ino)
+        self._next_file_check = now + self.file_check_interval
+        for policy in self.rotation:
+            policy.start(self._file_created)
+        return file
+
+    def close_file(self) -> None:
+        """
+        close the current log file (if opened)
+        :return: None
+        """
+        if self._file is not None:
+            if self.durability != "none":
+                # 轮换 / 重新打开之前, 旧文件里的数据也要落盘
+                self._sync()
+            self._file.close()
+            self._file = None
+        return None
+
+    def need_swap(self, now: float) -> bool:
+        """
+        check the swap limits with the size / age tracked in memory
+        :param now: time.time()
+        :return: True if the file should be swapped
+        """
+        if self.rotation:
+            return any(policy.should_rotate(self._file_size, now) for policy in self.rotation)
         if not self.file_swap:
-            # 不需要 swap 直接返回
-            return current_file
-        # 检查是否需要 swap
-        size_pass = True
-        if self.file_size_limit > 0:
-            file_size = current_file.stat().st_size / 1024  # kb
-            if file_size > self.file_size_limit:  # kb
-                size_pass = False
-        time_pass = True
-        if self.file_time_limit > 0:
-            file_time = round(time.time()) - current_file.stat().st_mtime
-            if file_time > self.file_time_limit:
-                time_pass = False
-        if (self.file_swap_on_both and size_pass and time_pass) or (
-                not self.file_swap_on_both and (size_pass or time_pass)):
-            # 两个都满足
-            # 或者只有一个满足
-            if size_pass and time_pass:
-                self.file_swap_counter += 1
-                # 生成新的文件名
-                return self.get_file_path()
-        return current_file
+            return False
+        size_over = self.file_size_limit > 0 and self._file_size > self.file_size_limit * 1024
+        time_over = self.file_time_limit > 0 and now - self._file_created > self.file_time_limit
+        if self.file_swap_on_both:
+            return size_over and time_over
+        return size_over or time_over
 
-    def flush(self) -> None:
-        new_cache = io.StringIO()  # 创建新的缓存
-        self.flush_counter = 0  # atomic, no lock
-        old_cache, self.text_cache = self.text_cache, new_cache
-        text = old_cache.getvalue()
-        old_cache.close()  # 关闭旧的缓存
-        if text == "":
+    def rotate_file(self, now: Optional[float] = None) -> Optional[Path]:
+        """
+        rename the current file to {file_name}.{time}
+        and compress / clean the rotated files in the background
+        (调用之前需要持有 _file_lock, 之后由调用者重新打开文件)
+        :param now: rotation time
+        :return: the rotated file (None if there is no file)
+        """
+        self.close_file()
+        current_file = self.get_file_path()
+        if now is None:
+            now = time.time()
+        stamp = time.strftime(self.rotation_time_format, time.localtime(now))
+        target = current_file.with_name(f"{current_file.name}.{stamp}")
+        counter = 0
+        while target.exists() or any(
+            target.with_name(target.name + suffix).exists() for _, suffix in COMPRESSIONS.values()
+        ):
+            counter += 1
+            target = current_file.with_name(f"{current_file.name}.{stamp}.{counter}")
+        try:
+            os.rename(current_file, target)
+        except FileNotFoundError:
             return None
-        current_file = self.check_flush()
-        # 检查文件是否存在
-        if not current_file.exists():
+        compression = self.compression
+        retention_count, retention_age = self.retention_count, self.retention_age
+
+        def after_rotate() -> None:
+            if compression:
+                compress_file(target, compression)
+            if retention_count > 0 or retention_age > 0:
+                clean_rotated(
+                    current_file.parent, f"{current_file.name}.", retention_count, retention_age
+                )
+
+        rotation_worker.submit(after_rotate)
+        return target
+
+    def rotate(self) -> None:
+        """
+        flush and rotate the current file now
+        :return: None
+        """
+        self.flush()
+        with self._file_lock:
+            # 下一次 flush 的时候打开新的文件
+            if self.multi_process:
+                lock = self.get_rotation_lock()
+                lock.lock(exclusive=True)
+                try:
+                    self.rotate_file()
+                finally:
+                    lock.unlock()
+            else:
+                self.rotate_file()
+        return None
+
+    def get_rotation_lock(self) -> RotationLock:
+        """
+        get the lock shared with other processes writing the same file
+        :return: lock of the current file
+        """
+        if (lock := self._rotation_lock) is None:
+            current_file = self.get_file_path()
             current_file.parent.mkdir(parents=True, exist_ok=True)
-            current_file.touch(exist_ok=True)
-        with current_file.open("a", encoding=self.file_encoding) as f:
-            f.write(text)
+            lock = self._rotation_lock = RotationLock(current_file)
+        return lock
+
+    def file_changed(self) -> bool:
+        """
+        检查文件是否被移动 / 删除 (需要重新打开), 顺便更新被截断的文件的大小
+        :return: True if the file should be reopened
+        """
+        try:
+            stat = os.stat(self.get_file_path())
+        except FileNotFoundError:
+            return True
+        if (stat.st_dev, stat.st_ino) != self._file_identity:
+            return True
+        if self.multi_process or stat.st_size < self._file_size:
+            # 被截断了 (或者其他进程也在写), O_APPEND 会继续写在文件末尾
+            self._file_size = stat.st_size
+        return False
+
+    def check_flush(self) -> io.FileIO:
+        """
+        get the file to write, swap / reopen it if needed
+        只有在 swap 和定期检查的时候才会访问文件系统
+        :return: opened file
+        """
+        if self._file is None:
+            return self.open_file()
+        now = time.time()
+        if self.need_swap(now):
+            if self.rotation:
+                self.rotate_file(now)
+                return self.open_file()
+            self.file_swap_counter += 1
+            # 生成新的文件名
+            self.current_file_name = None
+            return self.open_file()
+        if now >= self._next_file_check:
+            self._next_file_check = now + self.file_check_interval
+            if self.file_changed():
+                return self.open_file()
+        return self._file
+
+    def _write_batch(self) -> None:
+        """
+        write all buffered messages with one writev (需要持有 _file_lock)
+        :return: None
+        """
+        with self._lock:
+            chunks = self._chunks
+            if not chunks:
+                # 没有数据 / 已经 close 了
+                return None
+            self._chunks = []
+            self.flush_counter = 0
+            appended = self._appended
+        if self.multi_process:
+            self._write_shared(chunks)
+        else:
+            file = self.check_flush()
+            self._file_size += write_chunks(file.fileno(), chunks)
+        self._written = appended
+        return None
+
+    def _write_shared(self, chunks: List[bytes]) -> None:
+        """
+        write a batch to a file shared with other processes (需要持有 _file_lock)
+        写入的时候持有共享锁, 需要轮换的时候换成排他锁
+        :param chunks: data to write
+        :return: None
+        """
+        lock = self.get_rotation_lock()
+        lock.lock()
+        try:
+            # 每一批都检查一次, 其他进程可能已经轮换过了 (一次 stat)
+            if self._file is None or self.file_changed():
+                self.open_file()
+            now = time.time()
+            if self.need_swap(now):
+                lock.lock(exclusive=True)
+                # 等待排他锁的时候可能已经有其他进程轮换过了
+                if not self.file_changed() and self.need_swap(now):
+                    self.rotate_file(now)
+                self.open_file()
+                lock.lock()
+            self._file_size += write_chunks(self._file.fileno(), chunks)  # type: ignore
+        finally:
+            lock.unlock()
+        return None
+
+    def _sync(self) -> None:
+        """
+        fsync everything written so far (需要持有 _file_lock)
+        :return: None
+        """
+        if self._file is not None and self._synced < self._written:
+            _fsync(self._file.fileno())
+        self._synced = self._written
+        self._last_sync = time.monotonic()
+        return None
+
+    def commit(self, ticket: Optional[int] = None) -> None:
+        """
+        Write and fsync the buffered messages (group commit)
+        等待 _file_lock 的时候, 别的线程可能已经把这条消息和它自己的一起写入了
+        :param ticket: the number of the message to wait for (None -> everything buffered now)
+        :return: None
+        """
+        if ticket is None:
+            with self._lock:
+                ticket = self._appended
+        with self._file_lock:
+            if self._synced >= ticket:
+                return None
+            self._write_batch()
+            self._sync()
+        return None
+
+    def flush(self) -> None:
+        with self._file_lock:
+            self._write_batch()
+            if (
+                self.durability == "periodic"
+                and time.monotonic() - self._last_sync >= self.fsync_interval
+            ):
+                self._sync()
         return None
 
     def close(self) -> None:
         super().close()
+        periodic_flusher.unregister(self.flush)
         self.flush()
-        self.text_cache.close()
+        with self._file_lock:
+            with self._lock:
+                self._chunks = None
+            if self.durability != "none":
+                self._sync()
+            self.close_file()
+            if self._rotation_lock is not None:
+                self._rotation_lock.close()
         atexit.unregister(self.flush)
         return None
+
+
+class QueueOutputStream(BaseOutputStream):
+    """
+    把消息放进一个有界队列, 由后台线程格式化并写入被包装的 output
+    调用 log 的线程不会被慢的终端 / 磁盘卡住
+    """
+
+    name = "QueueOutputStream"
+
+    level: int = LogLevel.info
+    # 被包装的 output, 格式化和写入都在后台线程里进行
+    output: BaseOutputStream
+    queue_size: int = 10000
+    # 队列满了的时候怎么办
+    # block            -> 等待队列有空位
+    # drop_newest      -> 丢掉新的消息
+    # drop_below_level -> 丢掉等级低于 drop_level 的消息, 其他的等待
+    # shed             -> 丢掉新的消息, 并且提高有效等级, 队列排空到 1/4 以下后恢复
+    overflow_policy: str = "block"
+    drop_level: int = LogLevel.warn
+    # block 的最长等待时间 (秒), 0 表示一直等
+    block_timeout: float = 0
+
+    # 被丢掉的消息数量
+    dropped_count: int = 0
+    # shed 模式下当前的有效等级
+    effective_level: int = LogLevel.info
+
+    # (to_stderr, message) 或者 (None, 在后台线程里调用的函数)
+    message_queue: queue.Queue = None  # type: ignore
+    worker: Optional[threading.Thread] = None
+
+    _version_attrs = frozenset(("level", "enable", "output"))
+    _overflow_policies = ("block", "drop_newest", "drop_below_level", "shed")
+
+    def init(self, **kwargs) -> bool:
+        if self.overflow_policy not in self._overflow_policies:
+            raise ValueError(
+                f"overflow_policy must be one of {self._overflow_policies}, "
+                f"not {self.overflow_policy!r}"
+            )
+        if "output" not in kwargs:
+            self.output = StdioOutputStream()
+        if "level" not in kwargs:
+            self.level = self.output.level
+        self.effective_level = self.level
+        self._drop_lock = threading.Lock()
+        self.message_queue = queue.Queue(maxsize=max(self.queue_size, 0))
+        self.worker = threading.Thread(
+            target=self._work, name=f"{self.name}-worker", daemon=True
+        )
+        self.worker.start()
+        atexit.register(self.close)
+        return False
+
+    @property
+    def required_fields(self) -> Optional[FrozenSet[str]]:
+        return self.output.required_fields
+
+    @property
+    def need_stack_trace(self) -> bool:
+        return self.output.need_stack_trace
+
+    def _work(self) -> None:
+        """
+        后台线程: 从队列里取消息写入被包装的 output
+        :return: None
+        """
+        message_queue = self.message_queue
+        while True:
+            item = message_queue.get()
+            try:
+                if item is None:
+                    return None
+                to_stderr, message = item
+                if to_stderr is None:
+                    message()  # type: ignore
+                elif to_stderr:
+                    self.output.write_stderr(message)
+                else:
+                    self.output.write_stdout(message)
+                if (
+                    self.effective_level != self.level
+                    and message_queue.qsize() <= self.queue_size // 4
+                ):
+                    # 队列已经排空了, 恢复原来的等级
+                    self.effective_level = self.level
+            except Exception:
+                traceback.print_exc(file=sys.__stderr__)
+            finally:
+                message_queue.task_done()
+
+    def _drop(self) -> None:
+        with self._drop_lock:
+            self.dropped_count += 1
+
+    def _put(self, message: LogMessage, to_stderr: bool) -> None:
+        """
+        按照 overflow_policy 把消息放进队列
+        :param message: message to write
+        :param to_stderr: write to stderr or not
+        :return: None
+        """
+        if not self.enable:
+            return None
+        if message.level < self.level:
+            return None
+        if message.level < self.effective_level:
+            self._drop()
+            return None
+        if message.stack_trace is not None:
+            # 后台线程格式化的时候 frame 早就执行到别的地方了
+            # 先记下当前的位置, 也不让队列拿着 frame (以及 frame 里所有的局部变量)
+            message.stack_trace = FrameInfo.from_frame(message.stack_trace)
+        item = (to_stderr, message)
+        try:
+            self.message_queue.put_nowait(item)
+            return None
+        except queue.Full:
+            pass
+        policy = self.overflow_policy
+        if policy == "drop_newest" or (
+            policy == "drop_below_level" and message.level < self.drop_level
+        ):
+            self._drop()
+            return None
+        if policy == "shed":
+            # 提高有效等级到下一个标准等级
+            for level in sorted(LogLevel.level_name_map):
+                if level > message.level:
+                    self.effective_level = max(self.effective_level, level)
+                    break
+            self._drop()
+            return None
+        try:
+            self.message_queue.put(item, timeout=self.block_timeout or None)
+        except queue.Full:
+            self._drop()
+        return None
+
+    def write_stdout(self, message: LogMessage) -> None:
+        self._put(message, False)
+        return None
+
+    def write_stderr(self, message: LogMessage) -> None:
+        self._put(message, True)
+        return None
+
+    def flush(self) -> None:
+        """
+        wait for all queued messages to be written, then flush the output
+        :return: None
+        """
+        if self.worker is not None and self.worker.is_alive():
+            self.message_queue.join()
+        self.output.flush()
+        return None
+
+    def close(self) -> None:
+        """
+        stop accepting messages, drain the queue and close the output
+        :return: None
+        """
+        if not self.enable:
+            return None
+        super().close()
+        if self.worker is not None and self.worker.is_alive():
+            self.message_queue.put(None)
+            self.worker.join()
+        self.output.flush()
+        self.output.close()
+        atexit.unregister(self.close)
+        return None
+
+
+class AsyncOutputStream(QueueOutputStream):
+    """
+    给 asyncio 用的 QueueOutputStream
+    写入永远不会阻塞 event loop, 并且提供 await 的 aflush / aclose
+    """
+
+    name = "AsyncOutputStream"
+
+    level: int = LogLevel.info
+    output: BaseOutputStream
+    queue_size: int = 10000
+    # 只允许不会阻塞的策略
+    overflow_policy: str = "drop_newest"
+
+    _overflow_policies = ("drop_newest", "shed")
+
+    async def aflush(self) -> None:
+        """
+        wait (without blocking the event loop) until all queued messages are written
+        and the wrapped output is flushed
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        if self.worker is None or not self.worker.is_alive():
+            await loop.run_in_executor(None, self.output.flush)
+            return None
+        future = loop.create_future()
+
+        def set_done(_: Any = None) -> None:
+            if not future.done():
+                future.set_result(None)
+
+        def barrier() -> None:
+            try:
+                self.output.flush()
+            finally:
+                loop.call_soon_threadsafe(set_done)
+
+        try:
+            self.message_queue.put_nowait((None, barrier))
+        except queue.Full:
+            # 队列满了就在 executor 里等
+            await loop.run_in_executor(None, self.message_queue.put, (None, barrier))
+        await future
+        return None
+
+    async def aclose(self) -> None:
+        """
+        drain the queue and close the wrapped output without blocking the event loop
+        :return: None
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+        return None
+
+
+class ExceptionDumper:
+    """
+    所有 RingBufferOutputStream 共用的 sys.excepthook / threading.excepthook
+    第一次注册的时候安装一次, 只保存 output 的弱引用
+    output close 或者被回收之后就不会再被 dump
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._outputs: "weakref.WeakSet[RingBufferOutputStream]" = weakref.WeakSet()
+        self._installed = False
+
+    def register(self, output: "RingBufferOutputStream") -> None:
+        """
+        Dump the output when an exception is not handled
+        :param output: output to dump
+        :return: None
+        """
+        with self._lock:
+            self._outputs.add(output)
+            if not self._installed:
+                self._install()
+                self._installed = True
+
+    def unregister(self, output: "RingBufferOutputStream") -> None:
+        """
+        Stop dumping the output
+        :param output: output registered before
+        :return: None
+        """
+        with self._lock:
+            self._outputs.discard(output)
+
+    def dump(self) -> None:
+        """
+        Dump every registered output
+        :return: None
+        """
+        with self._lock:
+            outputs = list(self._outputs)
+        for output in outputs:
+            try:
+                output.dump()
+            except Exception:
+                traceback.print_exc(file=sys.__stderr__)
+
+    def _install(self) -> None:
+        sys_hook = sys.excepthook
+        thread_hook = threading.excepthook
+
+        def excepthook(*args) -> None:
+            self.dump()
+            sys_hook(*args)
+
+        def thread_excepthook(args) -> None:
+            self.dump()
+            thread_hook(args)
+
+        sys.excepthook = excepthook
+        threading.excepthook = thread_excepthook
+
+
+exception_dumper = ExceptionDumper()
+
+
+class RingBufferOutputStream(BaseOutputStream):
+    """
+    "飞行记录仪"
+    每个 logger 只保留最近 buffer_size 条没有格式化过的消息
+    收到等级 >= trigger_level 的消息 / 手动调用 dump / 出现没有处理的异常 的时候
+    才把这些消息写入被包装的 output
+    """
+
+    name = "RingBufferOutputStream"
+
+    # 会被缓存的最低等级
+    level: int = LogLevel.debug
+    output: BaseOutputStream
+    # 每个 logger 最多缓存多少条消息
+    buffer_size: int = 1000
+    # 触发写入的等级
+    trigger_level: int = LogLevel.error
+    # 出现没有处理的异常的时候写入所有缓存
+    dump_on_exception: bool = True
+
+    _version_attrs = frozenset(("level", "enable", "output"))
+
+    def init(self, **kwargs) -> bool:
+        if "output" not in kwargs:
+            # 默认的输出要能写出缓存的低等级消息
+            self.output = StdioOutputStream(level=self.level)
+        self._lock = threading.Lock()
+        self._buffers: Dict[str, Deque[Tuple[bool, LogMessage]]] = {}
+        if self.dump_on_exception:
+            self.install_excepthook()
+        return False
+
+    @property
+    def required_fields(self) -> Optional[FrozenSet[str]]:
+        return self.output.required_fields
+
+    @property
+    def need_stack_trace(self) -> bool:
+        return self.output.need_stack_trace
+
+    def install_excepthook(self) -> None:
+        """
+        出现没有处理的异常 (sys.excepthook / threading.excepthook) 的时候 dump
+        close 的时候取消
+        :return: None
+        """
+        exception_dumper.register(self)
+
+    def _buffer(self, message: LogMessage, to_stderr: bool) -> None:
+        if not self.enable:
+            return None
+        if message.level < self.level:
+            return None
+        if message.level >= self.trigger_level:
+            self.dump(message.logger_name)
+            if to_stderr:
+                self.output.write_stderr(message)
+            else:
+                self.output.write_stdout(message)
+            return None
+        if message.stack_trace is not None:
+            # 不要让缓存拿着 frame (以及 frame 里所有的局部变量)
+            message.stack_trace = FrameInfo.from_frame(message.stack_trace)
+        with self._lock:
+            if (buffer := self._buffers.get(message.logger_name)) is None:
+                buffer = self._buffers[message.logger_name] = deque(maxlen=self.buffer_size)
+            buffer.append((to_stderr, message))
+        return None
+
+    def write_stdout(self, message: LogMessage) -> None:
+        self._buffer(message, False)
+        return None
+
+    def write_stderr(self, message: LogMessage) -> None:
+        self._buffer(message, True)
+        return None
+
+    def dump(self, logger_name: Optional[str] = None) -> None:
+        """
+        write buffered messages to the wrapped output (and clear them)
+        :param logger_name: only dump this logger (None -> all loggers)
+        :return: None
+        """
+        with self._lock:
+            if logger_name is None:
+                buffers = list(self._buffers.values())
+                self._buffers.clear()
+                records = [record for buffer in buffers for record in buffer]
+                # 多个 logger 的消息按时间排序
+                records.sort(key=lambda record: record[1].log_time)
+            else:
+                records = list(self._buffers.pop(logger_name, ()))
+        for to_stderr, message in records:
+            if to_stderr:
+                self.output.write_stderr(message)
+            else:
+                self.output.write_stdout(message)
+        return None
+
+    def clear(self) -> None:
+        """
+        drop all buffered messages
+        :return: None
+        """
+        with self._lock:
+            self._buffers.clear()
+        return None
+
+    def flush(self) -> None:
+        self.output.flush()
+        return None
+
+    def close(self) -> None:
+        super().close()
+        exception_dumper.unregister(self)
+        self.clear()
+        self.output.flush()
+        return None
+
+
+class DedupOutputStream(BaseOutputStream):
+    """
+    合并连续重复的消息
+    logger / 等级 / tag / 原始消息 都相同的消息只写入第一条
+    之后在 消息变化 / 超时 / flush 的时候写入一条 "last message repeated N times"
+    判断是否重复的时候不会格式化消息
+    """
+
+    name = "DedupOutputStream"
+
+    level: int = LogLevel.info
+    output: BaseOutputStream
+    # 第一条重复消息之后多少秒写入汇总 (0 表示只在消息变化 / flush 的时候写入)
+    timeout: float = 5.0
+    repeat_template: str = "last message repeated {count} times"
+
+    timer: Optional[threading.Timer] = None
+
+    _version_attrs = frozenset(("level", "enable", "output"))
+
+    def init(self, **kwargs) -> bool:
+        if "output" not in kwargs:
+            self.output = StdioOutputStream()
+        if "level" not in kwargs:
+            self.level = self.output.level
+        self._lock = threading.Lock()
+        # 上一条消息的 key
+        self._last_key: Optional[tuple] = None
+        # (重复次数, 最后一条重复的消息, to_stderr)
+        self._repeat: Optional[Tuple[int, LogMessage, bool]] = None
+        return False
+
+    @property
+    def required_fields(self) -> Optional[FrozenSet[str]]:
+        return self.output.required_fields
+
+    @property
+    def need_stack_trace(self) -> bool:
+        return self.output.need_stack_trace
+
+    @staticmethod
+    def message_key(message: LogMessage) -> tuple:
+        """
+        key used to compare messages (without formatting)
+        :param message: message
+        :return: key
+        """
+        return (
+            message.logger_name,
+            message.level,
+            message.logger_tag,
+            message.split,
+            message.end,
+            message.style,
+            tuple(message.messages),
+        )
+
+    def _pop_repeat(self) -> Optional[Tuple[LogMessage, bool]]:
+        """
+        取出等待写入的汇总 (需要持有 _lock)
+        :return: (汇总消息, to_stderr)
+        """
+        if self._repeat is None:
+            return None
+        count, last, to_stderr = self._repeat
+        self._repeat = None
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        repeat = LogMessage(
+            messages=[self.repeat_template.format(count=count)],
+            end=last.end,
+            flush=last.flush,
+            level=last.level,
+            log_time=last.log_time,
+            logger_name=last.logger_name,
+            logger_tag=last.logger_tag,
+        )
+        return repeat, to_stderr
+
+    def _write(self, message: LogMessage, to_stderr: bool) -> None:
+        if to_stderr:
+            self.output.write_stderr(message)
+        else:
+            self.output.write_stdout(message)
+
+    def _dedup(self, message: LogMessage, to_stderr: bool) -> None:
+        if not self.enable:
+            return None
+        if message.level < self.level:
+            return None
+        key = self.message_key(message)
+        with self._lock:
+            try:
+                same = key == self._last_key
+            except Exception:
+                # 消息里有不能比较的对象
+                same = False
+            if same:
+                if self._repeat is None:
+                    self._repeat = (1, message, to_stderr)
+                    if self.timeout > 0:
+                        self.timer = threading.Timer(self.timeout, self.write_repeat)
+                        self.timer.daemon = True
+                        self.timer.start()
+                else:
+                    self._repeat = (self._repeat[0] + 1, message, to_stderr)
+                return None
+            self._last_key = key
+            # 持有锁写入, 保证汇总在新消息之前
+            if (repeat := self._pop_repeat()) is not None:
+                self._write(*repeat)
+            self._write(message, to_stderr)
+        return None
+
+    def write_stdout(self, message: LogMessage) -> None:
+        self._dedup(message, False)
+        return None
+
+    def write_stderr(self, message: LogMessage) -> None:
+        self._dedup(message, True)
+        return None
+
+    def write_repeat(self) -> None:
+        """
+        write the pending "repeated N times" line now
+        :return: None
+        """
+        with self._lock:
+            if (repeat := self._pop_repeat()) is not None:
+                self._write(*repeat)
+        return None
+
+    def flush(self) -> None:
+        self.write_repeat()
+        self.output.flush()
+        return None
+
+    def close(self) -> None:
+        super().close()
+        self.flush()
+        return None
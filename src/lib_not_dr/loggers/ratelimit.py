@@ -0,0 +1,248 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+"""
+日志限流 / 采样
+一个在循环里疯狂 warn 的调用点不应该把磁盘写满
+
+RateLimitRule 描述对哪些消息 (tag / 调用点) 做什么限制:
+    rate + burst : 令牌桶, 每秒最多 rate 条, 最多攒 burst 条
+    every        : 每 N 条只保留 1 条
+    sample       : 按概率保留
+    first        : 只保留前 N 条 (first=1 就是 "只 log 一次")
+RateLimiter 挂在 Logger.rate_limit 上, 被丢掉的消息会被计数
+每隔 summary_interval 秒 (下一条消息到来的时候) 输出一行汇总
+"""
+
+import time
+import random
+import threading
+
+from types import FrameType
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple, Union
+
+from lib_not_dr.loggers import LogLevel
+from lib_not_dr.types.options import Options
+from lib_not_dr.loggers.structure import FrameInfo
+
+if TYPE_CHECKING:
+    from lib_not_dr.loggers.logger import Logger
+
+__all__ = [
+    "RateLimitRule",
+    "RateLimiter",
+]
+
+
+class RateLimitState:
+    """
+    一个限流 key (规则 + tag + 调用点) 的状态
+    """
+
+    __slots__ = ("label", "tokens", "last", "seen", "suppressed")
+
+    def __init__(self, label: str, tokens: float) -> None:
+        # 汇总里显示的名字 (调用点 或者 tag)
+        self.label = label
+        self.tokens = tokens
+        self.last = time.monotonic()
+        self.seen = 0
+        self.suppressed = 0
+
+
+class RateLimitRule(Options):
+    name = "RateLimitRule"
+
+    # 只对这个 tag 生效 (None 表示所有 tag)
+    tag: Optional[str] = None
+    # 只对这个调用点生效, "file.py:123" 或者 "file.py" (按后缀匹配, None 表示所有调用点)
+    call_site: Optional[str] = None
+    # 只限制等级 <= max_level 的消息
+    max_level: int = LogLevel.error
+    # 每个调用点单独计数, 否则同一个 tag 共用一个计数
+    per_call_site: bool = True
+
+    # 令牌桶: 每秒 rate 条 (0 表示不限制), 最多攒 burst 条
+    rate: float = 0
+    burst: int = 1
+    # 每 every 条保留一条
+    every: int = 1
+    # 保留的概率
+    sample: float = 1.0
+    # 只保留前 first 条 (0 表示不限制)
+    first: int = 0
+
+    def matches(self, tag: Optional[str], site: Optional[str]) -> bool:
+        """
+        Check if this rule applies to a message
+        :param tag: logger tag
+        :param site: "file:line" of the call site (None if unknown)
+        :return: True if matched
+        """
+        if self.tag is not None and tag != self.tag:
+            return False
+        if self.call_site is not None:
+            if site is None:
+                return False
+            file_name = site.rpartition(":")[0]
+            if not (site.endswith(self.call_site) or file_name.endswith(self.call_site)):
+                return False
+        return True
+
+    def new_state(self, label: str) -> RateLimitState:
+        return RateLimitState(label, float(max(self.burst, 1)))
+
+    def check(self, state: RateLimitState) -> bool:
+        """
+        Update the state with a new message
+        :param state: state of the key
+        :return: True if the message should be written
+        """
+        state.seen += 1
+        if self.first and state.seen > self.first:
+            return False
+        if self.every > 1 and (state.seen - 1) % self.every:
+            return False
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return False
+        if self.rate > 0:
+            now = time.monotonic()
+            state.tokens = min(
+                state.tokens + (now - state.last) * self.rate, float(max(self.burst, 1))
+            )
+            state.last = now
+            if state.tokens < 1.0:
+                return False
+            state.tokens -= 1.0
+        return True
+
+
+# (tag, 文件名, 行号) -> (规则, 状态), 没有匹配的规则时是 None
+CacheKey = Tuple[Optional[str], Optional[str], Optional[int]]
+Matched = Optional[Tuple[RateLimitRule, RateLimitState]]
+
+
+class RateLimiter(Options):
+    name = "RateLimiter"
+
+    # 按顺序匹配, 使用第一个匹配的规则
+    rules: List[RateLimitRule] = []
+    # 汇总的间隔 (秒), 0 表示不输出汇总
+    summary_interval: float = 60.0
+    # 汇总消息的等级
+    summary_level: int = LogLevel.warn
+    # 汇总里最多列出多少个 key
+    summary_limit: int = 10
+
+    def init(self, **kwargs) -> bool:
+        self.rules = list(self.rules)
+        self._lock = threading.Lock()
+        # 正在写汇总的线程 (汇总本身不受限流影响)
+        self._summary_threads: Set[int] = set()
+        self._matched: Dict[CacheKey, Matched] = {}
+        self._states: Dict[tuple, RateLimitState] = {}
+        self._last_summary = time.monotonic()
+        # 有规则需要区分调用点的时候才需要获取 frame
+        self.need_call_site = any(
+            rule.per_call_site or rule.call_site is not None for rule in self.rules
+        )
+        return False
+
+    def _match(self, key: CacheKey) -> Matched:
+        tag, file_name, line = key
+        site = None if file_name is None else f"{file_name}:{line}"
+        for index, rule in enumerate(self.rules):
+            if rule.matches(tag, site):
+                state_key = (index, tag, site if rule.per_call_site else None)
+                if (state := self._states.get(state_key)) is None:
+                    label = site if state_key[2] is not None else f"tag {tag!r}"
+                    state = self._states[state_key] = rule.new_state(label)
+                return rule, state
+        return None
+
+    def allow(
+        self,
+        logger: "Logger",
+        level: int,
+        tag: Optional[str],
+        frame: Optional[Union[FrameType, FrameInfo]] = None,
+    ) -> bool:
+        """
+        Decide whether a message should be written
+        :param logger: the logger (used to write the summary)
+        :param level: level of the message
+        :param tag: tag of the message
+        :param frame: call site of the message
+        :return: True if the message should be written
+        """
+        if self._summary_threads and threading.get_ident() in self._summary_threads:
+            return True
+        if frame is not None and self.need_call_site:
+            key = (tag, frame.f_code.co_filename, frame.f_lineno)
+        else:
+            key = (tag, None, None)
+        with self._lock:
+            if (matched := self._matched.get(key, False)) is False:
+                if len(self._matched) > 4096:
+                    self._matched.clear()
+                matched = self._matched[key] = self._match(key)
+            if matched is None or level > matched[0].max_level:
+                allowed = True
+            else:
+                allowed = matched[0].check(matched[1])
+                if not allowed:
+                    matched[1].suppressed += 1
+        if (
+            self.summary_interval > 0
+            and time.monotonic() - self._last_summary >= self.summary_interval
+        ):
+            self.write_summary(logger)
+        return allowed
+
+    def pop_suppressed(self) -> Dict[str, int]:
+        """
+        Get and reset the suppressed count of every key
+        :return: {call site / tag: count}
+        """
+        counts: Dict[str, int] = {}
+        with self._lock:
+            self._last_summary = time.monotonic()
+            for state in self._states.values():
+                if state.suppressed:
+                    counts[state.label] = counts.get(state.label, 0) + state.suppressed
+                    state.suppressed = 0
+        return counts
+
+    def summary(self) -> Optional[str]:
+        """
+        Build the summary line and reset the counts
+        :return: summary line (None if nothing was suppressed)
+        """
+        counts = self.pop_suppressed()
+        if not counts:
+            return None
+        total = sum(counts.values())
+        items = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        text = ", ".join(f"{key} x{count}" for key, count in items[: self.summary_limit])
+        if len(items) > self.summary_limit:
+            text += f", ... ({len(items) - self.summary_limit} more)"
+        return f"rate limit suppressed {total} messages: {text}"
+
+    def write_summary(self, logger: "Logger") -> None:
+        """
+        Write the summary line with the logger (skips the rate limit)
+        :param logger: logger to write to
+        :return: None
+        """
+        if (text := self.summary()) is None:
+            return None
+        ident = threading.get_ident()
+        self._summary_threads.add(ident)
+        try:
+            logger.make_log(messages=[text], level=self.summary_level, tag="rate-limit")
+        finally:
+            self._summary_threads.discard(ident)
+        return None
@@ -0,0 +1,345 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+"""
+日志文件轮换
+FileCacheOutputStream(rotation=[...]) 使用
+
+RotationPolicy 在文件打开的时候预先算好下一次轮换的时间点
+写入的时候只需要比较 大小 / 时间, 不访问文件系统
+轮换下来的文件的 压缩 和 清理 (数量 / 时间) 都在后台线程里做, 不会阻塞写日志
+多个进程写同一个文件的时候用 RotationLock 保证只有一个进程轮换
+"""
+
+import os
+import sys
+import gzip
+import lzma
+import time
+import queue
+import shutil
+import threading
+import traceback
+
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Type, Union
+
+from lib_not_dr.types.options import Options
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+__all__ = [
+    "RotationPolicy",
+    "SizeRotation",
+    "IntervalRotation",
+    "DailyRotation",
+    "HourlyRotation",
+    "RotationWorker",
+    "RotationLock",
+    "rotation_worker",
+    "parse_rotation",
+    "compress_file",
+    "clean_rotated",
+]
+
+# 压缩方式 -> (打开函数, 后缀)
+COMPRESSIONS: Dict[str, Any] = {
+    "gzip": (gzip.open, ".gz"),
+    "lzma": (lzma.open, ".xz"),
+}
+
+
+class RotationPolicy(Options):
+    name = "RotationPolicy"
+
+    def start(self, created: float) -> None:
+        """
+        A new file is opened, precompute the next rotation
+        :param created: time when the file was created (time.time())
+        :return: None
+        """
+
+    def should_rotate(self, size: int, now: float) -> bool:
+        """
+        Check if the file should be rotated before writing
+        :param size: size of the file (bytes)
+        :param now: time.time()
+        :return: True if the file should be rotated
+        """
+        raise NotImplementedError(f"{self.__class__.__name__}.should_rotate is not implemented")
+
+
+class SizeRotation(RotationPolicy):
+    name = "SizeRotation"
+
+    # 文件超过多少 byte 的时候轮换
+    max_size: int = 10 * 1024 * 1024
+
+    def should_rotate(self, size: int, now: float) -> bool:
+        return size >= self.max_size
+
+
+class IntervalRotation(RotationPolicy):
+    name = "IntervalRotation"
+
+    # 文件创建之后多少秒轮换
+    interval: float = 3600
+    next_rotation: float = 0.0
+
+    def start(self, created: float) -> None:
+        self.next_rotation = created + self.interval
+
+    def should_rotate(self, size: int, now: float) -> bool:
+        return now >= self.next_rotation
+
+
+class DailyRotation(RotationPolicy):
+    name = "DailyRotation"
+
+    # 每天 hour:minute 轮换
+    hour: int = 0
+    minute: int = 0
+    # 使用 UTC 而不是本地时间
+    utc: bool = False
+    next_rotation: float = 0.0
+
+    def start(self, created: float) -> None:
+        self.next_rotation = self.next_boundary(created)
+
+    def next_boundary(self, after: float) -> float:
+        """
+        get the first rotation time after a time
+        :param after: time.time()
+        :return: time.time() of the boundary
+        """
+        if self.utc:
+            day_start = after - after % 86400
+            boundary = day_start + self.hour * 3600 + self.minute * 60
+            if boundary <= after:
+                boundary += 86400
+            return boundary
+        local = time.localtime(after)
+        for day in (local.tm_mday, local.tm_mday + 1):
+            # mktime 会处理 夏令时 和 跨月 (tm_mday + 1)
+            boundary = time.mktime(
+                (local.tm_year, local.tm_mon, day, self.hour, self.minute, 0, 0, 0, -1)
+            )
+            if boundary > after:
+                return boundary
+        return boundary
+
+    def should_rotate(self, size: int, now: float) -> bool:
+        return now >= self.next_rotation
+
+
+class HourlyRotation(RotationPolicy):
+    name = "HourlyRotation"
+
+    # 每个小时的第 minute 分钟轮换
+    minute: int = 0
+    next_rotation: float = 0.0
+
+    def start(self, created: float) -> None:
+        # 按照本地时间的整点算 (有些时区的偏移不是整小时)
+        offset = time.localtime(created).tm_gmtoff or 0
+        hour_start = created - (created + offset) % 3600
+        boundary = hour_start + self.minute * 60
+        if boundary <= created:
+            boundary += 3600
+        self.next_rotation = boundary
+
+    def should_rotate(self, size: int, now: float) -> bool:
+        return now >= self.next_rotation
+
+
+ROTATION_POLICIES: Dict[str, Type[RotationPolicy]] = {
+    "SizeRotation": SizeRotation,
+    "IntervalRotation": IntervalRotation,
+    "DailyRotation": DailyRotation,
+    "HourlyRotation": HourlyRotation,
+}
+
+
+def parse_rotation(policy: Union[RotationPolicy, Dict[str, Any]]) -> RotationPolicy:
+    """
+    Get a rotation policy from a config dict ({"class": "DailyRotation", ...})
+    :param policy: policy or config
+    :return: policy
+    """
+    if isinstance(policy, RotationPolicy):
+        return policy
+    config = dict(policy)
+    class_name = config.pop("class", None)
+    if class_name not in ROTATION_POLICIES:
+        raise ValueError(f"unknown rotation policy {class_name!r}")
+    return ROTATION_POLICIES[class_name](**config)
+
+
+def compress_file(path: Path, compression: str) -> Path:
+    """
+    Compress a file, then remove the original one
+    :param path: file to compress
+    :param compression: gzip / lzma
+    :return: compressed file
+    """
+    opener, suffix = COMPRESSIONS[compression]
+    target = path.with_name(path.name + suffix)
+    temp = path.with_name(path.name + suffix + ".tmp")
+    with path.open("rb") as source, opener(temp, "wb") as compressed:
+        shutil.copyfileobj(source, compressed, 1024 * 1024)
+    # 保留原来的修改时间, 清理的时候按照这个时间算
+    stat = path.stat()
+    os.utime(temp, (stat.st_atime, stat.st_mtime))
+    os.replace(temp, target)
+    path.unlink()
+    return target
+
+
+def clean_rotated(
+    directory: Path, prefix: str, max_count: int = 0, max_age: float = 0
+) -> List[Path]:
+    """
+    Remove old rotated files (name starts with prefix)
+    :param directory: directory of the log files
+    :param prefix: prefix of the rotated files (like "latest.log.")
+    :param max_count: keep at most this many files (0 -> no limit)
+    :param max_age: remove files older than this many seconds (0 -> no limit)
+    :return: removed files
+    """
+    files = []
+    for file in directory.iterdir():
+        if file.name.startswith(prefix) and not file.name.endswith(".tmp"):
+            try:
+                files.append((file.stat().st_mtime, file))
+            except FileNotFoundError:
+                continue
+    # 新的在前
+    files.sort(reverse=True)
+    now = time.time()
+    removed = []
+    for index, (mtime, file) in enumerate(files):
+        if (max_count > 0 and index >= max_count) or (max_age > 0 and now - mtime > max_age):
+            try:
+                file.unlink()
+            except FileNotFoundError:
+                continue
+            removed.append(file)
+    return removed
+
+
+class RotationLock:
+    """
+    多个进程写同一个日志文件时的锁 (.{file_name}.lock)
+    写入一批数据的时候拿共享锁, 轮换的时候拿排他锁
+    所以轮换的时候没有进程在写, 轮换之后其他进程看到文件变了就重新打开
+    Windows 上没有共享锁, 两种都是排他锁
+    """
+
+    def __init__(self, file: Path) -> None:
+        """
+        :param file: the log file
+        """
+        self.path = file.with_name(f".{file.name}.lock")
+        self._fd: Optional[int] = None
+        self._locked = False
+
+    def lock(self, exclusive: bool = False) -> None:
+        """
+        Acquire (or convert) the lock, blocks until acquired
+        :param exclusive: exclusive (rotate) or shared (write)
+        :return: None
+        """
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            # 已经持有的时候 flock 会转换锁的类型
+            fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        elif not self._locked:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            while True:
+                try:
+                    msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK 重试 10 次之后放弃, 继续等
+                    continue
+        self._locked = True
+
+    def unlock(self) -> None:
+        """
+        Release the lock
+        :return: None
+        """
+        if self._fd is None or not self._locked:
+            return None
+        self._locked = False
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        return None
+
+    def close(self) -> None:
+        """
+        Release the lock and close the lock file (the file is kept for other processes)
+        :return: None
+        """
+        self.unlock()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        return None
+
+
+class RotationWorker:
+    """
+    后台处理轮换下来的文件 (压缩 / 清理)
+    所有 output 共用一个线程, 按照提交的顺序执行
+    """
+
+    def __init__(self) -> None:
+        self.tasks: "queue.Queue[Callable[[], Any]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, task: Callable[[], Any]) -> None:
+        """
+        Run a task on the worker thread
+        :param task: function without arguments
+        :return: None
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="lib-not-dr-rotation", daemon=True
+                )
+                self._thread.start()
+        self.tasks.put(task)
+
+    def wait(self) -> None:
+        """
+        Wait until all submitted tasks are done
+        :return: None
+        """
+        self.tasks.join()
+
+    def _run(self) -> None:
+        while True:
+            task = self.tasks.get()
+            try:
+                task()
+            except Exception:
+                traceback.print_exc(file=sys.__stderr__)
+            finally:
+                self.tasks.task_done()
+
+
+rotation_worker = RotationWorker()
@@ -5,27 +5,200 @@
 #  -------------------------------
 
 import time
+import inspect
 
 from pathlib import Path
 from types import FrameType
-from typing import List, Optional, Tuple, Dict, Union
+from typing import (
+    Any,
+    Callable,
+    FrozenSet,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Dict,
+    Union,
+)
 
-__all__ = ["LogMessage", "FormattingMessage"]
+__all__ = [
+    "LogMessage",
+    "LazyValue",
+    "lazy",
+    "FormattingMessage",
+    "LogConfigVersion",
+    "FrameInfo",
+    "CodeInfo",
+    "LogRecord",
+    "STACK_TRACE_FIELDS",
+]
+
+# 需要堆栈信息才能格式化的字段
+STACK_TRACE_FIELDS: FrozenSet[str] = frozenset(
+    ("log_source", "log_line", "log_function", "stack_trace")
+)
+
+
+class LogConfigVersion:
+    """
+    全局的日志配置版本号
+    formatter 的模板 / output 的等级 / logger 的输出 发生变化时 +1
+    Logger 用它来判断缓存下来的东西是否需要重新计算
+    """
+
+    version: int = 0
+
+    @classmethod
+    def bump(cls) -> None:
+        cls.version += 1
+
+
+class CodeInfo(NamedTuple):
+    co_filename: str
+    co_name: str
+
+
+class FrameInfo(NamedTuple):
+    """
+    一个可以序列化的 "frame"
+    只保留了 formatter 需要的 f_code.co_filename / f_code.co_name / f_lineno
+    """
+
+    f_code: CodeInfo
+    f_lineno: int
+
+    @classmethod
+    def from_frame(cls, frame: Union[FrameType, "FrameInfo"]) -> "FrameInfo":
+        if isinstance(frame, FrameInfo):
+            return frame
+        return cls(CodeInfo(frame.f_code.co_filename, frame.f_code.co_name), frame.f_lineno)
+
+    @classmethod
+    def from_tuple(cls, trace: Tuple[str, int, str]) -> "FrameInfo":
+        return cls(CodeInfo(trace[0], trace[2]), trace[1])
+
+    def as_tuple(self) -> Tuple[str, int, str]:
+        return self.f_code.co_filename, self.f_lineno, self.f_code.co_name
+
+
+class LazyValue:
+    """
+    延迟计算的值
+    只有在真的需要格式化的时候才会调用函数, 并且只会调用一次
+    """
+
+    __slots__ = ("func", "_value", "_done")
+
+    def __init__(self, func: Callable[[], Any]) -> None:
+        self.func = func
+        self._value: Any = None
+        self._done = False
+
+    def get(self) -> Any:
+        if not self._done:
+            self._value = self.func()
+            self._done = True
+        return self._value
+
+    def __str__(self) -> str:
+        return str(self.get())
+
+    def __format__(self, format_spec: str) -> str:
+        return format(self.get(), format_spec)
+
+    def __repr__(self) -> str:
+        return f"<LazyValue {self.func!r}>"
+
+
+def _evaluate_argument(arg: Any) -> Any:
+    """
+    计算模板参数里延迟计算的值 (LazyValue 或者不需要参数的函数)
+    其他的参数 (包括需要参数的函数和类) 原样返回
+    计算的时候报错就用 repr 代替, 不会让 log 本身报错
+    :param arg: argument of a template message
+    :return: value to format
+    """
+    if isinstance(arg, LazyValue):
+        function = arg.get
+    elif callable(arg) and not isinstance(arg, type):
+        try:
+            inspect.signature(arg).bind()
+        except (TypeError, ValueError):
+            # 需要参数 (比如 log 一个回调函数) 或者拿不到签名, 不是延迟计算的值
+            return arg
+        function = arg
+    else:
+        return arg
+    try:
+        return function()
+    except Exception:
+        return repr(arg)
+
+
+def _safe_str(item: Any) -> str:
+    """
+    str(item), 报错的时候用不会报错的 object.__repr__ 代替
+    """
+    try:
+        return str(item)
+    except Exception:
+        return object.__repr__(item)
+
+
+def lazy(func: Callable[[], Any]) -> LazyValue:
+    """
+    把一个无参数的函数包装成延迟计算的值
+    logger.debug("result:", lazy(lambda: expensive()))
+    :param func: zero-arg callable
+    :return: LazyValue
+    """
+    return LazyValue(func)
+
+
+# (messages, end, flush, level, log_time, logger_name, logger_tag, (file, line, function))
+LogRecord = Tuple[
+    str, str, Optional[bool], int, int, str, Optional[str], Optional[Tuple[str, int, str]]
+]
 
 
 class LogMessage:
+    # 用 __slots__ 减少每条消息的内存占用和创建开销
+    # 默认值都在 __init__ 里
+    __slots__ = (
+        "messages",
+        "end",
+        "split",
+        "flush",
+        "level",
+        "log_time",
+        "logger_name",
+        "logger_tag",
+        "stack_trace",
+        "style",
+        "_text_cache",
+    )
+
     # 消息内容本身的属性
-    messages: List[str] = []
-    end: str = "\n"
-    split: str = " "
+    messages: List[str]
+    end: str
+    split: str
 
     # 消息的属性
-    flush: Optional[bool] = None
-    level: int = 20  # info
-    log_time: float = 0.0  # time.time_ns() if None
-    logger_name: str = "root"
-    logger_tag: Optional[str] = None
-    stack_trace: Optional[FrameType] = None
+    flush: Optional[bool]
+    level: int  # info
+    log_time: float  # time.time_ns() if None
+    logger_name: str
+    logger_tag: Optional[str]
+    stack_trace: Optional[Union[FrameType, FrameInfo]]
+    # None -> 用 split 拼接 messages
+    # "{"  -> messages[0].format(*messages[1:])
+    # "%"  -> messages[0] % messages[1:]
+    # 使用模板的时候, 参数里无参数的函数会在格式化的时候被调用
+    style: Optional[str]
+
+    # 缓存的格式化结果 (messages, split, style, text)
+    _text_cache: Optional[tuple]
 
     def __init__(
         self,
@@ -37,7 +210,8 @@ class LogMessage:
         log_time: Optional[float] = None,
         logger_name: str = "root",
         logger_tag: Optional[str] = None,
-        stack_trace: Optional[FrameType] = None,
+        stack_trace: Optional[Union[FrameType, FrameInfo]] = None,
+        style: Optional[str] = None,
     ) -> None:
         """
         Init for LogMessage
@@ -50,6 +224,7 @@ class LogMessage:
         :param logger_name: name of loggers
         :param logger_tag: tag of loggers
         :param stack_trace: stack trace of loggers
+        :param style: None (join with split) / "{" (str.format) / "%" (printf style)
         """
         # 20231128 23:23
         # 因为 Options 的初始化太慢了 所以改为不继承 直接编写
@@ -61,6 +236,8 @@ class LogMessage:
         self.logger_name = logger_name
         self.logger_tag = logger_tag
         self.stack_trace = stack_trace
+        self.style = style
+        self._text_cache = None
 
         if log_time is None:
             log_time = time.time_ns()
@@ -82,22 +259,110 @@ class LogMessage:
             "logger_name": self.logger_name,
             "logger_tag": self.logger_tag,
             "stack_trace": self.stack_trace,
+            "style": self.style,
         }
 
-    def format_message(self) -> str:
+    def to_record(self) -> LogRecord:
+        """
+        转换成只包含基础类型的 tuple, 可以直接 pickle / 发送给其他进程
+        messages 会被提前转换成字符串, stack_trace 只保留 文件名 / 行号 / 函数名
+        :return: record
+        """
+        trace = self.stack_trace
+        return (
+            self.format_text(),
+            self.end,
+            self.flush,
+            self.level,
+            self.log_time,
+            self.logger_name,
+            self.logger_tag,
+            None if trace is None else FrameInfo.from_frame(trace).as_tuple(),
+        )
+
+    @classmethod
+    def from_record(cls, record: Union[LogRecord, List[Any]]) -> "LogMessage":
+        """
+        Rebuild a message from LogMessage.to_record
+        :param record: record
+        :return: message
+        """
+        text, end, flush, level, log_time, logger_name, logger_tag, trace = record
+        return cls(
+            messages=[text],
+            end=end,
+            flush=flush,
+            level=level,
+            log_time=log_time,
+            logger_name=logger_name,
+            logger_tag=logger_tag,
+            stack_trace=None if trace is None else FrameInfo.from_tuple(trace),
+        )
+
+    def format_text(self) -> str:
+        """
+        格式化 messages (不包括 end)
+        结果会被缓存, 多个 output 格式化同一条消息的时候只会转换一次
+        :return: formatted text
+        """
         if self.split is None:
             self.split = " "
-        return self.split.join(str(item) for item in self.messages) + self.end
-
-    def format_for_message(self) -> Dict[str, str]:
-        basic_info = self.option()
+        cache = self._text_cache
+        if (
+            cache is not None
+            and cache[0] is self.messages
+            and cache[1] is self.split
+            and cache[2] is self.style
+        ):
+            return cache[3]
+        if self.style is None:
+            text = self.split.join(str(item) for item in self.messages)
+        else:
+            text = self._format_style()
+        self._text_cache = (self.messages, self.split, self.style, text)
+        return text
 
-        if self.logger_tag is None:
-            basic_info["logger_tag"] = "   "
+    def _format_style(self) -> str:
+        """
+        用模板格式化 messages
+        格式化失败的时候退回到用 split 拼接, 不会让 log 本身报错
+        :return: formatted text
+        """
+        if not self.messages:
+            return ""
+        template = str(self.messages[0])
+        args = tuple(_evaluate_argument(arg) for arg in self.messages[1:])
+        try:
+            if self.style == "{":
+                return template.format(*args)
+            if self.style == "%":
+                if not args:
+                    return template
+                if len(args) == 1 and isinstance(args[0], Mapping):
+                    return template % args[0]
+                return template % args
+        except Exception:
+            # 模板写错了 ({0.foo} 之类) 或者参数的 __str__ 报错
+            pass
+        return self.split.join(_safe_str(item) for item in (template,) + args)
 
-        basic_info["messages"] = self.format_message()
+    def format_message(self) -> str:
+        return self.format_text() + self.end
 
-        return basic_info
+    def format_for_message(self) -> Dict[str, str]:
+        tag = self.logger_tag
+        return {
+            "messages": self.format_message(),
+            "end": self.end,
+            "split": self.split,
+            "flush": self.flush,
+            "level": self.level,
+            "log_time": self.log_time,
+            "logger_name": self.logger_name,
+            "logger_tag": "   " if tag is None else tag,
+            "stack_trace": self.stack_trace,
+            "style": self.style,
+        }
 
     @property
     def create_msec_3(self) -> int:
@@ -0,0 +1,136 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+"""
+日志流程的分阶段计时
+Logger / BaseFormatter / BaseOutputStream 的 enable_timing() 把实例上的方法换成带计时的版本
+disable_timing() 换回去, 所以不计时的时候没有任何额外开销 (连一个 if 都没有)
+Logger 的两个版本共用 获取堆栈信息 / 创建消息 的函数
+output 计时的是自己的 formatter 副本, 不会影响共用同一个 formatter 的其他 output
+
+阶段是嵌套的, 外层的时间包括内层:
+    logger.make_log
+        logger.route / logger.stack_trace / logger.rate_limit / logger.message
+        logger.write
+            output.{name}.write_stdout / write_stderr
+                formatter.format_message / formatter.format_bytes (实际使用的融合的渲染函数)
+                或者 (stages=True, 不使用融合的渲染函数, 只能用来比较各阶段的相对开销):
+                formatter.fields / formatter.{sub formatter} / formatter.color.{color formatter}
+                formatter.template / formatter.encode
+    output.{name}.flush
+"""
+
+import threading
+
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, List
+
+__all__ = [
+    "StageTimer",
+    "StageClock",
+    "pipeline_timer",
+    "timed",
+]
+
+
+class StageTimer:
+    """
+    累计每个阶段的 耗时 (perf_counter_ns) 和 调用次数
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # stage -> [总耗时 (ns), 调用次数]
+        self._stages: Dict[str, List[int]] = {}
+
+    def add(self, stage: str, elapsed: int) -> None:
+        """
+        Record one call of a stage
+        :param stage: name of the stage
+        :param elapsed: time used (ns)
+        :return: None
+        """
+        with self._lock:
+            if (stat := self._stages.get(stage)) is None:
+                stat = self._stages[stage] = [0, 0]
+            stat[0] += elapsed
+            stat[1] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """
+        Get the current statistics
+        :return: {stage: {"calls": ..., "total_ns": ..., "mean_ns": ...}}
+        """
+        with self._lock:
+            stages = {stage: (total, calls) for stage, (total, calls) in self._stages.items()}
+        return {
+            stage: {"calls": calls, "total_ns": total, "mean_ns": total // calls}
+            for stage, (total, calls) in sorted(stages.items())
+        }
+
+    def reset(self) -> None:
+        """
+        Clear all statistics
+        :return: None
+        """
+        with self._lock:
+            self._stages.clear()
+
+
+class StageClock:
+    """
+    按顺序记录一次调用里相邻阶段的耗时
+    每个阶段的耗时是 从上一次 mark (或者创建) 到这一次 mark
+    """
+
+    __slots__ = ("add", "begin", "last")
+
+    def __init__(self, timer: StageTimer) -> None:
+        self.add = timer.add
+        self.begin = self.last = perf_counter_ns()
+
+    def mark(self, stage: str) -> None:
+        """
+        Record the time since the previous mark as a stage
+        :param stage: name of the stage
+        :return: None
+        """
+        now = perf_counter_ns()
+        self.add(stage, now - self.last)
+        self.last = now
+
+    def total(self, stage: str) -> None:
+        """
+        Record the time since the clock was created as a stage
+        :param stage: name of the stage
+        :return: None
+        """
+        self.add(stage, perf_counter_ns() - self.begin)
+
+
+# enable_timing() 默认使用的计时器
+pipeline_timer = StageTimer()
+
+
+def timed(function: Callable[..., Any], timer: StageTimer, stage: str) -> Callable[..., Any]:
+    """
+    Wrap a function to record its time as a stage
+    :param function: function to wrap
+    :param timer: timer to record to
+    :param stage: name of the stage
+    :return: wrapped function
+    """
+    add = timer.add
+
+    def wrapper(*args, **kwargs) -> Any:
+        start = perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            add(stage, perf_counter_ns() - start)
+
+    wrapper.__wrapped__ = function  # type: ignore
+    return wrapper
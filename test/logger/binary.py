@@ -0,0 +1,79 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+import inspect
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from lib_not_dr.loggers.structure import LogMessage
+from lib_not_dr.loggers.formatter import StdFormatter
+from lib_not_dr.loggers.binary import BinaryFileOutputStream, BinaryLogReader
+
+
+class BinaryLogTest(unittest.TestCase):
+    def test_round_trip(self):
+        formatter = StdFormatter(enable_color=False)
+        formatter.template = (
+            "${log_time}|${logger_name}|${logger_tag}|${log_source}:${log_line}"
+            "|${log_function}|${level}|${messages}"
+        )
+        messages = [
+            LogMessage(
+                messages=["hello", i, "世界"],
+                level=level,
+                logger_name=f"logger-{i % 3}",
+                logger_tag=None if i % 2 else "tag",
+                stack_trace=inspect.currentframe(),
+                end="\n" if i % 4 else "",
+                flush=None if i % 5 else True,
+            )
+            for i, level in enumerate((0, 5, 10, 20, 30, 40, 50, 20, 20, 20))
+        ]
+        with tempfile.TemporaryDirectory() as log_dir:
+            # 两次打开同一个文件, 每次都是新的一段
+            for part in (messages[:5], messages[5:]):
+                output = BinaryFileOutputStream(
+                    file_path=Path(log_dir), file_name="test.lndl", level=0
+                )
+                for message in part:
+                    output.write_stdout(message)
+                output.close()
+            decoded = list(BinaryLogReader(Path(log_dir) / "test.lndl"))
+        self.assertEqual(len(decoded), len(messages))
+        for message, result in zip(messages, decoded):
+            self.assertEqual(formatter.format_message(result), formatter.format_message(message))
+            self.assertEqual(result.flush, message.flush)
+            self.assertEqual(result.log_time, message.log_time)
+
+    def test_truncated_file(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            output = BinaryFileOutputStream(file_path=Path(log_dir), file_name="test.lndl")
+            for i in range(10):
+                output.write_stdout(LogMessage(messages=[i]))
+            output.close()
+            file = Path(log_dir) / "test.lndl"
+            data = file.read_bytes()
+            file.write_bytes(data[:-3])
+            decoded = list(BinaryLogReader(file))
+        self.assertEqual([m.messages for m in decoded], [[str(i)] for i in range(9)])
+
+    def test_append_after_crash(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            file = Path(log_dir) / "test.lndl"
+            output = BinaryFileOutputStream(file_path=Path(log_dir), file_name="test.lndl")
+            for text in ("first", "second"):
+                output.write_stdout(LogMessage(messages=[text]))
+            output.close()
+            # 写第二条的时候崩溃了
+            file.write_bytes(file.read_bytes()[:-3])
+            output = BinaryFileOutputStream(file_path=Path(log_dir), file_name="test.lndl")
+            for text in ("third", "fourth"):
+                output.write_stdout(LogMessage(messages=[text]))
+            output.close()
+            decoded = list(BinaryLogReader(file))
+        self.assertEqual([m.messages for m in decoded], [["first"], ["third"], ["fourth"]])
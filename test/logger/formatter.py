@@ -4,11 +4,26 @@
 #  All rights reserved
 #  -------------------------------
 
+import os
+import json
+import time
 import inspect
 import unittest
 
-from lib_not_dr.loggers.formatter import BaseFormatter, MainFormatter
-from lib_not_dr.loggers.structure import LogMessage
+from string import Template
+
+from lib_not_dr.loggers import LogLevel
+from lib_not_dr.loggers.config import ConfigStorage
+from lib_not_dr.loggers.formatter import (
+    BaseFormatter,
+    MainFormatter,
+    StdFormatter,
+    JsonFormatter,
+    orjson,
+)
+from lib_not_dr.loggers.formatter.colors import LevelColorFormatter
+from lib_not_dr.loggers.formatter.template import CompiledTemplate
+from lib_not_dr.loggers.structure import LogMessage, FrameInfo
 
 
 class FormatterTest(unittest.TestCase):
@@ -44,3 +59,198 @@ class FormatterTest(unittest.TestCase):
     def test_std_formatter(self):
         formatter = BaseFormatter()
         formatter.info()
+
+    def test_compiled_template(self):
+        info = {"a": 1, "b": "text"}
+        for template in (
+            "${a}|$b|${c}",
+            "$$a ${a}$$",
+            "no field",
+            "",
+            "${a} $ {b} ${",
+        ):
+            self.assertEqual(
+                CompiledTemplate(template).render(info),
+                Template(template).safe_substitute(info),
+            )
+
+    def test_compiled_std_formatter(self):
+        message = LogMessage(
+            messages=["test", 1],
+            logger_tag="tag",
+            stack_trace=inspect.currentframe(),
+        )
+        templates = (
+            None,
+            "${log_time}|${logger_name}|${logger_tag}|${log_source}:${log_line}"
+            "|${log_function}|${level}|${messages}",
+            "${level} ${missing} ${end}${split}${flush}",
+            "${level} ${stack_trace} ${log_line} ${messages}",
+        )
+        for enable_color in (True, False):
+            compiled = StdFormatter(enable_color=enable_color)
+            legacy = StdFormatter(enable_color=enable_color, compile_template=False)
+            for template in templates:
+                if template is not None:
+                    compiled.template = template
+                    legacy.template = template
+                for test_level in self.test_levels + (3, 15, 25, 45, 60):
+                    message.level = test_level
+                    self.assertEqual(
+                        compiled.format_message(message), legacy.format_message(message)
+                    )
+                    # 没有堆栈信息的消息
+                    no_trace = LogMessage(messages=["test"], level=test_level)
+                    self.assertEqual(
+                        compiled.format_message(no_trace), legacy.format_message(no_trace)
+                    )
+
+    def test_time_format_cache(self):
+        formatter = MainFormatter()
+        message = LogMessage()
+        old_tz = os.environ.get("TZ")
+        try:
+            if hasattr(time, "tzset"):
+                os.environ["TZ"] = "Europe/Berlin"
+                time.tzset()
+            # 2023-03-26 01:59:59 UTC 前后 (夏令时切换)
+            start = 1679795998
+            for time_format in ("%Y-%m-%d %H:%M:%S", "%H:%M:%S %Z"):
+                formatter.time_format = time_format
+                for offset_ms in range(0, 4000, 333):
+                    message.log_time = (start * 1000 + offset_ms) * 1000000
+                    local = time.localtime(message.log_time / 1000000000)
+                    expect = "{}-{:03d}".format(
+                        time.strftime(time_format, local), message.create_msec_3
+                    )
+                    self.assertEqual(formatter._format((message, {}))[1]["log_time"], expect)
+        finally:
+            if old_tz is None:
+                os.environ.pop("TZ", None)
+            else:
+                os.environ["TZ"] = old_tz
+            if hasattr(time, "tzset"):
+                time.tzset()
+
+    def test_time_mode(self):
+        formatter = MainFormatter()
+        message = LogMessage(log_time=1701184980123 * 1000000)
+        formatter.time_mode = "utc"
+        self.assertEqual(
+            formatter._format((message, {}))[1]["log_time"], "2023-11-28T15:23:00.123Z"
+        )
+        formatter.time_mode = "epoch"
+        self.assertEqual(formatter._format((message, {}))[1]["log_time"], "1701184980.123")
+        formatter.msec_time_format = ""
+        self.assertEqual(formatter._format((message, {}))[1]["log_time"], "1701184980")
+
+    def test_custom_level(self):
+        formatter = MainFormatter()
+        for level, higher, lower in (
+            (3, " TRACE", "NOTSET"),
+            (25, " WARN ", " INFO "),
+            (60, "FATAL ", "FATAL "),
+        ):
+            formatter.level_get_higher = True
+            self.assertEqual(formatter.level_tag(level), higher)
+            formatter.level_get_higher = False
+            self.assertEqual(formatter.level_tag(level), lower)
+
+    def test_color_for_level(self):
+        formatter = LevelColorFormatter()
+        self.assertEqual(formatter.color_for_level(25), formatter.color[LogLevel.warn])
+        self.assertEqual(formatter.color_for_level(60), formatter.color[LogLevel.fatal])
+
+    def test_format_bytes(self):
+        """
+        format_bytes 和 format_message 编码之后的结果一致
+        """
+        message = LogMessage(
+            messages=["ü", "世界"],
+            logger_tag="tag",
+            stack_trace=FrameInfo.from_frame(inspect.currentframe()),
+        )
+        formatters = [
+            StdFormatter(),
+            StdFormatter(enable_color=False),
+            StdFormatter(default_template="${log_source}:${log_line}|${unknown}|${messages}"),
+            JsonFormatter(serializer="json"),
+            JsonFormatter(ensure_ascii=True),
+        ]
+        custom = StdFormatter(enable_color=False)
+        custom.sub_formatter = [MainFormatter(), BaseFormatter()]
+        formatters.append(custom)
+        if orjson is not None:
+            formatters.append(JsonFormatter(serializer="orjson"))
+        for formatter in formatters:
+            text = formatter.format_message(message)
+            self.assertEqual(formatter.format_bytes(message), text.encode("utf-8"))
+            self.assertEqual(
+                formatter.format_bytes(message, "ascii", "replace"),
+                text.encode("ascii", "replace"),
+            )
+        # 模板变化之后重新生成
+        formatter = StdFormatter(enable_color=False)
+        formatter.format_bytes(message)
+        formatter.template = "${messages}"
+        self.assertEqual(formatter.format_bytes(message), "ü 世界\n".encode("utf-8"))
+
+
+class JsonFormatterTest(unittest.TestCase):
+    def check_serializer(self, serializer: str) -> None:
+        formatter = JsonFormatter(serializer=serializer, time_mode="epoch")
+        message = LogMessage(
+            messages=['say "hi"\n\x01', "ü"],
+            level=45,
+            log_time=1700000000123456789,
+            logger_name="json",
+            stack_trace=FrameInfo.from_frame(inspect.currentframe()),
+        )
+        text = formatter.format_message(message)
+        self.assertTrue(text.endswith("}\n"))
+        self.assertEqual(text.count("\n"), 1)
+        # 只转义需要转义的字符
+        self.assertIn("ü", text)
+        self.assertEqual(
+            json.loads(text),
+            {
+                "time": "1700000000.123",
+                "level": 45,
+                "level_name": "FATAL",
+                "logger": "json",
+                "tag": None,
+                "message": 'say "hi"\n\x01 ü',
+                "source": __file__,
+                "line": message.stack_trace.f_lineno,
+                "function": "check_serializer",
+            },
+        )
+        # 没有堆栈信息的时候省略堆栈相关的字段
+        message.stack_trace = None
+        message.logger_tag = "tag"
+        data = json.loads(formatter.format_message(message))
+        self.assertNotIn("source", data)
+        self.assertEqual(data["tag"], "tag")
+
+    def test_json(self):
+        self.check_serializer("json")
+
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_orjson(self):
+        self.check_serializer("orjson")
+
+    def test_fields(self):
+        formatter = JsonFormatter(fields=["line", "level"], serializer="json")
+        self.assertTrue(formatter.need_stack_trace)
+        self.assertEqual(formatter.format_message(LogMessage()), '{"level":20}\n')
+        formatter = JsonFormatter(fields=["message"], ensure_ascii=True)
+        self.assertFalse(formatter.need_stack_trace)
+        message = LogMessage(messages=["ü"])
+        self.assertEqual(formatter.format_message(message), '{"message":"\\u00fc"}\n')
+        with self.assertRaises(ValueError):
+            JsonFormatter(fields=["unknown"])
+
+    def test_config(self):
+        storage = ConfigStorage(formatters={}, fail_formatters={})
+        storage.parse_formatter({"json": {"class": "JsonFormatter", "fields": ["level"]}})
+        self.assertIsInstance(storage.formatters["json"], JsonFormatter)
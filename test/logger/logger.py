@@ -0,0 +1,208 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+import unittest
+
+from typing import List
+
+from lib_not_dr.loggers.logger import Logger
+from lib_not_dr.loggers.timing import StageTimer
+from lib_not_dr.loggers.structure import LogMessage
+from lib_not_dr.loggers.formatter import StdFormatter
+from lib_not_dr.loggers.outstream import BaseOutputStream
+
+
+class RecordOutputStream(BaseOutputStream):
+    name = "RecordOutputStream"
+
+    level: int = 0
+    formatter: StdFormatter
+
+    def init(self, **kwargs) -> bool:
+        self.records: List[LogMessage] = []
+        if "formatter" not in kwargs:
+            self.formatter = StdFormatter(enable_color=False)
+        return False
+
+    def write_stdout(self, message: LogMessage) -> None:
+        if message.level >= self.level:
+            self.records.append(message)
+
+    def write_stderr(self, message: LogMessage) -> None:
+        self.write_stdout(message)
+
+    def flush(self) -> None:
+        pass
+
+
+class LoggerTest(unittest.TestCase):
+    def test_skip_stack_trace(self):
+        """
+        模板里没有用到堆栈信息的时候不应该去获取
+        """
+        output = RecordOutputStream()
+        logger = Logger(outputs=[output], level=0)
+        logger.info("no trace")
+        self.assertIsNone(output.records[-1].stack_trace)
+
+        output.formatter.template = "${log_source}:${log_line}|${messages}"
+        logger.info("with trace")
+        self.assertIsNotNone(output.records[-1].stack_trace)
+        self.assertEqual(output.records[-1].stack_trace.f_code.co_name, "test_skip_stack_trace")
+
+    def test_stack_trace_by_level(self):
+        """
+        只有需要堆栈信息的 output 会接收这个等级的时候才获取
+        """
+        plain = RecordOutputStream(level=0)
+        traced = RecordOutputStream(level=30)
+        traced.formatter.template = "${log_function}|${messages}"
+        logger = Logger(outputs=[plain, traced], level=0)
+        logger.info("info")
+        self.assertIsNone(plain.records[-1].stack_trace)
+        logger.warn("warn")
+        self.assertIsNotNone(plain.records[-1].stack_trace)
+        self.assertIs(traced.records[-1], plain.records[-1])
+
+    def test_lazy_arguments(self):
+        output = RecordOutputStream()
+        logger = Logger(outputs=[output], level=20)
+        called = []
+
+        def expensive() -> int:
+            called.append(1)
+            return 42
+
+        logger.debug("{}", expensive, style="{")
+        self.assertEqual(called, [])
+        logger.info("answer: %d", expensive, style="%")
+        self.assertEqual(called, [])
+        self.assertEqual(output.records[-1].format_message(), "answer: 42\n")
+        self.assertEqual(called, [1])
+
+    def test_route_outputs_mutated(self):
+        """
+        直接修改 outputs 列表之后路由表也要重建
+        """
+        first = RecordOutputStream()
+        second = RecordOutputStream()
+        third = RecordOutputStream()
+        logger = Logger(outputs=[first], level=0)
+        logger.info("one")
+        logger.outputs.append(second)
+        logger.info("two")
+        self.assertEqual([len(first.records), len(second.records)], [2, 1])
+        logger.outputs.remove(first)
+        logger.info("three")
+        self.assertEqual([len(first.records), len(second.records)], [2, 2])
+        logger.outputs[0] = third
+        logger.info("four")
+        self.assertEqual([len(second.records), len(third.records)], [2, 1])
+
+    def test_route_table(self):
+        """
+        消息只会发给会接收这个等级的 output
+        """
+        low = RecordOutputStream(level=0)
+        high = RecordOutputStream(level=40)
+        logger = Logger(outputs=[low], level=0)
+        logger.add_output(high)
+        self.assertEqual(len(logger.route(20)[0]), 1)
+        self.assertEqual(len(logger.route(40)[0]), 2)
+
+        logger.info("info")
+        logger.error("error")
+        self.assertEqual(len(low.records), 2)
+        self.assertEqual(len(high.records), 1)
+
+        # 修改 output 的等级之后路由表要重建
+        high.level = 0
+        logger.info("info")
+        self.assertEqual(len(high.records), 2)
+        logger.global_level = 30
+        logger.info("info")
+        self.assertEqual(len(low.records), 3)
+        self.assertEqual(logger.route(20)[0], ())
+
+        logger.remove_output(high)
+        self.assertEqual(len(logger.route(30)[0]), 1)
+        high.enable = False
+        logger.add_output(high)
+        self.assertEqual(len(logger.route(30)[0]), 1)
+
+    def test_stderr_level(self):
+        stdout: List[int] = []
+        stderr: List[int] = []
+        output = RecordOutputStream(level=0)
+        output.write_stdout = lambda message: stdout.append(message.level)
+        output.write_stderr = lambda message: stderr.append(message.level)
+        logger = Logger(outputs=[output], level=0)
+        logger.info("info")
+        logger.warn("warn")
+        logger.stderr_level = 40
+        logger.warn("warn")
+        logger.error("error")
+        self.assertEqual(stdout, [20, 30])
+        self.assertEqual(stderr, [30, 40])
+
+    def test_timing(self):
+        output = RecordOutputStream()
+        output.formatter = StdFormatter(default_template="${log_function}|${level}|${messages}")
+        logger = Logger(outputs=[output], level=0)
+        timer = logger.enable_timing(StageTimer(), stages=True)
+        self.assertIn("make_log", logger.__dict__)
+        logger.info("a")
+        logger.debug("b")
+        # 计时的版本获取的堆栈信息也是调用者的
+        self.assertEqual(output.records[-1].stack_trace.f_code.co_name, "test_timing")
+        timed_text = output.formatter.format_message(output.records[0])
+
+        snapshot = logger.timing_snapshot()
+        self.assertEqual(snapshot["logger.make_log"]["calls"], 2)
+        self.assertEqual(snapshot["logger.stack_trace"]["calls"], 2)
+        self.assertEqual(snapshot["output.RecordOutputStream.write_stdout"]["calls"], 2)
+        self.assertNotIn("logger.rate_limit", snapshot)
+        for stage in ("formatter.MainFormatter", "formatter.color.LevelColorFormatter",
+                      "formatter.template"):
+            self.assertEqual(snapshot[stage]["calls"], 1)
+
+        # 关闭之后换回原来的方法, 结果和计时的版本一样
+        logger.disable_timing()
+        self.assertNotIn("make_log", logger.__dict__)
+        self.assertNotIn("write_stdout", output.__dict__)
+        self.assertNotIn("format_message", output.formatter.__dict__)
+        self.assertEqual(output.formatter.format_message(output.records[0]), timed_text)
+        self.assertEqual(logger.timing_snapshot(), {})
+        logger.info("c")
+        self.assertEqual(timer.snapshot()["logger.make_log"]["calls"], 2)
+        timer.reset()
+        self.assertEqual(timer.snapshot(), {})
+
+        # 默认计时的是实际使用的融合的渲染函数整体
+        logger.enable_timing(timer)
+        self.assertEqual(output.formatter.format_message(output.records[0]), timed_text)
+        snapshot = timer.snapshot()
+        self.assertEqual(snapshot["formatter.format_message"]["calls"], 1)
+        self.assertNotIn("formatter.template", snapshot)
+        logger.disable_timing()
+
+    def test_timing_shared_formatter(self):
+        """
+        计时一个 output 不会影响共用同一个 formatter 的其他 output
+        """
+        formatter = StdFormatter()
+        timed_output = RecordOutputStream(formatter=formatter)
+        other = RecordOutputStream(formatter=formatter)
+        timer = timed_output.enable_timing(StageTimer())
+        self.assertIsNot(timed_output.formatter, formatter)
+        self.assertNotIn("format_message", formatter.__dict__)
+        message = LogMessage(messages=["a"])
+        text = other.formatter.format_message(message)
+        self.assertEqual(timer.snapshot(), {})
+        self.assertEqual(timed_output.formatter.format_message(message), text)
+        self.assertEqual(timer.snapshot()["formatter.format_message"]["calls"], 1)
+        timed_output.disable_timing()
+        self.assertIs(timed_output.formatter, formatter)
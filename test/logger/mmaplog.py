@@ -0,0 +1,86 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from lib_not_dr.loggers.structure import LogMessage
+from lib_not_dr.loggers.formatter import StdFormatter
+from lib_not_dr.loggers.mmaplog import MmapOutputStream, MmapLogReader
+
+
+class MmapLogTest(unittest.TestCase):
+    def make_stream(self, log_dir: str, **options) -> MmapOutputStream:
+        formatter = StdFormatter(enable_color=False)
+        formatter.template = "${messages}"
+        output = MmapOutputStream(
+            file_path=Path(log_dir), file_name="test.lndm", formatter=formatter, **options
+        )
+        self.addCleanup(output.close)
+        return output
+
+    def test_wrap_around(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            output = self.make_stream(log_dir, file_size=1024, level=0)
+            for i in range(200):
+                output.write_stdout(LogMessage(messages=[f"message {i}"], level=20))
+            self.assertGreater(output.wrap_count, 0)
+            output.flush()
+            reader = MmapLogReader(Path(log_dir) / "test.lndm")
+            texts = list(reader)
+            self.assertEqual(reader.wrap_count, output.wrap_count)
+        # 最新的消息都在, 并且按照写入的顺序
+        self.assertEqual(texts[-1], "message 199\n")
+        numbers = [int(text.split()[1]) for text in texts]
+        self.assertEqual(numbers, list(range(200 - len(numbers), 200)))
+        self.assertGreater(len(numbers), 10)
+
+    def test_wrap_stale_records(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            file = Path(log_dir) / "test.lndm"
+            output = self.make_stream(log_dir, file_size=1024, level=0)
+            for i in range(300):
+                # 长度不一样的消息, 绕回的时候上一圈末尾会留下没被覆盖的旧记录
+                output.write_stdout(LogMessage(messages=[f"message {i}", "x" * (i * 37 % 300)]))
+                if i % 3 == 0:
+                    numbers = [int(text.split()[1]) for text in MmapLogReader(file)]
+                    self.assertEqual(numbers, list(range(i + 1 - len(numbers), i + 1)))
+            output.close()
+            # 重新打开之后接着写
+            output = self.make_stream(log_dir)
+            for i in range(300, 320):
+                output.write_stdout(LogMessage(messages=[f"message {i}"]))
+            output.flush()
+            numbers = [int(text.split()[1]) for text in MmapLogReader(file)]
+        self.assertEqual(numbers, list(range(320 - len(numbers), 320)))
+
+    def test_crash_recovery(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            output = self.make_stream(log_dir, file_size=1024)
+            for i in range(50):
+                output.write_stdout(LogMessage(messages=[f"message {i}"]))
+            output.close()
+            # 模拟崩溃: header 里的写入位置没写回, 最后一条记录只写了一半
+            file = Path(log_dir) / "test.lndm"
+            data = bytearray(file.read_bytes())
+            data[24:40] = bytes(16)
+            last = data.rfind(b"message 49")
+            data[last + 8 : last + 10] = b"\0\0"
+            file.write_bytes(bytes(data))
+
+            texts = list(MmapLogReader(file))
+            self.assertEqual(texts[-1], "message 48\n")
+
+            # 重新打开之后接着最后一条完整的记录写
+            output = self.make_stream(log_dir)
+            output.write_stdout(LogMessage(messages=["after crash"]))
+            output.flush()
+            texts = list(MmapLogReader(file))
+        self.assertEqual(texts[-2:], ["message 48\n", "after crash\n"])
+        numbers = [int(text.split()[1]) for text in texts[:-1]]
+        self.assertEqual(numbers, list(range(49 - len(numbers), 49)))
@@ -0,0 +1,79 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+import unittest
+import multiprocessing
+
+from typing import List
+
+from lib_not_dr.loggers.logger import Logger
+from lib_not_dr.loggers.structure import LogMessage
+from lib_not_dr.loggers.formatter import StdFormatter
+from lib_not_dr.loggers.outstream import BaseOutputStream
+from lib_not_dr.loggers.multiprocess import LogAggregator, ProcessOutputStream
+
+
+class LineOutputStream(BaseOutputStream):
+    name = "LineOutputStream"
+
+    level: int = 0
+    formatter: StdFormatter = StdFormatter(
+        enable_color=False, default_template="${logger_name}|${log_function}|${messages}"
+    )
+
+    def init(self, **kwargs) -> bool:
+        self.lines: List[str] = []
+        return False
+
+    def write_stdout(self, message: LogMessage) -> None:
+        self.lines.append(self.formatter.format_message(message))
+
+    def write_stderr(self, message: LogMessage) -> None:
+        self.write_stdout(message)
+
+    def flush(self) -> None:
+        pass
+
+
+def worker(output: ProcessOutputStream, index: int) -> None:
+    logger = Logger(outputs=[output], level=0, logger_name=f"worker-{index}")
+    for i in range(200):
+        logger.info(i)
+    logger.warn("done")
+
+
+@unittest.skipUnless(
+    "fork" in multiprocessing.get_all_start_methods(), "need fork start method"
+)
+class LogAggregatorTest(unittest.TestCase):
+    def test_record_round_trip(self):
+        message = LogMessage(messages=["a", 1], logger_tag="tag", level=30)
+        rebuilt = LogMessage.from_record(message.to_record())
+        self.assertEqual(rebuilt.format_message(), message.format_message())
+        self.assertEqual(rebuilt.logger_tag, "tag")
+        self.assertEqual(rebuilt.level, 30)
+
+    def test_aggregate(self):
+        context = multiprocessing.get_context("fork")
+        output = LineOutputStream()
+        aggregator = LogAggregator(outputs=[output], record_queue=context.Queue())
+        with aggregator:
+            child_output = aggregator.make_output()
+            self.assertTrue(child_output.need_stack_trace)
+            processes = [
+                context.Process(target=worker, args=(child_output, index)) for index in range(4)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        self.assertEqual(len(output.lines), 4 * 201)
+        self.assertEqual(aggregator.record_count, 4 * 201)
+        for index in range(4):
+            lines = [line for line in output.lines if line.startswith(f"worker-{index}|")]
+            expect = [f"worker-{index}|worker|{i}\n" for i in range(200)]
+            expect.append(f"worker-{index}|worker|done\n")
+            self.assertEqual(lines, expect)
@@ -0,0 +1,546 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+import gc
+import io
+import os
+import sys
+import time
+import inspect
+import tempfile
+import asyncio
+import weakref
+import threading
+import unittest
+import multiprocessing
+
+from typing import List
+from pathlib import Path
+from unittest import mock
+
+from lib_not_dr.loggers.logger import Logger, AsyncLogger
+from lib_not_dr.loggers.structure import LogMessage, FrameInfo
+from lib_not_dr.loggers.formatter import StdFormatter
+from lib_not_dr.loggers import outstream
+from lib_not_dr.loggers.outstream import (
+    BaseOutputStream,
+    QueueOutputStream,
+    AsyncOutputStream,
+    RingBufferOutputStream,
+    DedupOutputStream,
+    StdioOutputStream,
+    FileCacheOutputStream,
+)
+
+
+class RecordOutputStream(BaseOutputStream):
+    name = "RecordOutputStream"
+
+    level: int = 0
+    formatter: StdFormatter = StdFormatter(enable_color=False)
+
+    def init(self, **kwargs) -> bool:
+        self.records: List[LogMessage] = []
+        self.lines: List[str] = []
+        # 用于模拟很慢的输出
+        self.gate = threading.Event()
+        self.gate.set()
+        self.flushed = 0
+        return False
+
+    def write_stdout(self, message: LogMessage) -> None:
+        self.gate.wait()
+        if message.level >= self.level:
+            self.records.append(message)
+            self.lines.append(self.formatter.format_message(message))
+
+    def write_stderr(self, message: LogMessage) -> None:
+        self.write_stdout(message)
+
+    def flush(self) -> None:
+        self.flushed += 1
+
+
+class QueueOutputStreamTest(unittest.TestCase):
+    def test_write_in_order(self):
+        output = RecordOutputStream()
+        stream = QueueOutputStream(output=output, level=0)
+        for i in range(1000):
+            stream.write_stdout(LogMessage(messages=[i], level=20))
+        stream.close()
+        self.assertEqual([m.messages[0] for m in output.records], list(range(1000)))
+        self.assertEqual(stream.dropped_count, 0)
+        self.assertFalse(stream.worker.is_alive())
+
+    def test_drop_newest(self):
+        output = RecordOutputStream()
+        output.gate.clear()
+        stream = QueueOutputStream(output=output, queue_size=10, overflow_policy="drop_newest")
+        for i in range(100):
+            stream.write_stdout(LogMessage(messages=[i]))
+        output.gate.set()
+        stream.close()
+        # 最多 10 个在队列里, 1 个在 worker 手上
+        self.assertLessEqual(len(output.records), 11)
+        self.assertEqual(stream.dropped_count + len(output.records), 100)
+
+    def test_drop_below_level(self):
+        output = RecordOutputStream()
+        output.gate.clear()
+        stream = QueueOutputStream(
+            output=output, level=0, queue_size=5, overflow_policy="drop_below_level"
+        )
+        for i in range(50):
+            stream.write_stdout(LogMessage(messages=[i], level=10))
+        threading.Timer(0.1, output.gate.set).start()
+        # 队列满了, 但是 warn 会等待
+        stream.write_stderr(LogMessage(messages=["warn"], level=30))
+        stream.close()
+        self.assertEqual(output.records[-1].messages, ["warn"])
+        self.assertEqual(stream.dropped_count + len(output.records), 51)
+
+    def test_shed(self):
+        output = RecordOutputStream()
+        output.gate.clear()
+        stream = QueueOutputStream(output=output, level=0, queue_size=5, overflow_policy="shed")
+        for i in range(20):
+            stream.write_stdout(LogMessage(messages=[i], level=20))
+        self.assertGreater(stream.effective_level, 20)
+        output.gate.set()
+        stream.flush()
+        self.assertEqual(stream.effective_level, 0)
+        self.assertGreater(output.flushed, 0)
+        stream.close()
+        self.assertEqual(stream.dropped_count + len(output.records), 20)
+
+
+    def test_stack_trace(self):
+        output = RecordOutputStream(
+            formatter=StdFormatter(enable_color=False, default_template="${log_line}|${messages}")
+        )
+        output.gate.clear()
+        stream = QueueOutputStream(output=output, level=0)
+        logger = Logger(logger_name="queue", outputs=[stream], level=0)
+        logger.info("queued")
+        expected = inspect.currentframe().f_lineno - 1
+        # 后台线程格式化的时候这个 frame 已经执行到别的地方了
+        for _ in range(3):
+            pass
+        output.gate.set()
+        stream.close()
+        self.assertIsInstance(output.records[0].stack_trace, FrameInfo)
+        self.assertEqual(output.lines[0], f"{expected}|queued\n")
+
+
+class AsyncOutputStreamTest(unittest.TestCase):
+    def test_blocking_policy(self):
+        with self.assertRaises(ValueError):
+            AsyncOutputStream(output=RecordOutputStream(), overflow_policy="block")
+
+    def test_async_logger(self):
+        output = RecordOutputStream()
+
+        async def main() -> None:
+            logger = AsyncLogger(outputs=[output], level=0)
+            self.assertIsInstance(logger.outputs[0], AsyncOutputStream)
+            output.gate.clear()
+            for i in range(100):
+                logger.info(i)
+            # 输出被卡住的时候 log 也不会阻塞
+            self.assertEqual(output.records, [])
+            output.gate.set()
+            await logger.aflush()
+            self.assertEqual(len(output.records), 100)
+            self.assertGreater(output.flushed, 0)
+            await logger.aclose()
+            self.assertFalse(logger.outputs[0].enable)
+
+        asyncio.run(main())
+
+    def test_default_output(self):
+        async def main() -> None:
+            logger = AsyncLogger()
+            self.assertIsNot(logger.outputs[0].output, Logger.outputs[0])
+            await logger.aclose()
+
+        asyncio.run(main())
+        # 普通的 Logger 用的默认输出不能被关掉
+        self.assertTrue(Logger.outputs[0].enable)
+
+
+class RingBufferOutputStreamTest(unittest.TestCase):
+    def test_trigger(self):
+        output = RecordOutputStream()
+        stream = RingBufferOutputStream(output=output, buffer_size=5, dump_on_exception=False)
+        for i in range(20):
+            stream.write_stdout(LogMessage(messages=[i], level=10, logger_name="a"))
+            stream.write_stdout(LogMessage(messages=[i], level=10, logger_name="b"))
+        self.assertEqual(output.records, [])
+        stream.write_stderr(LogMessage(messages=["error"], level=40, logger_name="a"))
+        self.assertEqual(
+            [m.messages[0] for m in output.records], [15, 16, 17, 18, 19, "error"]
+        )
+        self.assertTrue(all(m.logger_name == "a" for m in output.records))
+        output.records.clear()
+        stream.dump()
+        self.assertEqual([m.messages[0] for m in output.records], [15, 16, 17, 18, 19])
+
+    def test_formatted_only_when_dumped(self):
+        class Lazy:
+            formatted = 0
+
+            def __str__(self) -> str:
+                Lazy.formatted += 1
+                return "lazy"
+
+        output = RecordOutputStream()
+        stream = RingBufferOutputStream(output=output, dump_on_exception=False)
+        for _ in range(10):
+            stream.write_stdout(LogMessage(messages=[Lazy()], level=10))
+        self.assertEqual(Lazy.formatted, 0)
+        stream.dump()
+        self.assertEqual(Lazy.formatted, 10)
+
+    def test_default_output(self):
+        stream = RingBufferOutputStream(dump_on_exception=False)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch("sys.stdout", stdout), mock.patch("sys.stderr", stderr):
+            stream.write_stdout(LogMessage(messages=["debug history"], level=10))
+            stream.write_stdout(LogMessage(messages=["info"], level=20))
+            stream.write_stderr(LogMessage(messages=["error"], level=40))
+        # dump 的时候缓存的 debug 消息也要写出来
+        self.assertIn("debug history", stdout.getvalue())
+        self.assertIn("info", stdout.getvalue())
+        self.assertIn("error", stderr.getvalue())
+
+    def test_excepthook(self):
+        first = RecordOutputStream()
+        stream = RingBufferOutputStream(output=first)
+        hook = sys.excepthook
+        second = RecordOutputStream()
+        closed = RingBufferOutputStream(output=second)
+        # 只安装一次
+        self.assertIs(sys.excepthook, hook)
+        for output in (stream, closed):
+            output.write_stdout(LogMessage(messages=["buffered"], level=10))
+        closed.close()
+        outstream.exception_dumper.dump()
+        self.assertEqual(len(first.records), 1)
+        self.assertEqual(second.records, [])
+        # 没有 close 的 output 也不会被 hook 拿着
+        collected = weakref.ref(stream)
+        del stream
+        gc.collect()
+        self.assertIsNone(collected())
+
+
+class DedupOutputStreamTest(unittest.TestCase):
+    def test_collapse(self):
+        output = RecordOutputStream()
+        stream = DedupOutputStream(output=output, timeout=0)
+        for _ in range(100):
+            stream.write_stdout(LogMessage(messages=["retry", 1], level=20))
+        stream.write_stdout(LogMessage(messages=["retry", 2], level=20))
+        stream.write_stdout(LogMessage(messages=["retry", 2], level=30))
+        stream.write_stdout(LogMessage(messages=["retry", 2], level=30))
+        stream.flush()
+        self.assertEqual(
+            [m.format_text() for m in output.records],
+            [
+                "retry 1",
+                "last message repeated 99 times",
+                "retry 2",
+                "retry 2",
+                "last message repeated 1 times",
+            ],
+        )
+        self.assertEqual(output.records[-1].level, 30)
+
+    def test_not_formatted(self):
+        class Counted:
+            count = 0
+
+            def __str__(self):
+                Counted.count += 1
+                return "counted"
+
+        output = RecordOutputStream()
+        stream = DedupOutputStream(output=output, timeout=0)
+        counted = Counted()
+        for _ in range(10):
+            stream.write_stdout(LogMessage(messages=[counted], level=20))
+        self.assertEqual(Counted.count, 1)
+
+    def test_timeout(self):
+        output = RecordOutputStream()
+        stream = DedupOutputStream(output=output, timeout=0.05)
+        for _ in range(3):
+            stream.write_stdout(LogMessage(messages=["same"], level=20))
+        time.sleep(0.2)
+        self.assertEqual(
+            [m.format_text() for m in output.records],
+            ["same", "last message repeated 2 times"],
+        )
+        stream.close()
+
+
+class BufferedStdioOutputStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+        self.out_bytes, self.err_bytes = io.BytesIO(), io.BytesIO()
+        sys.stdout = io.TextIOWrapper(self.out_bytes, encoding="utf-8")
+        sys.stderr = io.TextIOWrapper(self.err_bytes, encoding="utf-8")
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+
+    def make_stream(self, **kwargs) -> StdioOutputStream:
+        return StdioOutputStream(
+            formatter=StdFormatter(enable_color=False, default_template="${messages}"),
+            buffered=True,
+            level=0,
+            **kwargs,
+        )
+
+    def test_coalesce(self):
+        stream = self.make_stream(buffer_time=0, buffer_size=20)
+        stream.write_stdout(LogMessage(messages=["ü"], level=20))
+        stream.write_stdout(LogMessage(messages=["b"], level=20))
+        self.assertEqual(self.out_bytes.getvalue(), b"")
+        # 超过 buffer_size
+        stream.write_stdout(LogMessage(messages=["c" * 20], level=20))
+        self.assertEqual(self.out_bytes.getvalue(), "ü\nb\n".encode() + b"c" * 20 + b"\n")
+        # flush=True / error 立刻写入
+        stream.write_stdout(LogMessage(messages=["d"], level=20, flush=True))
+        stream.write_stderr(LogMessage(messages=["e"], level=40))
+        self.assertTrue(self.out_bytes.getvalue().endswith(b"d\n"))
+        self.assertEqual(self.err_bytes.getvalue(), b"e\n")
+        stream.close()
+
+    def test_order(self):
+        stream = self.make_stream(buffer_time=0)
+        order = []
+        self.out_bytes.write = lambda data: data and order.append(("out", bytes(data)))
+        self.err_bytes.write = lambda data: data and order.append(("err", bytes(data)))
+        stream.write_stdout(LogMessage(messages=["1"], level=20))
+        stream.write_stderr(LogMessage(messages=["2"], level=30))
+        stream.write_stdout(LogMessage(messages=["3"], level=20))
+        stream.flush()
+        self.assertEqual(order, [("out", b"1\n"), ("err", b"2\n"), ("out", b"3\n")])
+        stream.close()
+
+    def test_buffer_time(self):
+        stream = self.make_stream(buffer_time=0.05)
+        stream.write_stdout(LogMessage(messages=["late"], level=20))
+        self.assertEqual(self.out_bytes.getvalue(), b"")
+        deadline = time.monotonic() + 2
+        while not self.out_bytes.getvalue() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.out_bytes.getvalue(), b"late\n")
+        stream.close()
+
+
+def shared_file_worker(path: Path, index: int, count: int) -> None:
+    stream = FileCacheOutputStream(
+        formatter=StdFormatter(enable_color=False, default_template="${messages}"),
+        file_path=path,
+        file_name="test.log",
+        flush_count_limit=7,
+        flush_time_limit=0,
+        multi_process=True,
+        rotation=[{"class": "SizeRotation", "max_size": 16 * 1024}],
+    )
+    for i in range(count):
+        stream.write_stdout(LogMessage(messages=[f"{index}-{i}", "x" * (i % 50)]))
+    stream.close()
+
+
+class FileCacheOutputStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_stream(self, **kwargs) -> FileCacheOutputStream:
+        options = {"flush_time_limit": 0, "flush_count_limit": 1}
+        options.update(kwargs)
+        stream = FileCacheOutputStream(
+            formatter=StdFormatter(enable_color=False, default_template="${messages}"),
+            file_path=self.path,
+            file_name="test.log",
+            **options,
+        )
+        self.addCleanup(stream.close)
+        return stream
+
+    def test_keep_file_open(self):
+        stream = self.make_stream()
+        stream.write_stdout(LogMessage(messages=["a"]))
+        file = stream._file
+        stream.write_stdout(LogMessage(messages=["b"]))
+        self.assertIs(stream._file, file)
+        self.assertEqual(stream._file_size, 4)
+        self.assertEqual((self.path / "test.log").read_text(), "a\nb\n")
+
+    def test_batched_write(self):
+        stream = self.make_stream(flush_count_limit=100, file_encoding="gbk")
+        for i in range(10):
+            stream.write_stdout(LogMessage(messages=[f"{i} 世界"]))
+        self.assertFalse((self.path / "test.log").exists())
+        stream.flush()
+        expected = "".join(f"{i} 世界\n" for i in range(10)).encode("gbk")
+        self.assertEqual((self.path / "test.log").read_bytes(), expected)
+        self.assertEqual(stream._file_size, len(expected))
+        stream.close()
+        # close 之后的消息被丢弃
+        stream.write_stdout(LogMessage(messages=["closed"]))
+        stream.flush()
+        self.assertEqual((self.path / "test.log").read_bytes(), expected)
+
+    def count_fsync(self) -> List[int]:
+        calls: List[int] = []
+        real_fsync = outstream._fsync
+
+        def fsync(fd: int) -> None:
+            calls.append(fd)
+            real_fsync(fd)
+
+        patcher = mock.patch.object(outstream, "_fsync", fsync)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return calls
+
+    def test_durable_level(self):
+        calls = self.count_fsync()
+        stream = self.make_stream(flush_count_limit=100, durable_level=40)
+        stream.write_stdout(LogMessage(messages=["info"], level=20))
+        self.assertFalse((self.path / "test.log").exists())
+        # error 返回之前, 之前的消息也一起写入并 fsync 了
+        stream.write_stdout(LogMessage(messages=["error"], level=40))
+        self.assertEqual((self.path / "test.log").read_text(), "info\nerror\n")
+        self.assertEqual(len(calls), 1)
+        stream.write_stdout(LogMessage(messages=["info"], level=20))
+        stream.flush()
+        self.assertEqual(len(calls), 1)
+        with self.assertRaises(ValueError):
+            self.make_stream(durability="always")
+
+    def test_periodic_fsync(self):
+        calls = self.count_fsync()
+        stream = self.make_stream(durability="periodic", fsync_interval=3600)
+        stream.write_stdout(LogMessage(messages=["a"]))
+        self.assertEqual(calls, [])
+        stream._last_sync -= 3600
+        stream.write_stdout(LogMessage(messages=["b"]))
+        self.assertEqual(len(calls), 1)
+        stream.write_stdout(LogMessage(messages=["c"]))
+        stream.close()
+        # close 的时候剩下的也要落盘
+        self.assertEqual(len(calls), 2)
+
+    def test_group_commit(self):
+        calls = self.count_fsync()
+        stream = self.make_stream(durability="group", flush_count_limit=1000)
+        threads_count, count = 8, 100
+        lost = []
+
+        def worker(index: int) -> None:
+            for i in range(count):
+                stream.write_stdout(LogMessage(messages=[f"{index}-{i}"]))
+                # 返回的时候这条消息一定已经写入并 fsync 了
+                if f"{index}-{i}\n" not in (self.path / "test.log").read_text():
+                    lost.append((index, i))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(lost, [])
+        lines = (self.path / "test.log").read_text().splitlines()
+        self.assertEqual(len(lines), threads_count * count)
+        self.assertLessEqual(len(calls), threads_count * count)
+        self.assertEqual(stream._synced, threads_count * count)
+
+    @unittest.skipUnless(
+        "fork" in multiprocessing.get_all_start_methods(), "need fork start method"
+    )
+    def test_multi_process(self):
+        context = multiprocessing.get_context("fork")
+        workers, count = 4, 2000
+        processes = [
+            context.Process(target=shared_file_worker, args=(self.path, index, count))
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        files = [file for file in self.path.iterdir() if file.name.startswith("test.log")]
+        lines = []
+        for file in files:
+            lines.extend(file.read_text().splitlines())
+            if file.name != "test.log":
+                # 只有一个进程轮换, 不会有刚轮换过又被其他进程轮换的小文件
+                self.assertGreaterEqual(file.stat().st_size, 16 * 1024)
+        self.assertGreater(len(files), 2)
+        # 每一行都是完整的
+        expected = {
+            f"{index}-{i} {'x' * (i % 50)}".rstrip()
+            for index in range(workers)
+            for i in range(count)
+        }
+        self.assertEqual(len(lines), workers * count)
+        self.assertEqual({line.rstrip() for line in lines}, expected)
+
+    def test_reopen_after_move(self):
+        stream = self.make_stream(file_check_interval=0)
+        stream.write_stdout(LogMessage(messages=["a"]))
+        os.rename(self.path / "test.log", self.path / "test.log.1")
+        stream.write_stdout(LogMessage(messages=["b"]))
+        self.assertEqual((self.path / "test.log.1").read_text(), "a\n")
+        self.assertEqual((self.path / "test.log").read_text(), "b\n")
+        # 截断之后继续写在末尾, 大小也要跟着更新
+        os.truncate(self.path / "test.log", 0)
+        stream.write_stdout(LogMessage(messages=["c"]))
+        self.assertEqual((self.path / "test.log").read_text(), "c\n")
+        self.assertEqual(stream._file_size, 2)
+
+    def test_swap_by_size(self):
+        stream = self.make_stream(file_swap=True, file_size_limit=1)
+        for i in range(3):
+            stream.write_stdout(LogMessage(messages=[str(i) * 1024]))
+        names = sorted(file.name for file in self.path.iterdir())
+        self.assertEqual(names, ["test.log-0.log", "test.log-1.log", "test.log-2.log"])
+
+    def test_threaded_stress(self):
+        """
+        多个线程同时写入, 同时还有定时 flush, 不能丢失或者打断任何一行
+        """
+        stream = self.make_stream(flush_count_limit=7, flush_time_limit=0.001)
+        threads_count, count = 8, 3000
+
+        def worker(index: int) -> None:
+            for i in range(count):
+                stream.write_stdout(LogMessage(messages=[f"{index}-{i}"]))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stream.close()
+        lines = (self.path / "test.log").read_text().splitlines()
+        self.assertEqual(len(lines), threads_count * count)
+        self.assertEqual(
+            set(lines), {f"{t}-{i}" for t in range(threads_count) for i in range(count)}
+        )
+        # 同一个线程的消息保持顺序
+        for index in range(threads_count):
+            own = [line for line in lines if line.startswith(f"{index}-")]
+            self.assertEqual(own, [f"{index}-{i}" for i in range(count)])
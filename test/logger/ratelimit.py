@@ -0,0 +1,122 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+import time
+import unittest
+
+from typing import List
+
+from lib_not_dr.loggers.logger import Logger
+from lib_not_dr.loggers.config import ConfigStorage
+from lib_not_dr.loggers.structure import LogMessage
+from lib_not_dr.loggers.formatter import StdFormatter
+from lib_not_dr.loggers.outstream import BaseOutputStream
+from lib_not_dr.loggers.ratelimit import RateLimitRule, RateLimiter
+
+
+class RecordOutputStream(BaseOutputStream):
+    name = "RecordOutputStream"
+
+    level: int = 0
+    formatter: StdFormatter
+
+    def init(self, **kwargs) -> bool:
+        self.records: List[LogMessage] = []
+        self.formatter = StdFormatter(enable_color=False)
+        return False
+
+    def write_stdout(self, message: LogMessage) -> None:
+        self.records.append(message)
+
+    def write_stderr(self, message: LogMessage) -> None:
+        self.records.append(message)
+
+    def flush(self) -> None:
+        pass
+
+
+class RateLimitTest(unittest.TestCase):
+    def test_first_n(self):
+        output = RecordOutputStream()
+        limiter = RateLimiter(rules=[RateLimitRule(first=2)], summary_interval=0)
+        logger = Logger(outputs=[output], level=0, rate_limit=limiter)
+        for i in range(5):
+            logger.warn("hot", i)
+        for i in range(5):
+            logger.warn("other", i)
+        # 每个调用点单独计数
+        self.assertEqual(
+            [record.format_text() for record in output.records],
+            ["hot 0", "hot 1", "other 0", "other 1"],
+        )
+        summary = limiter.summary()
+        self.assertIn("suppressed 6 messages", summary)
+        self.assertIsNone(limiter.summary())
+
+    def test_every_and_tag(self):
+        output = RecordOutputStream()
+        limiter = RateLimiter(
+            rules=[RateLimitRule(tag="net", every=3, per_call_site=False)],
+            summary_interval=0,
+        )
+        logger = Logger(outputs=[output], level=0, rate_limit=limiter)
+        for i in range(6):
+            logger.info(i, tag="net")
+            logger.info(i)
+        self.assertEqual(
+            [record.format_text() for record in output.records if record.logger_tag == "net"],
+            ["0", "3"],
+        )
+        self.assertEqual(len(output.records), 8)
+        # 不区分调用点的时候不需要获取 frame
+        self.assertFalse(limiter.need_call_site)
+
+    def test_token_bucket(self):
+        rule = RateLimitRule(rate=1000, burst=5)
+        state = rule.new_state("test")
+        self.assertEqual(sum(rule.check(state) for _ in range(100)), 5)
+        time.sleep(0.01)
+        self.assertTrue(rule.check(state))
+
+    def test_max_level_and_summary(self):
+        output = RecordOutputStream()
+        limiter = RateLimiter(rules=[RateLimitRule(first=1)], summary_interval=0.01)
+        logger = Logger(outputs=[output], level=0, rate_limit=limiter)
+        for i in range(4):
+            if i == 3:
+                time.sleep(0.02)
+            logger.info("info")
+            logger.fatal("fatal")
+        texts = [record.format_text() for record in output.records]
+        self.assertEqual(texts.count("fatal"), 4)
+        self.assertEqual(texts.count("info"), 1)
+        # 汇总在下一条消息的时候输出
+        self.assertEqual(output.records[-2].logger_tag, "rate-limit")
+        self.assertIn("suppressed 3 messages", texts[-2])
+
+    def test_config(self):
+        storage = ConfigStorage(
+            loggers={}, formatters={}, outputs={}, rate_limits={},
+            fail_loggers={}, fail_formatters={}, fail_outputs={}, fail_rate_limits={},
+        )
+        storage.read_dict_config(
+            {
+                "RateLimit": {
+                    "once": {"first": 1},
+                    "bad": {"not_an_option": 1},
+                },
+                "Logger": {
+                    "limited": {"rate_limit": ["once"], "outputs": []},
+                    "broken": {"rate_limit": ["bad"], "outputs": []},
+                },
+            }
+        )
+        self.assertTrue(storage.have_rate_limit("once"))
+        self.assertFalse(storage.have_rate_limit("bad"))
+        self.assertTrue(storage.have_logger("limited"))
+        self.assertFalse(storage.have_logger("broken"))
+        limiter = storage.loggers["limited"].rate_limit
+        self.assertEqual(limiter.rules, [storage.rate_limits["once"]])
@@ -0,0 +1,130 @@
+#  -------------------------------
+#  Difficult Rocket
+#  Copyright © 2020-2023 by shenjackyuanjie 3695888@qq.com
+#  All rights reserved
+#  -------------------------------
+
+import os
+import gzip
+import lzma
+import time
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from lib_not_dr.loggers.structure import LogMessage
+from lib_not_dr.loggers.formatter import StdFormatter
+from lib_not_dr.loggers.outstream import FileCacheOutputStream
+from lib_not_dr.loggers.rotation import (
+    SizeRotation,
+    DailyRotation,
+    HourlyRotation,
+    IntervalRotation,
+    rotation_worker,
+    clean_rotated,
+)
+
+
+class RotationPolicyTest(unittest.TestCase):
+    def test_size(self):
+        policy = SizeRotation(max_size=10)
+        self.assertFalse(policy.should_rotate(9, 0))
+        self.assertTrue(policy.should_rotate(10, 0))
+
+    def test_interval(self):
+        policy = IntervalRotation(interval=60)
+        policy.start(1000)
+        self.assertFalse(policy.should_rotate(0, 1059))
+        self.assertTrue(policy.should_rotate(0, 1060))
+
+    def test_daily_utc(self):
+        policy = DailyRotation(hour=6, utc=True)
+        # 2023-11-14 22:13:20 UTC
+        policy.start(1700000000)
+        self.assertEqual(policy.next_rotation, 1700028000)  # 2023-11-15 06:00 UTC
+        policy.start(1700028000)
+        self.assertEqual(policy.next_rotation, 1700028000 + 86400)
+
+    def test_daily_local(self):
+        policy = DailyRotation()
+        now = time.time()
+        policy.start(now)
+        boundary = time.localtime(policy.next_rotation)
+        self.assertEqual((boundary.tm_hour, boundary.tm_min, boundary.tm_sec), (0, 0, 0))
+        self.assertTrue(0 < policy.next_rotation - now <= 25 * 3600)
+
+    def test_hourly(self):
+        policy = HourlyRotation(minute=30)
+        now = time.time()
+        policy.start(now)
+        self.assertEqual(time.localtime(policy.next_rotation).tm_min, 30)
+        self.assertTrue(0 < policy.next_rotation - now <= 3600)
+
+
+class RotationOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_stream(self, **kwargs) -> FileCacheOutputStream:
+        options = {"file_name": "test.log", "flush_time_limit": 0, "flush_count_limit": 1}
+        options.update(kwargs)
+        stream = FileCacheOutputStream(
+            formatter=StdFormatter(enable_color=False, default_template="${messages}"),
+            file_path=self.path,
+            **options,
+        )
+        self.addCleanup(stream.close)
+        return stream
+
+    def test_rotate_and_compress(self):
+        for compression, opener, suffix in (("gzip", gzip.open, ".gz"), ("lzma", lzma.open, ".xz")):
+            with self.subTest(compression=compression):
+                stream = self.make_stream(
+                    file_name=f"{compression}.log",
+                    rotation=[{"class": "SizeRotation", "max_size": 10}],
+                    compression=compression,
+                )
+                for i in range(3):
+                    stream.write_stdout(LogMessage(messages=[str(i) * 10]))
+                rotation_worker.wait()
+                rotated = sorted(self.path.glob(f"{compression}.log.*"))
+                self.assertEqual(len(rotated), 2)
+                self.assertTrue(all(file.name.endswith(suffix) for file in rotated))
+                contents = sorted(opener(file).read() for file in rotated)
+                self.assertEqual(contents, [b"0" * 10 + b"\n", b"1" * 10 + b"\n"])
+                self.assertEqual((self.path / f"{compression}.log").read_text(), "2" * 10 + "\n")
+
+    def test_retention_count(self):
+        stream = self.make_stream(rotation=[SizeRotation(max_size=1)], retention_count=2)
+        for i in range(6):
+            stream.write_stdout(LogMessage(messages=[str(i)]))
+            rotation_worker.wait()
+        rotated = list(self.path.glob("test.log.*"))
+        self.assertEqual(len(rotated), 2)
+        self.assertEqual(
+            sorted(file.read_text() for file in rotated), ["3\n", "4\n"]
+        )
+
+    def test_retention_age(self):
+        old = self.path / "test.log.old"
+        old.write_text("old")
+        os.utime(old, (time.time() - 100, time.time() - 100))
+        new = self.path / "test.log.new"
+        new.write_text("new")
+        removed = clean_rotated(self.path, "test.log.", max_age=50)
+        self.assertEqual(removed, [old])
+        self.assertTrue(new.exists())
+
+    def test_manual_rotate(self):
+        stream = self.make_stream(rotation=[IntervalRotation(interval=3600)])
+        stream.write_stdout(LogMessage(messages=["before"]))
+        stream.rotate()
+        stream.write_stdout(LogMessage(messages=["after"]))
+        rotated = list(self.path.glob("test.log.*"))
+        self.assertEqual([file.read_text() for file in rotated], ["before\n"])
+        self.assertEqual((self.path / "test.log").read_text(), "after\n")
@@ -7,7 +7,7 @@
 import time
 import unittest
 
-from lib_not_dr.loggers.structure import LogMessage
+from lib_not_dr.loggers.structure import LogMessage, lazy
 
 
 class LogMessageTest(unittest.TestCase):
@@ -69,3 +69,83 @@ class LogMessageTest(unittest.TestCase):
         message = LogMessage(log_time=start_time)
         msec_3 = int(start_time / 1000000) % 1000
         self.assertEqual(message.create_msec_3, msec_3)
+
+    def test_format_style(self):
+        """
+        测试模板格式的消息
+        """
+        message = LogMessage(messages=["{} + {} = {:.1f}", 1, 2, 3], style="{")
+        self.assertEqual(message.format_message(), "1 + 2 = 3.0\n")
+        message = LogMessage(messages=["%s + %d", "a", 2], style="%")
+        self.assertEqual(message.format_message(), "a + 2\n")
+        message = LogMessage(messages=["%(a)s", {"a": "b"}], style="%")
+        self.assertEqual(message.format_message(), "b\n")
+        # 格式化失败的时候退回到拼接
+        message = LogMessage(messages=["{} {}", 1], style="{")
+        self.assertEqual(message.format_message(), "{} {} 1\n")
+
+    def test_lazy_message(self):
+        """
+        测试延迟计算的参数只会被计算一次
+        """
+        called = []
+
+        def expensive() -> str:
+            called.append(1)
+            return "value"
+
+        message = LogMessage(messages=["{}", expensive], style="{")
+        self.assertEqual(called, [])
+        for _ in range(3):
+            self.assertEqual(message.format_message(), "value\n")
+        self.assertEqual(called, [1])
+
+        message = LogMessage(messages=["result:", lazy(expensive)])
+        for _ in range(3):
+            self.assertEqual(message.format_message(), "result: value\n")
+        self.assertEqual(called, [1, 1])
+
+    def test_callable_argument(self):
+        """
+        需要参数的函数不是延迟计算的值, 计算报错也不会让格式化报错
+        """
+
+        def handler(event):
+            return event
+
+        message = LogMessage(messages=["registered %s", handler], style="%")
+        self.assertEqual(message.format_text(), f"registered {handler}")
+
+        def broken() -> str:
+            raise RuntimeError("broken")
+
+        message = LogMessage(messages=["value: {}", broken], style="{")
+        self.assertEqual(message.format_text(), f"value: {broken!r}")
+        message = LogMessage(messages=["%d", lazy(lambda: 42)], style="%")
+        self.assertEqual(message.format_text(), "42")
+
+    def test_format_style_never_raises(self):
+        """
+        模板访问属性失败 / 参数的 __str__ 报错 都退回到拼接
+        """
+        message = LogMessage(messages=["{0.foo}", 1], style="{")
+        self.assertEqual(message.format_text(), "{0.foo} 1")
+
+        class Broken:
+            def __str__(self) -> str:
+                return str(1 / 0)
+
+        broken = Broken()
+        for template, style in (("%s", "%"), ("{}", "{")):
+            message = LogMessage(messages=[template, broken], style=style)
+            self.assertEqual(message.format_text(), f"{template} {object.__repr__(broken)}")
+
+    def test_slots(self):
+        """
+        LogMessage 不应该有 __dict__
+        """
+        message = LogMessage(messages=["test"])
+        self.assertFalse(hasattr(message, "__dict__"))
+        with self.assertRaises(AttributeError):
+            message.not_a_field = 1  # type: ignore
+        self.assertEqual(set(message.format_for_message()), set(message.option()))